@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# VCU HIL Benchmarks
+# Runs against local stand-ins, no hardware needed.
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import tracemalloc
+import serial_asyncio
+import telnetlib3
+from hilcode import telemetry
+from hilcode.micro_commander import VCUSerialDevice
+from hilcode.supply_commander import SorensenXPF6020DP
+from hilcode.supply_simulator import SimulatedSorensenServer
+from hilcode.components import HIL, VCU
+
+
+async def bench_psu_readback(args):
+    """
+    Time one PSU telemetry readback, sequential queries vs pipelined queries.
+
+    :param args: Arguments from argparse
+    """
+    server = SimulatedSorensenServer(latency=args.latency)
+    await server.start()
+    reader, writer = await telnetlib3.open_connection(server.host, server.port)
+    for pipelined in (False, True):
+        supply = SorensenXPF6020DP(pipelined=pipelined)
+        packets = server.packets_received
+        times = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            await supply._telem_readback(reader, writer)
+            times.append(time.perf_counter() - start)
+        packets = (server.packets_received - packets) / args.iterations
+        mode = 'pipelined' if pipelined else 'sequential'
+        print(f'psu_readback {mode:>10}: mean {statistics.mean(times) * 1e3:7.2f} ms  '
+              f'p95 {sorted(times)[int(len(times) * 0.95)] * 1e3:7.2f} ms  '
+              f'packets/readback {packets:.1f}')
+    writer.close()
+    await server.close()
+
+
+async def bench_psu_command(args):
+    """
+    Time from set_defaults queued to every setpoint applied on the (simulated) supply, with the supply loop idle.
+
+    :param args: Arguments from argparse
+    """
+    server = SimulatedSorensenServer(latency=args.latency)
+    await server.start()
+    supply = SorensenXPF6020DP()
+    await supply.connect(server.host, server.port)
+    await supply.supply_state()
+    times = []
+    packets = server.packets_received
+    for i in range(args.iterations):
+        await asyncio.sleep(0.01)
+        voltage = float(i % 20)
+        start = time.perf_counter()
+        await supply.set_voltage_channel1(voltage)
+        await supply.set_voltage_channel2(voltage)
+        await supply.set_current_channel1(7.0)
+        await supply.set_current_channel2(7.0)
+        await supply.set_output_channel1(1)
+        await supply.set_output_channel2(1)
+        await supply.flush()
+        while server.channels[2]['V'] != voltage or server.channels[2]['OP'] != 1:
+            await asyncio.sleep(0)
+        times.append(time.perf_counter() - start)
+    packets = (server.packets_received - packets) / args.iterations
+    print(f'psu_command set_defaults: mean {statistics.mean(times) * 1e3:7.3f} ms  '
+          f'p95 {sorted(times)[int(len(times) * 0.95)] * 1e3:7.3f} ms  '
+          f'packets/command {packets:.1f}  lines sent/commands {supply.lines_sent}/{supply.commands_sent}')
+    await supply.close()
+    await server.close()
+
+
+async def bench_supply_scale(args):
+    """
+    Time of one PSU telemetry pass over many VCUs with simulated supplies, and of draining it.
+
+    :param args: Arguments from argparse
+    """
+    defaults = {'voltage_ch1': 16.0, 'voltage_ch2': 16.0, 'current_ch1': 7.0, 'current_ch2': 7.0,
+                'output_ch1': 1, 'output_ch2': 1}
+    hil = HIL('HIL')
+    for i in range(args.vcus):
+        hil.components[f'vcu{i}'] = VCU(f'vcu{i}', {'psu': {'type': 'simulated_psu', 'defaults': defaults}})
+    await hil.setup('HIL')
+    supplies = [vcu.components['psu'] for vcu in hil.components.values()]
+    gather_times, drain_times = [], []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        await asyncio.gather(*(supply.gather_telemetry() for supply in supplies))
+        gather_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        telemetry.group_by_timestamp(hil.telemetry.records())
+        drain_times.append(time.perf_counter() - start)
+    print(f'supply_scale {args.vcus:3d} VCUs: gather {statistics.mean(gather_times) * 1e3:7.3f} ms  '
+          f'drain {statistics.mean(drain_times) * 1e3:7.3f} ms  per pass')
+    await asyncio.gather(*(vcu.desetup() for vcu in hil.components.values()))
+
+
+def _legacy_telemetry(n):
+    """
+    Point-object pipeline as it was before columnar channels: object per sample, dict per point, dict again per
+    point when grouping by timestamp.
+
+    :param n: Number of points
+    :return: Points grouped by timestamp
+    """
+    points = [telemetry.UnitTelemetryPoint('volts', float(i), float(i), 'volts') for i in range(n)]
+    dicts = [point.get_dict() for point in points]
+    ts_dict = {}
+    for point in dicts:
+        ts_dict.setdefault(point['timestamp'], []).append({
+            'name': point['name'], 'type': point['type'], 'value': point['value'], 'unit': point['unit']})
+    return ts_dict
+
+
+def _columnar_telemetry(n):
+    """
+    Columnar channel pipeline: append to typed arrays, drain without copying, group by timestamp.
+
+    :param n: Number of points
+    :return: Points grouped by timestamp
+    """
+    keeper = telemetry.TelemetryKeeper('HIL')
+    channel = telemetry.TelemetryChannel('volts', 'unit', 'volts')
+    keeper.add_telemetry_channel(channel)
+    for i in range(n):
+        channel.append(float(i), float(i))
+    return telemetry.group_by_timestamp(keeper.records())
+
+
+def _columnar_drain(n):
+    """
+    Columnar channel append and drain only (what the influx writer consumes).
+
+    :param n: Number of points
+    :return: Drained columns
+    """
+    keeper = telemetry.TelemetryKeeper('HIL')
+    channel = telemetry.TelemetryChannel('volts', 'unit', 'volts')
+    keeper.add_telemetry_channel(channel)
+    for i in range(n):
+        channel.append(float(i), float(i))
+    return list(keeper.drain_columns())
+
+
+async def bench_telemetry(args):
+    """
+    Time and peak memory to store and drain 10k telemetry points, point objects vs columnar channels.
+
+    :param args: Arguments from argparse
+    """
+    n = 10000
+    for name, func in (('point objects', _legacy_telemetry),
+                       ('columnar + group', _columnar_telemetry),
+                       ('columnar drain', _columnar_drain)):
+        times = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            func(n)
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        func(n)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'telemetry {name:>16}: {statistics.mean(times) * 1e3:7.2f} ms / 10k points  '
+              f'peak {peak / 1024:8.1f} KiB / 10k points')
+
+
+def open_pty():
+    """
+    Open a pseudo terminal to stand in for a serial port.
+
+    :return: Tuple of (master file descriptor, slave device path)
+    """
+    master, slave = os.openpty()
+    path = os.ttyname(slave)
+    os.close(slave)
+    return master, path
+
+
+async def _polling_reader(path, stop):
+    """
+    Serial reader as it was before the line protocol: readline() under a 100 ms timeout, in a loop.
+
+    :param path: Serial device path
+    :param stop: Event that ends the reader
+    """
+    reader, writer = await serial_asyncio.open_serial_connection(url=path, baudrate=115200)
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(reader.readline(), timeout=0.1)
+        except asyncio.TimeoutError:
+            pass
+    writer.close()
+
+
+async def bench_serial_idle(args):
+    """
+    CPU used per idle serial port, polling reader vs line protocol, then line latency through the line protocol.
+
+    :param args: Arguments from argparse
+    """
+    ports = [open_pty() for _ in range(args.ports)]
+    duration = args.duration
+
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(_polling_reader(path, stop)) for _, path in ports]
+    await asyncio.sleep(0.2)
+    cpu = time.process_time()
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu
+    stop.set()
+    await asyncio.gather(*tasks)
+    print(f'serial_idle {"polling":>9}: {cpu / duration / args.ports * 1e3:7.3f} ms CPU / s / idle port')
+
+    devices = [VCUSerialDevice() for _ in ports]
+    for device, (_, path) in zip(devices, ports):
+        await device.connect(path)
+    await asyncio.sleep(0.2)
+    cpu = time.process_time()
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu
+    print(f'serial_idle {"protocol":>9}: {cpu / duration / args.ports * 1e3:7.3f} ms CPU / s / idle port')
+
+    master, _ = ports[0]
+    device = devices[0]
+    times = []
+    for i in range(args.iterations):
+        start = time.perf_counter()
+        os.write(master, f'line {i}\r\n'.encode())
+        await device.wait_line()
+        device.get_line_nowait()
+        times.append(time.perf_counter() - start)
+    print(f'serial_idle {"latency":>9}: mean {statistics.mean(times) * 1e3:7.3f} ms  '
+          f'p95 {sorted(times)[int(len(times) * 0.95)] * 1e3:7.3f} ms  (pty write to line available)')
+    for device in devices:
+        await device.close()
+    for master, _ in ports:
+        os.close(master)
+
+
+async def bench_simulate(args):
+    """
+    Whole service against simulated VCUs (see vcuhil_service --simulate), doubling the VCU count up to --vcus:
+    job cycle time, event loop lag, memory and CPU as the fleet grows.
+
+    :param args: Arguments from argparse
+    """
+    import vcuhil_service
+    count = 1
+    while count <= args.vcus:
+        state = await vcuhil_service.setup({'log_filename': None, 'simulate': count, 'line_rate': args.line_rate})
+        scheduler, monitor = state['scheduler'], state['loop_monitor']
+        await scheduler.start()
+        await monitor.start()
+        commands = asyncio.create_task(vcuhil_service.command_loop(state))
+        # Let VCUs boot before measuring
+        await asyncio.sleep(3.0)
+        monitor.reset()
+        cpu = time.process_time()
+        await asyncio.sleep(args.duration)
+        cpu = time.process_time() - cpu
+        report = vcuhil_service.load_report(state)
+        idle = sum(vcu.state == 'idle' for vcu in state['hil'].components.values())
+        print(f'simulate {count:3d} VCUs: max job {report["max_job_duration"] * 1e3:6.2f} ms  '
+              f'publish {report["publish_duration"] * 1e3:6.2f} ms  overruns {report["overruns"]:3d}  '
+              f'lag mean {report["mean_lag"] * 1e3:5.2f} p99 {report["p99_lag"] * 1e3:6.2f} '
+              f'max {report["max_lag"] * 1e3:6.2f} ms  CPU {cpu / args.duration * 100:5.1f} %  '
+              f'RSS {report["rss_bytes"] / 2 ** 20:6.1f} MiB  idle {idle}/{count}')
+        commands.cancel()
+        await scheduler.close()
+        await monitor.close()
+        await state['dispatcher'].close()
+        await asyncio.gather(*(vcu.desetup() for vcu in state['hil'].components.values()))
+        await state['influx_writer'].close()
+        await state['simulator'].close()
+        count *= 2
+
+
+BENCHMARKS = {
+    'psu_readback': bench_psu_readback,
+    'psu_command': bench_psu_command,
+    'supply_scale': bench_supply_scale,
+    'telemetry': bench_telemetry,
+    'serial_idle': bench_serial_idle,
+    'simulate': bench_simulate,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='hil_bench', description='Benchmarks for VCU HIL service internals.')
+    parser.add_argument('benchmark', choices=BENCHMARKS.keys(), help='Benchmark to run')
+    parser.add_argument('--iterations', default=50, type=int, help='Iterations per measurement')
+    parser.add_argument('--latency', default=0.002, type=float, help='Simulated device round trip (seconds)')
+    parser.add_argument('--vcus', default=16, type=int, help='Virtual VCUs')
+    parser.add_argument('--ports', default=5, type=int, help='Serial ports (one VCU has five)')
+    parser.add_argument('--duration', default=5.0, type=float, help='Seconds to measure idle CPU (or load) over')
+    parser.add_argument('--line_rate', default=10.0, type=float, help='Serial lines per second per simulated console')
+    args = parser.parse_args()
+    asyncio.run(BENCHMARKS[args.benchmark](args))
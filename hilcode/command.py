@@ -1,6 +1,9 @@
 from enum import Enum
+import asyncio
+import copy
 import json
 import logging
+import time
 
 log = logging.getLogger(__name__)
 
@@ -10,6 +13,15 @@ class CommandWarning(RuntimeWarning):
 class CommandError(RuntimeError):
     pass
 
+class RoutingError(CommandWarning, KeyError):
+    """
+    Command target doesn't name a component.  Also a KeyError, which is what unknown targets used to raise.
+    """
+
+    def __str__(self):
+        # Plain message, not the quoted repr KeyError gives
+        return str(self.args[0]) if self.args else ''
+
 class Operation(Enum):
     """
     Enumeration of all possible command operations for HIL
@@ -26,6 +38,121 @@ class Operation(Enum):
     ENABLE = 9
     BOOTED_FORCE = 10
     VERSION_CHECK = 12
+    SEQUENCE = 13
+
+class CommandStatus(Enum):
+    """
+    Outcome of a command
+    """
+    PENDING = 'pending'
+    SUCCESS = 'success'
+    WARNING = 'warning'
+    ERROR = 'error'
+    TIMEOUT = 'timeout'
+
+# Worst outcome wins when results of a broadcast command are combined
+STATUS_SEVERITY = (CommandStatus.SUCCESS, CommandStatus.WARNING, CommandStatus.PENDING, CommandStatus.TIMEOUT,
+                   CommandStatus.ERROR)
+# Characters that make a target a glob pattern
+GLOB_CHARS = '*?['
+
+
+def is_broadcast(target):
+    """
+    Does a command target name more than one component (a list of targets, or a glob pattern like '*.psu')?
+
+    :param target: Command target
+    :return: True/False if command is a broadcast
+    """
+    if isinstance(target, (list, tuple)):
+        return True
+    return any(char in str(target) for char in GLOB_CHARS)
+
+class CommandResult(object):
+    """
+    Outcome and timing of an executed command.
+    """
+
+    def __init__(self, command_id=None, status=CommandStatus.PENDING, warning=None, value=None,
+                 queued_at=None, started_at=None, finished_at=None):
+        """
+        Create a command result.
+
+        :param command_id: Correlation id of command
+        :param status: CommandStatus of command
+        :param warning: CommandWarning (or error) text, if command didn't succeed
+        :param value: Value returned by component, if any
+        :param queued_at: Time command was queued (UNIX time)
+        :param started_at: Time command started executing (UNIX time)
+        :param finished_at: Time command finished executing (UNIX time)
+        """
+        self.command_id = command_id
+        self.status = status
+        self.warning = warning
+        self.value = value
+        self.queued_at = queued_at
+        self.started_at = started_at
+        self.finished_at = finished_at
+
+    def to_dict(self):
+        """
+        Dictionary representation of result
+
+        :return: Dictionary representation of result
+        """
+        latency = None
+        if self.queued_at is not None and self.finished_at is not None:
+            latency = self.finished_at - self.queued_at
+        return {
+            'id': self.command_id,
+            'status': self.status.value,
+            'warning': self.warning,
+            'value': self.value,
+            'queued_at': self.queued_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'latency': latency,
+        }
+
+    @classmethod
+    def combine(cls, command_id, results):
+        """
+        Combine the results of a broadcast command into one.  Status is the worst of the targets' statuses, value
+        is {'targets': {target: result dictionary}}.
+
+        :param command_id: Correlation id of broadcast command
+        :param results: Dictionary of {target: CommandResult}
+        :return: CommandResult
+        """
+        status = max((result.status for result in results.values()), key=STATUS_SEVERITY.index,
+                     default=CommandStatus.SUCCESS)
+        failed = [target for target, result in results.items() if result.status != CommandStatus.SUCCESS]
+        warning = None
+        if failed:
+            warning = f'{len(failed)} of {len(results)} targets did not succeed: {", ".join(failed)}'
+        return cls(command_id=command_id, status=status, warning=warning,
+                   value={'targets': {target: result.to_dict() for target, result in results.items()}})
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Build result from its dictionary representation
+
+        :param d: Dictionary representation (see to_dict)
+        :return: CommandResult
+        """
+        return cls(
+            command_id=d.get('id'),
+            status=CommandStatus(d['status']),
+            warning=d.get('warning'),
+            value=d.get('value'),
+            queued_at=d.get('queued_at'),
+            started_at=d.get('started_at'),
+            finished_at=d.get('finished_at'),
+        )
+
+    def __str__(self):
+        return json.dumps(self.to_dict())
 
 class Command(object):
     """
@@ -36,7 +163,8 @@ class Command(object):
                  json_data='',
                  operation=Operation.NO_OP,
                  options=None,
-                 target=''
+                 target='',
+                 command_id=None
                  ):
         """
         Create a HIL command.
@@ -44,18 +172,124 @@ class Command(object):
         :param json_data: JSON data to build command from, or leave blank to pass in options manually.
         :param operation: Must be an enum of type Operation, or a corresponding integer.  Represents type of operation command performs.
         :param options: Command options, usually a dictionary contianing {'value':'', 'command':''} or the like depending on command.
-        :param target: Target of command (VCU, or subcomponent of VCU).  Convention is VCU.subcomponent
+        :param target: Target of command (VCU, or subcomponent of VCU).  Convention is VCU.subcomponent.  A list of
+                       targets or a glob pattern ('*', '*.psu') broadcasts the command, see is_broadcast
+        :param command_id: (optional) Correlation id, replies to this command carry the same id
         """
         if json_data == '':
             assert isinstance(operation, Operation)
             self.operation = operation
             self.options = options
             self.target = target
+            self.command_id = command_id
         else:
             dict = json.loads(json_data)
-            self.operation = dict['operation']
+            self.operation = Operation(dict['operation'])
             self.options = dict['options']
             self.target = dict['target']
+            self.command_id = dict.get('id')
+        self.result = CommandResult(command_id=self.command_id)
+        self._completion = None
+        self._progress_callbacks = []
+
+    def is_broadcast(self):
+        """
+        Does command go to more than one component?
+
+        :return: True/False if command is a broadcast
+        """
+        return is_broadcast(self.target)
+
+    def fan_out(self, targets):
+        """
+        One command per target of a broadcast, tracked so they can be waited on.
+
+        :param targets: List of targets (no patterns)
+        :return: List of commands
+        """
+        commands = []
+        for target in targets:
+            cmd = Command(operation=self.operation, options=copy.deepcopy(self.options), target=target)
+            cmd.track()
+            commands.append(cmd)
+        return commands
+
+    def track(self):
+        """
+        Start tracking completion of command (call when queueing it, from the event loop).
+        """
+        self.result.queued_at = time.time()
+        self._completion = asyncio.get_running_loop().create_future()
+
+    def start(self):
+        """
+        Mark command as executing.
+        """
+        self.result.started_at = time.time()
+
+    def finish(self, status, warning=None, value=None):
+        """
+        Mark command as finished, waking anything waiting on it.  Only the first call counts.
+
+        :param status: CommandStatus of command
+        :param warning: CommandWarning (or error) text, if command didn't succeed
+        :param value: Value returned by component, if any
+        """
+        if self.done():
+            return
+        self.result.status = status
+        self.result.warning = warning
+        self.result.value = value
+        self.result.finished_at = time.time()
+        if self._completion is not None and not self._completion.done():
+            self._completion.set_result(self.result)
+
+    def on_progress(self, callback):
+        """
+        Call a function with each progress report of a long running command (like a SEQUENCE).
+
+        :param callback: Function called as callback(progress dictionary)
+        """
+        self._progress_callbacks.append(callback)
+
+    def progress(self, report):
+        """
+        Report progress of command to anything listening (see on_progress).
+
+        :param report: Progress dictionary
+        """
+        for callback in self._progress_callbacks:
+            try:
+                callback(report)
+            except Exception:
+                log.exception(f'Progress callback of command {self.command_id} failed')
+
+    def done(self):
+        """
+        Has command finished?
+
+        :return: True/False if command finished
+        """
+        return self.result.finished_at is not None
+
+    async def wait(self, timeout=None):
+        """
+        Wait for command to finish.
+
+        :param timeout: (optional) Seconds to wait
+        :return: CommandResult, with status TIMEOUT if command didn't finish in time (it keeps running)
+        """
+        if self._completion is None:
+            raise CommandError('Command is not tracked, call track() when queueing it')
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._completion), timeout=timeout)
+        except asyncio.TimeoutError:
+            return CommandResult(
+                command_id=self.command_id,
+                status=CommandStatus.TIMEOUT,
+                queued_at=self.result.queued_at,
+                started_at=self.result.started_at,
+            )
 
     def __str__(self):
         """
@@ -63,6 +297,16 @@ class Command(object):
 
         :return: String represetation of command
         """
+        return f'{json.dumps(self.to_dict())}\n'
+
+    def to_dict(self):
+        """
+        Dictionary representation of command
+
+        :return: Dictionary representation of command
+        """
         d = {'operation': self.operation.value, 'options': self.options, 'target': self.target}
-        return f'{json.dumps(d)}\n'
+        if self.command_id is not None:
+            d['id'] = self.command_id
+        return d
 
@@ -1,21 +1,177 @@
+# Power supply drivers register their config types on import
 from hilcode.supply_commander import SorensenXPF6020DP
-from hilcode.micro_commander import VCUSerialDevice
-from hilcode.sga_commander import VCUSGA
+from hilcode.supply_simulator import SimulatedSupply
+from hilcode.supply import create_supply, is_supply
+from hilcode.micro_commander import VCUSerialDevice, SerialLine
+from hilcode.serial_buffer import BUFFER_BYTES as SERIAL_BUFFER_BYTES, DROP_OLDEST as SERIAL_OVERFLOW
+from hilcode.serial_capture import SerialCapture, CAPTURE_DIR
+from hilcode.serial_matcher import SerialMatcher, DEFAULT_PATTERNS
+from hilcode.sga_commander import VCUSGA, PINGER_CYCLE_TIME
 from hilcode.hpa_commander import VCUHPA
+from hilcode.ssh_session import VCUSSHSession
 import abc
+import difflib
+import fnmatch
+import os
 import pprint
 import asyncio
 import time
 from transitions import Machine
-from hilcode.telemetry import TelemetryKeeper, TelemetryChannel, BooleanTelemetryPoint, StringTelemetryPoint, UnitTelemetryPoint, FloatTelemetryPoint
-from hilcode.command import CommandWarning, Operation
+from hilcode.telemetry import TelemetryKeeper, TelemetryChannel
+from hilcode.command import CommandWarning, Operation, RoutingError, is_broadcast
 import logging
 
 log = logging.getLogger(__name__)
 
+# Serial ports whose login prompts mean the VCU has booted
+BOOT_PORTS = ('sga_serial', 'hpa_serial')
+# SSH ping period while serial consoles are watched for boot
+BOOTING_PINGER_CYCLE_TIME = 5.0
+# VCU subcomponent types other than power supplies (see hilcode.supply), matched as substrings of config type
+COMPONENT_KINDS = ('micro', 'sga', 'hpa', 'vlan')
+# Seconds for one subcomponent to set up (config 'setup_timeout' overrides) or close
+COMPONENT_SETUP_TIMEOUT = 15
+COMPONENT_CLOSE_TIMEOUT = 5
+
+class ComponentMap(dict):
+    """
+    Subcomponents of a component, by name.  Tells the owning component when subcomponents are added or removed, so
+    the HIL's path index follows VCU setup and desetup.
+    """
+
+    def __init__(self, owner):
+        super().__init__()
+        self.owner = owner
+
+    def __setitem__(self, name, comp):
+        old = self.get(name)
+        super().__setitem__(name, comp)
+        if old is not None and old is not comp:
+            self.owner._component_removed(name, old)
+        self.owner._component_added(name, comp)
+
+    def __delitem__(self, name):
+        comp = self[name]
+        super().__delitem__(name)
+        self.owner._component_removed(name, comp)
+
+    def pop(self, name, *default):
+        if name not in self:
+            return super().pop(name, *default)
+        comp = self[name]
+        del self[name]
+        return comp
+
+    def update(self, *args, **kwargs):
+        for name, comp in dict(*args, **kwargs).items():
+            self[name] = comp
+
+    def clear(self):
+        for name in list(self):
+            del self[name]
+
+
+def _match_tokens(parts, tokens):
+    return len(parts) == len(tokens) and all(fnmatch.fnmatchcase(part, token) for part, token in zip(parts, tokens))
+
+
+class ComponentIndex(object):
+    """
+    Every component under a root, by fully qualified path ('leonardo', 'leonardo.psu'), with the stack of components
+    above it.  Routing a command is one dictionary lookup instead of a walk down the tree.
+    """
+
+    def __init__(self, root):
+        """
+        Create an empty index.
+
+        :param root: Root component, which paths are relative to
+        """
+        self.root = root
+        self._paths = {}
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, path):
+        return path in self._paths
+
+    def add(self, path, comp, stack):
+        """
+        Index a component and everything under it.
+
+        :param path: Fully qualified path of component
+        :param comp: Component
+        :param stack: Components above it, root first
+        """
+        self._paths[path] = (stack, comp)
+        for name, child in comp.components.items():
+            self.add(f'{path}.{name}', child, stack + [comp])
+
+    def remove(self, path):
+        """
+        Drop a component and everything under it from the index.
+
+        :param path: Fully qualified path of component
+        """
+        prefix = f'{path}.'
+        for indexed in [indexed for indexed in self._paths if indexed == path or indexed.startswith(prefix)]:
+            del self._paths[indexed]
+
+    def route(self, path):
+        """
+        Component a path names, and the components above it.
+
+        :param path: Fully qualified path
+        :return: Tuple of (list of components above it, root first; component)
+        """
+        try:
+            return self._paths[path]
+        except KeyError:
+            raise RoutingError(self._unknown(path)) from None
+
+    def match(self, pattern):
+        """
+        Paths matching a glob pattern, one dot separated part at a time: '*' is every VCU, '*.psu' every VCU's power
+        supply, 'leonardo.h*' leonardo's HIA and HIB.
+
+        :param pattern: Glob pattern, or a plain path
+        :return: Sorted list of matching paths
+        """
+        if pattern in self._paths:
+            return [pattern]
+        tokens = pattern.split('.')
+        return sorted(path for path in self._paths if _match_tokens(path.split('.'), tokens))
+
+    def _unknown(self, path):
+        """
+        Explain why a path isn't routable: the first part of it that doesn't exist, and what does.
+
+        :param path: Fully qualified path
+        :return: Error message
+        """
+        parent = ''
+        for token in str(path).split('.'):
+            child = f'{parent}.{token}' if parent else token
+            if child not in self._paths:
+                siblings = [indexed[len(parent) + 1 if parent else 0:] for indexed in self._paths
+                            if indexed.rpartition('.')[0] == parent]
+                where = f"'{parent}'" if parent else self.root.name
+                message = f"Unknown target '{path}': no component '{token}' in {where}"
+                close = difflib.get_close_matches(token, siblings, n=1)
+                if close:
+                    message += f", did you mean '{close[0]}'?"
+                elif siblings:
+                    message += f" (has {', '.join(sorted(siblings))})"
+                return message
+            parent = child
+        return f"Unknown target '{path}'"
+
+
 class Component(object):
     def __init__(self, name):
         self.name = name
+        self.parent = None
         self.components = {}
         self.type = 'Component'
         self.telemetry = TelemetryKeeper('Component')
@@ -23,6 +179,51 @@ class Component(object):
     async def setup(self, name):
         await self.gather_telemetry_keepers(name)
 
+    @property
+    def components(self):
+        return self._components
+
+    @components.setter
+    def components(self, components):
+        old = getattr(self, '_components', None)
+        self._components = ComponentMap(self)
+        if old:
+            for name, comp in old.items():
+                self._component_removed(name, comp)
+        self._components.update(components)
+
+    def _root_path(self):
+        """
+        Root of the tree this component is in, and this component's path under it.
+
+        :return: Tuple of (root component, list of path names from root)
+        """
+        path = []
+        comp = self
+        while comp.parent is not None:
+            parent, name = comp.parent
+            path.append(name)
+            comp = parent
+        return comp, path[::-1]
+
+    def _component_added(self, name, comp):
+        comp.parent = (self, name)
+        root, path = self._root_path()
+        index = getattr(root, 'index', None)
+        if index is not None:
+            stack = [root]
+            for token in path:
+                stack.append(stack[-1].components[token])
+            index.add('.'.join(path + [name]), comp, stack)
+
+    def _component_removed(self, name, comp):
+        if comp.parent is not None and comp.parent[0] is self:
+            comp.parent = None
+        root, path = self._root_path()
+        index = getattr(root, 'index', None)
+        if index is not None:
+            index.remove('.'.join(path + [name]))
+
     @abc.abstractmethod
     def all_configs(self):
         pass
@@ -57,7 +258,10 @@ class Component(object):
                 context =  context.get_component(token)
             return context
         else:
-            return self.components[name]
+            try:
+                return self.components[name]
+            except KeyError:
+                raise RoutingError(f"No component '{name}' in {self.name}") from None
 
     def get_component_cmdstack(self, name):
         if '.' in name:
@@ -69,7 +273,7 @@ class Component(object):
                 context =  context.get_component(token)
             return prev_context, context
         else:
-            return None, self.components[name]
+            return None, self.get_component(name)
 
 
 class HIL(Component):
@@ -80,6 +284,84 @@ class HIL(Component):
         self.type = 'HIL'
         self.hil_machine = Machine(model=self, states=HIL.states, initial='idle')
         self.telemetry = TelemetryKeeper('HIL')
+        # Every component under the HIL by target path, kept current as components are added and removed
+        self.index = ComponentIndex(self)
+
+    def get_component(self, name):
+        return self.index.route(name)[1]
+
+    def get_component_cmdstack(self, name):
+        """
+        Component a command target names, and the components above it (whose command_callstack sees the command).
+
+        :param name: Fully qualified target ('leonardo', 'leonardo.psu')
+        :return: Tuple of (list of components above target, HIL first; target component)
+        """
+        return self.index.route(name)
+
+    def match_components(self, pattern):
+        """
+        Targets matching a glob pattern, like '*.psu' or 'leonardo.h*'.
+
+        :param pattern: Glob pattern (matched one dot separated part at a time), or a plain target
+        :return: Sorted list of matching targets
+        """
+        return self.index.match(pattern)
+
+    def expand_targets(self, target):
+        """
+        Targets of a broadcast command, in order without repeats.  Patterns expand to what they match, plain targets
+        are kept (unknown ones fail when their command is routed).
+
+        :param target: Glob pattern, or list of targets and patterns
+        :return: List of targets
+        """
+        patterns = target if isinstance(target, (list, tuple)) else [target]
+        targets = {}
+        for pattern in patterns:
+            pattern = str(pattern)
+            if is_broadcast(pattern):
+                targets.update(dict.fromkeys(self.match_components(pattern)))
+            else:
+                targets[pattern] = None
+        if not targets:
+            raise RoutingError(f"No targets match {target}")
+        return list(targets)
+
+    def find_channel(self, path):
+        """
+        Telemetry channel a path names: a target, then the name of one of its channels ('leonardo.vcu_state',
+        'leonardo.psu.pri_meas_curr', 'leonardo.hia.serial_out').  Targets are resolved through the index, so they
+        are component names even where a component's telemetry keeper is named differently (micro 'hia' keeps its
+        channels in 'micro_hia').  Telemetry keeper paths ('leonardo.micro_hia.serial_out') are tried last.
+
+        :param path: Target, then channel name
+        :return: TelemetryChannel, or None if path names no channel
+        """
+        tokens = str(path).split('.')
+        for split in range(len(tokens) - 1, 0, -1):
+            target = '.'.join(tokens[:split])
+            if target in self.index:
+                channel = self.index.route(target)[1].telemetry.find_channel('.'.join(tokens[split:]))
+                if channel is not None:
+                    return channel
+        return self.telemetry.find_channel(path)
+
+    def check_channel(self, path):
+        """
+        Make sure a path can name a telemetry channel (see find_channel), so a wait on it fails when it's submitted
+        rather than when it runs.  A channel of a configured subcomponent that isn't set up yet (its VCU is powered
+        off) passes, it exists once the VCU is enabled.
+
+        :param path: Target, then channel name
+        """
+        if self.find_channel(path) is not None:
+            return
+        tokens = str(path).split('.')
+        vcu = self.components.get(tokens[0])
+        if vcu is not None and len(tokens) > 2 and tokens[1] in vcu.configs and tokens[1] not in vcu.components:
+            return
+        raise RoutingError(f'No telemetry channel {path}')
 
     def all_configs(self):
         def _config_gen():
@@ -89,10 +371,19 @@ class HIL(Component):
         return {n:v for n,v in _config_gen()}
 
     async def setup(self, name):
-        for component_name, component in self.components.items(): # Grab VCU
-            await component.setup(component_name)
+        # VCUs set up at the same time
+        await asyncio.gather(*(component.setup(component_name)
+                               for component_name, component in self.components.items()))
         await super().setup(name)
 
+    def setup_reports(self):
+        """
+        Setup status and time of every VCU subcomponent.
+
+        :return: Dictionary of {VCU name: {subcomponent name: {'status', 'seconds', 'error'}}}
+        """
+        return {vcu_name: vcu.setup_report for vcu_name, vcu in self.components.items()}
+
     async def command(self, operation, options):
         pass
 
@@ -119,9 +410,78 @@ class VCU(Component):
     ]
 
     def _setup_state_callbacks(self):
-        pass
         #self.vcu_machine.on_enter_offline('desetup')
         #self.vcu_machine.on_enter_power_off('resetup')
+        self.vcu_machine.on_enter_booting('_enter_booting')
+        self.vcu_machine.on_exit_booting('_exit_booting')
+        self.vcu_machine.on_enter_idle('_enter_idle')
+
+    def _setup_serial_matcher(self):
+        self.serial_matcher = SerialMatcher(DEFAULT_PATTERNS)
+        self.serial_matcher.on_match('booted', self._serial_booted)
+        self.serial_matcher.on_match('reboot', self._serial_reboot)
+        self._boot_ports = {dev for dev, config in self.configs.items()
+                            if 'micro' in config['type'] and dev in BOOT_PORTS}
+        self._login_ports = set()
+
+    def _serial_booted(self, port, name, line):
+        # Booted once every boot port has shown a login prompt
+        if self.state != 'booting' or port not in self._boot_ports:
+            return
+        self._login_ports.add(port)
+        if self._login_ports >= self._boot_ports:
+            log.info(f'VCU {self.name} booted (login prompt on {", ".join(sorted(self._login_ports))}).')
+            self.booted()
+
+    def _serial_reboot(self, port, name, line):
+        if self.state == 'booting':
+            # Another boot stage, wait for login prompts again
+            self._login_ports.clear()
+        elif self.state == 'idle':
+            log.info(f'VCU {self.name} rebooting (seen on {port}: {line.data!r}).')
+            self.reboot()
+
+    def _enter_booting(self):
+        self._login_ports.clear()
+        if self._boot_ports:
+            # Serial consoles detect boot, SSH pings are only a fallback
+            self._set_pinger_cycle_time(BOOTING_PINGER_CYCLE_TIME)
+
+    def _exit_booting(self):
+        self._set_pinger_cycle_time(PINGER_CYCLE_TIME)
+
+    def _enter_idle(self):
+        self._ssh_seen = False
+
+    def _state_changed(self):
+        for states, waiter in self._state_waiters:
+            if self.state in states and not waiter.done():
+                waiter.set_result(self.state)
+
+    async def wait_for_state(self, states, timeout=None):
+        """
+        Wait for VCU to reach a state, woken by the state change itself (no polling).
+
+        :param states: List of states, any of them will do
+        :param timeout: (optional) Seconds to wait
+        :return: True if VCU reached a state, False if timeout passed first
+        """
+        if self.state in states:
+            return True
+        entry = (states, asyncio.get_running_loop().create_future())
+        self._state_waiters.append(entry)
+        try:
+            await asyncio.wait_for(entry[1], timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._state_waiters.remove(entry)
+
+    def _set_pinger_cycle_time(self, cycle_time):
+        for comp in self.components.values():
+            if isinstance(comp, (SGA, HPA)):
+                comp.client.set_cycle_time(cycle_time)
 
     async def exec_booting(self):
         if await self.ping_hpa_sga():
@@ -129,7 +489,10 @@ class VCU(Component):
             self.booted()
 
     async def exec_idle(self):
-        if not await self.ping_hpa_sga():
+        if await self.ping_hpa_sga():
+            self._ssh_seen = True
+        elif self._ssh_seen:
+            # Only a loss of SSH counts, after a serial boot SSH may not be up yet
             log.debug(f'VCU {self.name} disconnected')
             self.reboot()
 
@@ -160,50 +523,58 @@ class VCU(Component):
             await self.setup(self.name)
             self.power_off()
         elif operation == Operation.ENABLE:
+            if 'psu' not in self.components:
+                raise CommandWarning(f'ENABLE needs the power supply, which is degraded: {self.degraded.get("psu")}')
             if self.state == 'power_off':
                 logging.info(f'Bringing VCU {self.name} power up.')
                 await self.components['psu'].enable()
                 self.power_on()
             else:
-                RuntimeWarning('ENABLE command can only be called in power_off sate.')
+                raise CommandWarning('ENABLE command can only be called in power_off sate.')
         elif operation == Operation.BOOTED_FORCE:
             if self.state == 'booting':
                 logging.info(f'Forcing VCU {self.name} into idle state.')
                 self.booted()
             else:
-                RuntimeWarning('Force Boot command can only be called in booting sate.')
+                raise CommandWarning('Force Boot command can only be called in booting sate.')
         else:
             logging.error('WTF A VCU COMMAND?')
             raise RuntimeError('A VCU COMMAND?  NOT IN THIS HOUSE')
 
     async def desetup(self):
         logging.debug(f'VCU {self.name} is being desetup')
-        for comp_name, comp in self.components.items():
-            await comp.close()
-            self.telemetry.purge(comp_name)
-        self.components = {}
+        components, self.components = self.components, {}
+        await asyncio.gather(*(self._timed_close(comp_name, comp) for comp_name, comp in components.items()))
+        for comp in components.values():
+            self.telemetry.purge(comp.telemetry.name)
+        sessions, self.ssh_sessions = self.ssh_sessions, {}
+        await asyncio.gather(*(session.close() for session in sessions.values()), return_exceptions=True)
 
     def __init__(self, name, configs):
         super().__init__(name)
         self.configs = configs
         self.type = 'VCU'
-        self.vcu_machine = Machine(model=self, states=VCU.states, transitions=VCU.transitions, initial='power_off')
+        self.ssh_sessions = {}
+        self.setup_report = {}
+        self.degraded = {}
+        self._ssh_seen = False
+        self._state_waiters = []
+        self.vcu_machine = Machine(model=self, states=VCU.states, transitions=VCU.transitions, initial='power_off',
+                                   after_state_change='_state_changed')
         self.telemetry = TelemetryKeeper(name)
         self._setup_telemetry()
+        self._setup_serial_matcher()
         self._setup_state_callbacks()
 
     def _setup_telemetry(self):
         # HIL State
-        self.telemetry.add_telemetry_channel(TelemetryChannel('vcu_state'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('vcu_state', 'string'))
+
+    async def gather_state_telemetry(self):
+        self.telemetry.telemetry_channels['vcu_state'].append(time.time(), self.state)
 
     async def gather_telemetry(self):
-        self.telemetry.telemetry_channels['vcu_state'].add_point(
-            StringTelemetryPoint(
-                'vcu_state',
-                time.time(),
-                self.state
-            )
-        )
+        await self.gather_state_telemetry()
         await super().gather_telemetry()
 
     def all_configs(self):
@@ -211,39 +582,105 @@ class VCU(Component):
 
     async def setup(self, name):
         logging.debug(f'Setting up VCU {self.name} alias {name}')
-        for config_dev, config_dict in self.configs.items():
-            if   'sorensen_psu' in config_dict['type']:
-                # Create a power supply component
-                self.components[config_dev] = PowerSupply('psu', SorensenXPF6020DP(), defaults=config_dict['defaults'])
-                # Connect telnet client for power supply to actual physical power supply
-                await self.components[config_dev].client.connect(config_dict['host'], config_dict['port'])
-                # Complete setup for power supply
-                await self.components[config_dev].setup('psu')
-            elif 'micro' in config_dict['type']:
-                self.components[config_dev] = Micro(f'micro_{config_dev}', VCUSerialDevice())
-                await self.components[config_dev].client.connect(config_dict['serial'], baudrate=config_dict['baudrate'])
-                await self.components[config_dev].setup(f'micro_{config_dev}')
-            elif 'sga' in config_dict['type']:
-                self.components[config_dev] = SGA(
-                    config_dev,
-                    VCUSGA(config_dict['odb'])
-                )
-                await self.components[config_dev].setup('sga')
-            elif 'hpa' in config_dict['type']:
-                self.components[config_dev] = HPA(
-                    config_dev,
-                    VCUHPA(
-                        config_dict['sga_odb'],
-                        config_dict['hostname']
-                    )
-                )
-                await self.components[config_dev].setup('hpa')
-            elif 'vlan' in config_dict['type']:
-                self.components[config_dev] = Component(config_dev)
-            else:
+        for config_dict in self.configs.values():
+            if not is_supply(config_dict['type']) and not any(kind in config_dict['type'] for kind in COMPONENT_KINDS):
                 raise RuntimeError(f'Unexpected VCU subcomponent type {config_dict["type"]}.')
+        self.setup_report = {}
+        self.degraded = {}
+        # Subcomponents connect at the same time, one that fails or hangs doesn't hold up the others
+        await asyncio.gather(*(self._timed_setup(config_dev, config_dict)
+                               for config_dev, config_dict in self.configs.items()))
+        if self.state == 'booting' and self._boot_ports:
+            self._set_pinger_cycle_time(BOOTING_PINGER_CYCLE_TIME)
         await super().setup(name)
 
+    async def _timed_setup(self, config_dev, config_dict):
+        started = time.monotonic()
+        pending = {}
+        error = None
+        try:
+            await asyncio.wait_for(self._setup_component(config_dev, config_dict, pending),
+                                   timeout=config_dict.get('setup_timeout', COMPONENT_SETUP_TIMEOUT))
+            # Telemetry goes in the VCU's tree first, jobs find the component as soon as it's added and name its
+            # channels from where its keeper is
+            self.telemetry.add_telemetry_keeper(pending[config_dev].telemetry)
+            self.components[config_dev] = pending[config_dev]
+        except asyncio.TimeoutError:
+            error = 'setup timed out'
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+        seconds = time.monotonic() - started
+        if error is not None:
+            log.warning(f'VCU {self.name} {config_dev} degraded after {seconds:.2f}s: {error}')
+            self.degraded[config_dev] = error
+            if config_dev in pending:
+                await self._timed_close(config_dev, pending[config_dev])
+        self.setup_report[config_dev] = {
+            'status': 'ok' if error is None else 'degraded',
+            'seconds': seconds,
+            'error': error,
+        }
+
+    async def _setup_component(self, config_dev, config_dict, pending):
+        # Component goes in pending as soon as it exists, so a failed setup can still be closed
+        if   is_supply(config_dict['type']):
+            # Create a power supply component, with the driver registered for its type
+            comp = pending[config_dev] = PowerSupply('psu', create_supply(config_dict), defaults=config_dict['defaults'])
+            # Connect driver to power supply
+            await comp.client.open(config_dict)
+            # Complete setup for power supply
+            await comp.setup('psu')
+        elif 'micro' in config_dict['type']:
+            comp = pending[config_dev] = Micro(f'micro_{config_dev}', VCUSerialDevice(
+                buffer_bytes=config_dict.get('buffer_bytes', SERIAL_BUFFER_BYTES),
+                overflow=config_dict.get('overflow', SERIAL_OVERFLOW)
+            ), capture=SerialCapture(
+                os.path.join(config_dict.get('capture_dir', CAPTURE_DIR), self.name),
+                config_dev
+            ))
+            comp.client.add_line_listener(lambda line, port=config_dev: self.serial_matcher.feed(port, line))
+            # Login prompts have no line ending
+            comp.client.add_partial_listener(lambda data, port=config_dev: self.serial_matcher.feed_partial(
+                port, SerialLine(time.time(), data)))
+            await comp.client.connect(config_dict['serial'], baudrate=config_dict['baudrate'])
+            await comp.setup(f'micro_{config_dev}')
+        elif 'sga' in config_dict['type']:
+            port = config_dict.get('port', 22)
+            comp = pending[config_dev] = SGA(
+                config_dev,
+                VCUSGA(config_dict['odb'], port=port, session=self._ssh_session(config_dict['odb'], port))
+            )
+            await comp.setup('sga')
+        elif 'hpa' in config_dict['type']:
+            sga_port = config_dict.get('sga_port', 22)
+            comp = pending[config_dev] = HPA(
+                config_dev,
+                VCUHPA(
+                    config_dict['sga_odb'],
+                    config_dict['hostname'],
+                    sga_port=sga_port,
+                    port=config_dict.get('port', 22),
+                    session=self._ssh_session(config_dict['sga_odb'], sga_port)
+                )
+            )
+            await comp.setup('hpa')
+        elif 'vlan' in config_dict['type']:
+            pending[config_dev] = Component(config_dev)
+
+    async def _timed_close(self, comp_name, comp):
+        try:
+            await asyncio.wait_for(comp.close(), timeout=COMPONENT_CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning(f'VCU {self.name} {comp_name} close timed out')
+        except Exception as e:
+            log.warning(f'VCU {self.name} {comp_name} close failed: {type(e).__name__}: {e}')
+
+    def _ssh_session(self, sga_host, sga_port=22):
+        # SGA and HPA pingers share one SSH session per SGA
+        if (sga_host, sga_port) not in self.ssh_sessions:
+            self.ssh_sessions[(sga_host, sga_port)] = VCUSSHSession(sga_host, sga_port)
+        return self.ssh_sessions[(sga_host, sga_port)]
+
     async def query_power_status(self):
         return await self.components['psu'].query_state()
 
@@ -257,18 +694,23 @@ class VCU(Component):
         return await self._ping_hpa_through_sga()
 
     async def _ping_sga(self):
-        return self.components['sga'].is_connected()
+        sga = self.components.get('sga')
+        return sga is not None and sga.is_connected()
 
     async def _ping_hpa_through_sga(self):
-        return self.components['hpa'].is_connected()
+        hpa = self.components.get('hpa')
+        return hpa is not None and hpa.is_connected()
 
 
 class Micro(Component):
-    def __init__(self, name, client):
+    def __init__(self, name, client, capture=None):
         super().__init__(name)
         self.type = 'Micro'
         self.client = client
+        self.capture = capture
         self.telemetry = TelemetryKeeper(name)
+        self._last_gather = None
+        self._last_lines = 0
 
     def all_configs(self):
         return {}
@@ -282,29 +724,48 @@ class Micro(Component):
         return await self.client.command(options)
 
     async def close(self):
-        return await self.client.close()
+        await self.client.close()
+        if self.capture is not None:
+            await self.capture.close()
 
     async def gather_telemetry(self):
+        serial_out = self.telemetry.telemetry_channels['serial_out']
+        capture = self.capture
         try:
             while self.client.line_available():
                 line = self.client.get_line_nowait()
                 data = line.data
+                if capture is not None:
+                    capture.write(line)
                 if isinstance(data, bytes):
                     data = data.decode('utf-8', 'backslashreplace')
                 log.debug(f'Serial Input from {self.name}: {line}')
-                self.telemetry.telemetry_channels['serial_out'].add_point(
-                    StringTelemetryPoint(
-                        'serial_out',
-                        line.time,
-                        data
-                    )
-                )
+                serial_out.append(line.time, data)
         except asyncio.QueueEmpty:
             pass
+        now = time.time()
+        channels = self.telemetry.telemetry_channels
+        if capture is not None:
+            await capture.flush()
+            if self._last_gather is not None and now > self._last_gather:
+                channels['line_rate'].append(now, (capture.lines - self._last_lines) / (now - self._last_gather))
+            self._last_gather, self._last_lines = now, capture.lines
+            channels['captured_lines'].append(now, capture.lines)
+            channels['captured_bytes'].append(now, capture.bytes)
+        stats = self.client.buffer_stats()
+        channels['dropped_lines'].append(now, stats['dropped_lines'])
+        channels['dropped_bytes'].append(now, stats['dropped_bytes'])
+        channels['buffered_bytes'].append(now, stats['bytes'] + stats['spilled_bytes'])
         await super().gather_telemetry()
 
     def _setup_telemetry(self, name):
-        self.telemetry.add_telemetry_channel(TelemetryChannel('serial_out'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('serial_out', 'string'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('line_rate', 'unit', 'lines_per_second'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('captured_lines', 'unit', 'lines'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('captured_bytes', 'unit', 'bytes'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('dropped_lines', 'unit', 'lines'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('dropped_bytes', 'unit', 'bytes'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('buffered_bytes', 'unit', 'bytes'))
 
 class HPA(Component):
     def __init__(self, name, client):
@@ -316,35 +777,19 @@ class HPA(Component):
     async def setup(self, name):
         await super().setup(name)
         await self.client.setup()
-        self.telemetry.add_telemetry_channel(TelemetryChannel('ssh_connected'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('uname_version'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('nvidia_version'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('ssh_connected', 'boolean'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('uname_version', 'string'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('nvidia_version', 'string'))
 
     async def close(self):
         return await self.client.close()
 
     async def gather_telemetry(self):
-        self.telemetry.telemetry_channels['ssh_connected'].add_point(
-            BooleanTelemetryPoint(
-                'connected',
-                time.time(),
-                self.client.is_connected()
-            )
-        )
-        self.telemetry.telemetry_channels['uname_version'].add_point(
-            StringTelemetryPoint(
-                'uname_version',
-                time.time(),
-                self.client.uname_version()
-            )
-        )
-        self.telemetry.telemetry_channels['nvidia_version'].add_point(
-            StringTelemetryPoint(
-                'nvidia_version',
-                time.time(),
-                self.client.nvidia_version()
-            )
-        )
+        now = time.time()
+        channels = self.telemetry.telemetry_channels
+        channels['ssh_connected'].append(now, self.client.is_connected())
+        channels['uname_version'].append(now, self.client.uname_version())
+        channels['nvidia_version'].append(now, self.client.nvidia_version())
 
     def is_connected(self):
         return self.client.is_connected()
@@ -359,19 +804,13 @@ class SGA(Component):
     async def setup(self, name):
         await super().setup(name)
         await self.client.setup()
-        self.telemetry.add_telemetry_channel(TelemetryChannel('ssh_connected'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('ssh_connected', 'boolean'))
 
     async def close(self):
         return await self.client.close()
 
     async def gather_telemetry(self):
-        self.telemetry.telemetry_channels['ssh_connected'].add_point(
-            BooleanTelemetryPoint(
-                'connected',
-                time.time(),
-                self.client.is_connected()
-            )
-        )
+        self.telemetry.telemetry_channels['ssh_connected'].append(time.time(), self.client.is_connected())
 
     def is_connected(self):
         return self.client.is_connected()
@@ -385,10 +824,7 @@ class PowerSupply(Component):
         self.telemetry = TelemetryKeeper(name)
 
     async def query_state(self):
-        return await self.client.supply_state()
-
-    def power_status(self):
-        return self.client.supply_state()
+        return await self.client.reading()
 
     def all_configs(self):
         return {}
@@ -411,117 +847,47 @@ class PowerSupply(Component):
                 await self.client.set_current_channel2(self.defaults['current_ch2'])
                 await self.client.set_output_channel1(self.defaults['output_ch1'])
                 await self.client.set_output_channel2(self.defaults['output_ch2'])
+                await self.client.flush()
                 return
             else:
                 func = getattr(self.client, options['command'])
-                return await func(options['value'])
+                value = await func(options['value'])
+                await self.client.flush()
+                return value
         except KeyError:
             raise CommandWarning(f'Command {options} failed.')
         except AttributeError:
             raise CommandWarning(f'Command {options} failed.')
+        except ConnectionError as e:
+            raise CommandWarning(f'Command {options} failed: {e}')
 
     async def close(self):
         return await self.client.close()
 
     async def gather_telemetry(self):
         # Get Power Status
-        power_status = await self.power_status()
-        self.telemetry.telemetry_channels['idn'].add_point(
-            StringTelemetryPoint(
-                'idn',
-                time.time(),
-                power_status[0]['idn']
-            )
-        )
-        self.telemetry.telemetry_channels['pri_meas_volt'].add_point(
-            UnitTelemetryPoint(
-                'pri_meas_volt',
-                time.time(),
-                power_status[1]['meas_voltage'],
-                'volts'
-            )
-        )
-        self.telemetry.telemetry_channels['red_meas_volt'].add_point(
-            UnitTelemetryPoint(
-                'red_meas_volt',
-                time.time(),
-                power_status[2]['meas_voltage'],
-                'volts'
-            )
-        )
-        self.telemetry.telemetry_channels['pri_set_volt'].add_point(
-            UnitTelemetryPoint(
-                'red_meas_volt',
-                time.time(),
-                power_status[1]['set_voltage'],
-                'volts'
-            )
-        )
-        self.telemetry.telemetry_channels['red_set_volt'].add_point(
-            UnitTelemetryPoint(
-                'red_meas_volt',
-                time.time(),
-                power_status[2]['set_voltage'],
-                'volts'
-            )
-        )
-        self.telemetry.telemetry_channels['pri_meas_curr'].add_point(
-            UnitTelemetryPoint(
-                'pri_meas_curr',
-                time.time(),
-                power_status[1]['meas_current'],
-                'amperes'
-            )
-        )
-        self.telemetry.telemetry_channels['red_meas_curr'].add_point(
-            UnitTelemetryPoint(
-                'red_meas_curr',
-                time.time(),
-                power_status[2]['meas_current'],
-                'amperes'
-            )
-        )
-        self.telemetry.telemetry_channels['pri_set_curr'].add_point(
-            UnitTelemetryPoint(
-                'red_meas_curr',
-                time.time(),
-                power_status[1]['set_current'],
-                'amperes'
-            )
-        )
-        self.telemetry.telemetry_channels['red_set_curr'].add_point(
-            UnitTelemetryPoint(
-                'red_meas_curr',
-                time.time(),
-                power_status[2]['set_current'],
-                'amperes'
-            )
-        )
-        self.telemetry.telemetry_channels['pri_output_enable'].add_point(
-            BooleanTelemetryPoint(
-                'pri_output_enable',
-                time.time(),
-                power_status[1]['output_enabled']
-            )
-        )
-        self.telemetry.telemetry_channels['red_output_enable'].add_point(
-            BooleanTelemetryPoint(
-                'red_output_enable',
-                time.time(),
-                power_status[2]['output_enabled']
-            )
-        )
+        reading = await self.client.reading()
+        now = time.time()
+        channels = self.telemetry.telemetry_channels
+        channels['idn'].append(now, reading.idn)
+        for prefix, number in (('pri', 1), ('red', 2)):
+            channel = reading.channels[number]
+            channels[f'{prefix}_meas_volt'].append(now, channel.meas_voltage)
+            channels[f'{prefix}_set_volt'].append(now, channel.set_voltage)
+            channels[f'{prefix}_meas_curr'].append(now, channel.meas_current)
+            channels[f'{prefix}_set_curr'].append(now, channel.set_current)
+            channels[f'{prefix}_output_enable'].append(now, channel.output_enabled)
         await super().gather_telemetry()
 
     def _setup_telemetry(self, name):
-        self.telemetry.add_telemetry_channel(TelemetryChannel('idn'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('pri_meas_volt'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('red_meas_volt'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('pri_set_volt'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('red_set_volt'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('pri_meas_curr'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('red_meas_curr'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('pri_set_curr'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('red_set_curr'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('pri_output_enable'))
-        self.telemetry.add_telemetry_channel(TelemetryChannel('red_output_enable'))
\ No newline at end of file
+        self.telemetry.add_telemetry_channel(TelemetryChannel('idn', 'string'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('pri_meas_volt', 'unit', 'volts'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('red_meas_volt', 'unit', 'volts'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('pri_set_volt', 'unit', 'volts'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('red_set_volt', 'unit', 'volts'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('pri_meas_curr', 'unit', 'amperes'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('red_meas_curr', 'unit', 'amperes'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('pri_set_curr', 'unit', 'amperes'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('red_set_curr', 'unit', 'amperes'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('pri_output_enable', 'boolean'))
+        self.telemetry.add_telemetry_channel(TelemetryChannel('red_output_enable', 'boolean'))
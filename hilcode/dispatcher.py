@@ -0,0 +1,142 @@
+import asyncio
+import time
+import logging
+from hilcode.command import CommandStatus, CommandWarning
+
+log = logging.getLogger(__name__)
+
+
+def dispatch_key(cmd):
+    """
+    Which worker a command runs on: the VCU at the head of its target.
+
+    :param cmd: Command object
+    :return: Worker key (VCU name)
+    """
+    return str(cmd.target).split('.')[0]
+
+
+class CommandWorkerStats(object):
+    """
+    Counters for one command worker.
+    """
+
+    def __init__(self):
+        self.executed = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency, failed=False):
+        """
+        Record a finished command.
+
+        :param latency: Seconds from command queued to command finished
+        :param failed: True if command raised
+        """
+        self.executed += 1
+        if failed:
+            self.failed += 1
+        self.total_latency += latency
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+
+
+class CommandDispatcher(object):
+    """
+    Runs commands on one worker per target VCU.  Commands to different VCUs run at the same time, commands to the
+    same VCU run one at a time in the order received.
+    """
+
+    def __init__(self, execute, check_key=None):
+        """
+        Create a command dispatcher.
+
+        :param execute: Coroutine function taking a command, which executes it
+        :param check_key: (optional) Function called with a worker key before its worker is created, raising
+                          CommandWarning (like RoutingError) if it doesn't name a VCU
+        """
+        self._execute = execute
+        self._check_key = check_key
+        self.rejected = 0
+        self._queues = {}
+        self._workers = {}
+        self._stats = {}
+
+    def submit(self, cmd):
+        """
+        Queue a command on its VCU's worker.  Never blocks.  A command whose target doesn't name a VCU is finished
+        with a warning instead, so a typo doesn't leave a worker behind.
+
+        :param cmd: Command object
+        :return: True/False if command was queued
+        """
+        key = dispatch_key(cmd)
+        if key not in self._queues:
+            if self._check_key is not None:
+                try:
+                    self._check_key(key)
+                except CommandWarning as e:
+                    self.rejected += 1
+                    cmd.finish(CommandStatus.WARNING, warning=str(e))
+                    return False
+            self._queues[key] = asyncio.Queue()
+            self._stats[key] = CommandWorkerStats()
+            self._workers[key] = asyncio.create_task(self._worker(key))
+        self._queues[key].put_nowait((time.monotonic(), cmd))
+        return True
+
+    def queue_depth(self, key):
+        """
+        Number of commands waiting on a VCU's worker.
+
+        :param key: Worker key (VCU name)
+        :return: Number of commands waiting
+        """
+        queue = self._queues.get(key)
+        return 0 if queue is None else queue.qsize()
+
+    def stats(self):
+        """
+        Per worker queue depth and command latency.
+
+        :return: Dictionary of {worker key: statistics}
+        """
+        return {key: {
+            'queue_depth': self._queues[key].qsize(),
+            'executed': stats.executed,
+            'failed': stats.failed,
+            'last_latency': stats.last_latency,
+            'max_latency': stats.max_latency,
+            'mean_latency': stats.total_latency / stats.executed if stats.executed else 0.0,
+        } for key, stats in self._stats.items()}
+
+    async def close(self):
+        """
+        Stop all workers, dropping anything still queued.
+        """
+        for task in self._workers.values():
+            task.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers = {}
+        self._queues = {}
+        self._stats = {}
+
+    async def _worker(self, key):
+        """
+        Coroutine that executes one VCU's commands in order.
+
+        :param key: Worker key (VCU name)
+        """
+        queue = self._queues[key]
+        stats = self._stats[key]
+        while True:
+            queued_at, cmd = await queue.get()
+            failed = False
+            try:
+                await self._execute(cmd)
+            except Exception:
+                failed = True
+                log.exception(f'COMMAND ERROR {cmd}')
+            stats.record(time.monotonic() - queued_at, failed=failed)
@@ -2,6 +2,8 @@ import asyncio
 import asyncssh
 import socket
 import logging
+from hilcode.ssh_session import VCUSSHSession
+from hilcode.lifecycle import DriverTask
 
 log = logging.getLogger(__name__)
 
@@ -12,7 +14,7 @@ class VCUHPA(object):
     Interface library for talking with HPA
     """
 
-    def __init__(self, sga_host, hpa_host, sga_port=22, port=22):
+    def __init__(self, sga_host, hpa_host, sga_port=22, port=22, session=None):
         """
         VCUHPA Interface object
 
@@ -20,14 +22,19 @@ class VCUHPA(object):
         :param hpa_host: HPA Hostname/IP (from SGA)
         :param sga_port: SGA SSH Port (default is 22)
         :param port: HPA SSH Port (default is 22)
+        :param session: (optional) Shared VCUSSHSession for this VCU, one is created if not given
         """
         self.sga_host = sga_host
         self.sga_port = sga_port
         self.host = hpa_host
         self.port = port
-        self._pinger_task = None
+        self._owns_session = session is None
+        if session is None:
+            session = VCUSSHSession(sga_host, sga_port)
+        self.session = session
+        self._pinger = DriverTask('hpa_pinger')
         self._pinger_connected = asyncio.Event()
-        self._pinger_stop = asyncio.Event()
+        self.cycle_time = PINGER_CYCLE_TIME
         self._pinger_version_uname = asyncio.Queue(1)
         self._pinger_version_nvidia = asyncio.Queue(1)
         self._pinger_last_version_uname = 'not connected'
@@ -38,32 +45,14 @@ class VCUHPA(object):
         """
         Coroutine that implements the pinger and version checker.
         """
-        while not self._pinger_stop.is_set():
-            await asyncio.sleep(PINGER_CYCLE_TIME)
+        while await self._pinger.sleep(self.cycle_time):
             try:
-                async with await asyncio.wait_for(asyncssh.connect(
-                    self.sga_host,
-                    port=self.sga_port,
-                    username = 'root',
-                    password='root',
-                    preferred_auth='password',
-                    known_hosts=None,
-                    login_timeout=10,
-                ), timeout=10) as sga_conn:
-                    async with await asyncio.wait_for(asyncssh.connect(
-                        self.host,
-                        port=self.port,
-                        tunnel=sga_conn,
-                        username = 'root',
-                        password='root',
-                        preferred_auth='password',
-                        known_hosts=None,
-                        login_timeout=10,
-                    ), timeout=10) as conn:
-                        uname_result = await asyncio.wait_for(conn.run(
-                            'uname -a', check=True), timeout=10)
-                        nvidia_result = await asyncio.wait_for(conn.run(
-                            'cat /usr/libnvidia/version-pdk.txt', check=True), timeout=10)
+                # Version checks run as new channels on the shared HPA connection (tunneled through SGA)
+                conn = await self.session.hpa(self.host, self.port)
+                uname_result = await asyncio.wait_for(conn.run(
+                    'uname -a', check=True), timeout=10)
+                nvidia_result = await asyncio.wait_for(conn.run(
+                    'cat /usr/libnvidia/version-pdk.txt', check=True), timeout=10)
                 if uname_result.exit_status == 0 and nvidia_result.exit_status == 0:
                     # ping succeeded
                     self._pinger_connected.set()
@@ -76,14 +65,28 @@ class VCUHPA(object):
                 else:
                     # ping failed
                     self._pinger_connected.clear()
-            except asyncio.exceptions.TimeoutError:
+            except ConnectionRefusedError:
+                # Includes reconnect backoff, connection already dropped
                 self._pinger_connected.clear()
-            except OSError:
+            except asyncssh.ProcessError:
+                # Command failed, but the session itself is fine
                 self._pinger_connected.clear()
+            except (asyncio.exceptions.TimeoutError, OSError, asyncssh.Error):
+                self._pinger_connected.clear()
+                self.session.drop_hpa(self.host, self.port)
             except Exception as e:
-                log.error(f'WTF HPA ERROR!!! {e.format_exc()}')
+                log.error(f'WTF HPA ERROR!!! {e}')
                 raise e
 
+    def set_cycle_time(self, cycle_time):
+        """
+        Change how often the HPA is pinged, and ping now.
+
+        :param cycle_time: Seconds between pings
+        """
+        self.cycle_time = cycle_time
+        self._pinger.wake()
+
     def is_connected(self):
         """
         Is the HPA currently connected?
@@ -126,14 +129,14 @@ class VCUHPA(object):
         """
         Setup of VCU HPA (starts pinger and version checker)
         """
-        self._pinger_stop.clear()
         self._pinger_connected.clear()
-        self._pinger_task = asyncio.create_task(self.pinger_loop())
+        self._pinger.start(self.pinger_loop())
 
     async def close(self):
         """
         Close VCU HPA (stop pinger and version checker)
         """
-        self._pinger_stop.set()
-        while not self._pinger_task.done():
-            await asyncio.sleep(0.1)
\ No newline at end of file
+        # Nothing in a ping is worth finishing, cancel it rather than wait out a stuck connect
+        await self._pinger.stop(timeout=0)
+        if self._owns_session:
+            await self.session.close()
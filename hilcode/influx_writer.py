@@ -0,0 +1,318 @@
+import asyncio
+import functools
+import time
+import logging
+from influxdb import InfluxDBClient
+
+log = logging.getLogger(__name__)
+
+QUEUE_SIZE = 20000
+BATCH_SIZE = 5000
+BATCH_AGE = 1.0
+# Seconds close() spends writing what is left, lines still waiting after that are dropped
+CLOSE_TIMEOUT = 5.0
+# Channels not written to influx (serial output goes to serial capture files instead)
+EXCLUDE_CHANNELS = ('serial_out',)
+
+
+def tags_compute(name):
+    """
+    Split a dotted telemetry name into an influx measurement name and tags.
+
+    :param name: Fully qualified telemetry name (HIL.VCU.subcomponent.channel)
+    :return: Tuple of (measurement, tags dictionary)
+    """
+    tags = name.split('.')
+    if len(tags) == 2:
+        return (tags[-1], {
+            'HIL': tags[0]
+        })
+    elif len(tags) == 3:
+        return (tags[-1], {
+            'HIL': tags[0],
+            'VCU': tags[1],
+        })
+    else:
+        return (tags[-1], {
+            'HIL': tags[0],
+            'VCU': tags[1],
+            'subcomponent': tags[2],
+        })
+
+
+def _escape_key(key):
+    """
+    Escape a measurement name, tag key or tag value for line protocol.
+
+    :param key: String to escape
+    :return: Escaped string
+    """
+    return str(key).replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ').replace('=', '\\=')
+
+
+def _format_value(point_type, value):
+    """
+    Format a telemetry value as a line protocol field value.  Other types (like 'default', a channel whose type
+    was never given) are written as strings, one odd channel mustn't stop the rest of the telemetry being written.
+
+    :param point_type: Telemetry point type ('unit', 'float', 'string', 'boolean')
+    :param value: Telemetry value
+    :return: Line protocol field value
+    """
+    if point_type == 'unit' or point_type == 'float':
+        return repr(float(value))
+    elif point_type == 'boolean':
+        return 'true' if value else 'false'
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'"{value}"'
+
+
+def _series_key(name):
+    """
+    Line protocol measurement and tag set for a telemetry name.
+
+    :param name: Fully qualified telemetry name
+    :return: Escaped 'measurement,tag=value,...' string
+    """
+    measurement, tags = tags_compute(name)
+    tag_str = ''.join(f',{_escape_key(k)}={_escape_key(v)}' for k, v in tags.items())
+    return f'{_escape_key(measurement)}{tag_str}'
+
+
+def line_protocol(name, point_type, value, timestamp):
+    """
+    Convert one telemetry point to an influx line protocol string.
+
+    :param name: Fully qualified telemetry name
+    :param point_type: Telemetry point type
+    :param value: Telemetry value
+    :param timestamp: UNIX timestamp (seconds, float)
+    :return: Line protocol string
+    """
+    return f'{_series_key(name)} value={_format_value(point_type, value)} {int(timestamp * 1e9)}'
+
+
+class InfluxWriter(object):
+    """
+    Background writer stage that batches telemetry into influx with a single long-lived client.
+    """
+
+    def __init__(self,
+                 host='localhost',
+                 port=8086,
+                 username='vcuhil',
+                 password='vcuhil_password123',
+                 database='vcuhil',
+                 queue_size=QUEUE_SIZE,
+                 batch_size=BATCH_SIZE,
+                 batch_age=BATCH_AGE,
+                 exclude_channels=EXCLUDE_CHANNELS,
+                 client=None):
+        """
+        Create an influx writer stage.
+
+        :param host: Influx hostname
+        :param port: Influx port (default is 8086)
+        :param username: Influx username
+        :param password: Influx password
+        :param database: Influx database
+        :param queue_size: Maximum number of lines waiting to be written, further lines are dropped
+        :param batch_size: Flush once this many lines are waiting
+        :param batch_age: Flush once the oldest waiting line is this many seconds old
+        :param exclude_channels: Channel names (last part of telemetry name) that are not written
+        :param client: (optional) Pre-built client with a write_points() method
+        """
+        if client is None:
+            client = InfluxDBClient(host, port, username, password, database)
+        self._client = client
+        self._queue = asyncio.Queue(queue_size)
+        self._batch_size = batch_size
+        self._batch_age = batch_age
+        self._task = None
+        # Lines taken off the queue but not written yet, and the write in progress
+        self._pending = []
+        self._writing = None
+        self._writing_lines = 0
+        self._closing = False
+        self._series = {}
+        self._exclude_channels = frozenset(exclude_channels)
+        self.dropped_points = 0
+        self.written_points = 0
+        self.batches = 0
+        self.write_errors = 0
+
+    async def start(self):
+        """
+        Start writer task.
+        """
+        self._closing = False
+        self._task = asyncio.create_task(self._writer_loop())
+
+    async def close(self, timeout=CLOSE_TIMEOUT):
+        """
+        Stop writer task, then write everything it hadn't: the write it was doing, the batch it was collecting and
+        what is still queued.
+
+        :param timeout: Seconds to spend writing, lines not written by then are dropped and counted
+        """
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        # Cancelling alone isn't enough, asyncio.wait_for can swallow a cancellation that races its result
+        self._closing = True
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        while not self._queue.empty():
+            self._pending.append(self._queue.get_nowait())
+        try:
+            await asyncio.wait_for(self._write_remaining(), timeout=timeout)
+        except asyncio.TimeoutError:
+            unwritten = len(self._pending)
+            if self._writing is not None and not self._writing.done():
+                # Stop waiting on the write, its lines may or may not reach influx
+                self._writing.cancel()
+                unwritten += self._writing_lines
+            self.dropped_points += unwritten
+            log.warning(f'Influx writer closed with {unwritten} points not written after {timeout}s')
+            self._pending = []
+            self._writing = None
+
+    def submit(self, ts_data):
+        """
+        Queue timestamped telemetry for writing.  Never blocks, if the queue is full points are dropped and counted.
+
+        :param ts_data: Dictionary of {timestamp: [point dictionaries]} (see TelemetryKeeper.timestamped_data)
+        :return: Number of points accepted
+        """
+        accepted = 0
+        for timestamp, tpoints in ts_data.items():
+            for tpoint in tpoints:
+                if self._excluded(tpoint['name']):
+                    continue
+                if self.submit_line(line_protocol(tpoint['name'], tpoint['type'], tpoint['value'], timestamp)):
+                    accepted += 1
+        return accepted
+
+    def add(self, timestamp, name, point_type, value, unit):
+        """
+        Queue one telemetry record for writing (consumer stage for TelemetryKeeper.drain_to).  Never blocks, if the
+        queue is full the point is dropped and counted.
+
+        :param timestamp: UNIX timestamp (seconds, float)
+        :param name: Fully qualified telemetry name
+        :param point_type: Telemetry point type
+        :param value: Telemetry value
+        :param unit: Telemetry unit (not written)
+        :return: True/False if point was accepted
+        """
+        series = self._series.get(name)
+        if series is None:
+            series = self._series[name] = '' if self._excluded(name) else _series_key(name)
+        if not series:
+            return False
+        return self.submit_line(f'{series} value={_format_value(point_type, value)} {int(timestamp * 1e9)}')
+
+    def _excluded(self, name):
+        """
+        Is a telemetry name excluded from influx?
+
+        :param name: Fully qualified telemetry name
+        :return: True/False if excluded
+        """
+        return name.rsplit('.', 1)[-1] in self._exclude_channels
+
+    def submit_line(self, line):
+        """
+        Queue a single line protocol string for writing.  Never blocks.
+
+        :param line: Line protocol string
+        :return: True/False if line was accepted
+        """
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except asyncio.QueueFull:
+            self.dropped_points += 1
+            return False
+
+    def stats(self):
+        """
+        Writer counters.
+
+        :return: Dictionary of writer counters
+        """
+        return {
+            'queue_depth': self._queue.qsize(),
+            'dropped_points': self.dropped_points,
+            'written_points': self.written_points,
+            'batches': self.batches,
+            'write_errors': self.write_errors,
+        }
+
+    async def _writer_loop(self):
+        """
+        Coroutine that collects lines from queue and flushes them by size or age.  The batch being collected is kept
+        in _pending, so close() can still write it.
+        """
+        while not self._closing:
+            batch = self._pending
+            batch.append(await self._queue.get())
+            deadline = time.monotonic() + self._batch_age
+            while len(batch) < self._batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Take everything already waiting before sleeping again
+                while not self._queue.empty() and len(batch) < self._batch_size:
+                    batch.append(self._queue.get_nowait())
+                if len(batch) >= self._batch_size:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            self._pending = []
+            await self._write(batch)
+
+    async def _write(self, batch):
+        """
+        Flush a batch, carrying on with the write if the caller is cancelled (like the writer task at close()).
+
+        :param batch: List of line protocol strings
+        """
+        self._writing = asyncio.ensure_future(self._flush(batch))
+        self._writing_lines = len(batch)
+        await asyncio.shield(self._writing)
+        self._writing = None
+
+    async def _write_remaining(self):
+        """
+        Finish the write in progress, then write everything in _pending, a batch at a time.
+        """
+        if self._writing is not None:
+            await asyncio.shield(self._writing)
+            self._writing = None
+        while self._pending:
+            batch = self._pending[:self._batch_size]
+            del self._pending[:len(batch)]
+            await self._write(batch)
+
+    async def _flush(self, batch):
+        """
+        Write a batch of lines to influx without blocking the event loop.
+
+        :param batch: List of line protocol strings
+        """
+        loop = asyncio.get_running_loop()
+        write = functools.partial(self._client.write_points, batch, time_precision='n', protocol='line')
+        try:
+            await loop.run_in_executor(None, write)
+            self.written_points += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.write_errors += 1
+            self.dropped_points += len(batch)
+            log.warning(f'Influx write of {len(batch)} points failed: {e}')
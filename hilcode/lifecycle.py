@@ -0,0 +1,100 @@
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+# Seconds a driver task gets to finish on its own after being told to stop, before it is cancelled
+STOP_TIMEOUT = 1.0
+
+
+class DriverTask(object):
+    """
+    Background task of a hardware driver.  The task sleeps with sleep(), which returns as soon as it is woken or
+    told to stop, so stop() takes as long as the task's current step.  A task that doesn't finish by the deadline
+    (like one stuck connecting) is cancelled.
+    """
+
+    def __init__(self, name):
+        """
+        Create a driver task.
+
+        :param name: Name of task, for logs
+        """
+        self.name = name
+        self.task = None
+        self._stop = asyncio.Event()
+        self._wake = asyncio.Event()
+
+    def start(self, coro):
+        """
+        Start task.
+
+        :param coro: Coroutine the task runs, which should return once stopping() is True
+        """
+        self._stop.clear()
+        self._wake.clear()
+        self.task = asyncio.create_task(coro, name=self.name)
+        self.task.add_done_callback(self._done)
+
+    def _done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f'Driver task {self.name} failed: {task.exception()!r}')
+
+    def running(self):
+        """
+        Is task running?
+
+        :return: True/False if task running
+        """
+        return self.task is not None and not self.task.done()
+
+    def stopping(self):
+        """
+        Has task been told to stop?
+
+        :return: True/False if task should stop
+        """
+        return self._stop.is_set()
+
+    def wake(self):
+        """
+        End the task's current sleep() early.
+        """
+        self._wake.set()
+
+    async def sleep(self, seconds):
+        """
+        Sleep until woken, told to stop, or seconds have passed.
+
+        :param seconds: Seconds to sleep
+        :return: True if task should keep running, False if it has been told to stop
+        """
+        if not self._wake.is_set() and not self._stop.is_set():
+            handle = asyncio.get_running_loop().call_later(seconds, self._wake.set)
+            try:
+                await self._wake.wait()
+            finally:
+                handle.cancel()
+        self._wake.clear()
+        return not self._stop.is_set()
+
+    async def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Tell task to stop and wait for it, cancelling it if it takes longer than timeout.
+
+        :param timeout: Seconds to wait before cancelling (0 cancels straight away)
+        """
+        self._stop.set()
+        self._wake.set()
+        task, self.task = self.task, None
+        if task is None or task.done():
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.debug(f'Driver task {self.name} did not stop within {timeout}s, cancelling')
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        except Exception:
+            # Already logged when task finished
+            pass
@@ -1,10 +1,20 @@
 import asyncio
+import re
 import time
 import serial_asyncio
 import logging
+from hilcode.serial_buffer import SerialLineBuffer, BUFFER_BYTES, DROP_OLDEST
+from hilcode.lifecycle import STOP_TIMEOUT
 
 log = logging.getLogger(__name__)
 
+MAX_LINE_LENGTH = 4096
+EXPECT_TIMEOUT = 10.0
+# With no pattern to expect, output is done once the port has been quiet this long
+QUIET_TIME = 0.1
+# Waiting for a prompt after waking the console
+WAKE_TIMEOUT = 1.0
+
 
 class SerialLine(object):
     """
@@ -29,26 +39,120 @@ class SerialLine(object):
         return f'{self.time}: {self.data}'
 
 
+class SerialLineProtocol(asyncio.Protocol):
+    """
+    Serial port protocol that splits incoming bytes into timestamped lines as they arrive.  Nothing runs while the
+    port is quiet.
+    """
+
+    def __init__(self, lines, line_ready, listeners=(), partial_listeners=()):
+        """
+        Create a serial line protocol.
+
+        :param lines: SerialLineBuffer that complete SerialLines are appended to
+        :param line_ready: Event set whenever lines are appended
+        :param listeners: Functions called with each complete SerialLine as it arrives
+        :param partial_listeners: Functions called with the unterminated end of the input (bytes, like a prompt)
+                                  whenever some arrives
+        """
+        self.transport = None
+        self.lines = lines
+        self.line_ready = line_ready
+        self.listeners = listeners
+        self.partial_listeners = partial_listeners
+        self.closed = asyncio.Event()
+        self._buffer = bytearray()
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        buffer = self._buffer
+        start = len(buffer)
+        buffer.extend(data)
+        if buffer.find(b'\n', start) < 0 and len(buffer) < MAX_LINE_LENGTH:
+            self._partial()
+            return
+        # Every line in one chunk arrived at the same time, timestamp them together
+        now = time.time()
+        lines = buffer.split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            line = SerialLine(now, bytes(line.rstrip(b'\r')))
+            for listener in self.listeners:
+                listener(line)
+            self.lines.append(line)
+        del buffer[:len(buffer) - len(remainder)]
+        if len(buffer) >= MAX_LINE_LENGTH:
+            # No line ending in sight, don't let one line grow without bound
+            self.lines.append(SerialLine(now, bytes(buffer)))
+            buffer.clear()
+        self.line_ready.set()
+        self._partial()
+
+    def pending_bytes(self):
+        """
+        Length of the unterminated line received so far (like a prompt).
+
+        :return: Number of bytes
+        """
+        return len(self._buffer)
+
+    def _partial(self):
+        if self._buffer and self.partial_listeners:
+            partial = bytes(self._buffer)
+            for listener in self.partial_listeners:
+                listener(partial)
+
+    def connection_lost(self, exc):
+        if self._buffer:
+            self.lines.append(SerialLine(time.time(), bytes(self._buffer)))
+            self._buffer.clear()
+            self.line_ready.set()
+        if exc is not None:
+            log.warning(f'Serial connection lost: {exc}')
+        self._can_write.set()
+        self.closed.set()
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._can_write.set()
+
+    async def drain(self):
+        """
+        Wait until transport has room for more writes.
+        """
+        await self._can_write.wait()
+
+
 class VCUSerialDevice(object):
     """
     Abstraction layer for VCU Serial Device
     """
 
-    def __init__(self):
+    def __init__(self, buffer_bytes=BUFFER_BYTES, overflow=DROP_OLDEST):
         """
         Create VCU Serial Device
+
+        :param buffer_bytes: Bytes of serial lines held until they are taken
+        :param overflow: What to do when buffer is full ('drop_oldest', 'drop_newest' or 'spill' to disk)
         """
-        self.reader = None
-        self.writer = None
-        self.line_reader_queue = asyncio.Queue()
-        self.line_reader_exit = asyncio.Event()
-        self._line_reader_task = None
+        self.transport = None
+        self.protocol = None
+        self.lines = SerialLineBuffer(buffer_bytes, overflow, line_class=SerialLine)
+        self.line_ready = asyncio.Event()
+        self.listeners = []
+        self.partial_listeners = []
 
     async def start(self):
         """
-        Start vehicle task
+        Start vehicle task (lines are read as they arrive, there is nothing to start)
         """
-        self._line_reader_task = asyncio.create_task(self.line_reader())
+        pass
 
     async def connect(self, serial, baudrate=115200):
         """
@@ -58,45 +162,78 @@ class VCUSerialDevice(object):
         :param baudrate: Baud rate of serial port (default is 115200 baud)
         """
         logging.info(f'CONNECTING to serial device {serial} at baud rate {baudrate}')
-        self.reader, self.writer = await serial_asyncio.open_serial_connection(url=serial, baudrate=baudrate)
+        self.transport, self.protocol = await serial_asyncio.create_serial_connection(
+            asyncio.get_running_loop(),
+            lambda: SerialLineProtocol(self.lines, self.line_ready, self.listeners, self.partial_listeners),
+            serial,
+            baudrate=baudrate
+        )
         logging.debug('CONNECTED to serial device')
 
     async def close(self):
         """
         Close serial port
         """
-        self.line_reader_exit.set()
-        while not self._line_reader_task.done():
-            await asyncio.sleep(0.1)
-        self.writer.close()
-        await self.writer.wait_closed()
+        if self.transport is not None:
+            self.transport.close()
+            try:
+                await asyncio.wait_for(self.protocol.closed.wait(), timeout=STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Writes still pending on a stuck port, drop them
+                self.transport.abort()
+        self.lines.close()
+
+    def add_line_listener(self, listener):
+        """
+        Call a function with every serial line as soon as it arrives (before it is buffered).  Listeners run in the
+        event loop's read callback, so they have to be quick and must not block.
+
+        :param listener: Function called as listener(SerialLine)
+        """
+        self.listeners.append(listener)
+
+    def add_partial_listener(self, listener):
+        """
+        Call a function with the unterminated end of the input (like a prompt) whenever some of it arrives.  Same
+        rules as line listeners.
+
+        :param listener: Function called as listener(bytes)
+        """
+        self.partial_listeners.append(listener)
 
-    async def line_reader(self):
+    async def wait_line(self, timeout=None):
         """
-        Coroutine that runs in background, timestamps incoming serial lines, and places in queue.
+        Wait until a serial line is available.
+
+        :param timeout: (optional) Seconds to wait
+        :return: True/False if a serial line is available
         """
-        while not self.line_reader_exit.is_set():
+        if not self.lines:
+            self.line_ready.clear()
             try:
-                await self.line_reader_queue.put(
-                    SerialLine(
-                        time.time(),
-                        await asyncio.wait_for(self.reader.readline(), timeout=0.1)
-                    )
-                )
+                await asyncio.wait_for(self.line_ready.wait(), timeout=timeout)
             except asyncio.TimeoutError:
-                # Buffer is clear
                 pass
-            except Exception as e:
-                log.error('WTF!!!!')
-                raise e
+        return bool(self.lines)
 
     def get_line_nowait(self):
         """
-        Get latest serial line from queue.
+        Get oldest serial line received.
+
+        :return: Oldest serial line, or a asyncio.QueueEmpty exception
+        """
+        try:
+            return self.lines.popleft()
+        except IndexError:
+            raise asyncio.QueueEmpty()
 
-        :return: Latest serial line, or a asyncio.QueueEmpty exception
+    def buffer_stats(self):
         """
-        return self.line_reader_queue.get_nowait()
+        Serial buffer counters (lines and bytes held, dropped and spilled).
+
+        :return: Dictionary of buffer counters
+        """
+        return self.lines.stats()
 
     def line_available(self):
         """
@@ -104,22 +241,100 @@ class VCUSerialDevice(object):
 
         :return: True/False if new serial line available
         """
-        return not self.line_reader_queue.empty()
+        return bool(self.lines)
 
-    async def command(self, command):
+    async def _write(self, data):
+        """
+        Write to serial port, waiting if transport is full.
+
+        :param data: Bytes to write
+        """
+        self.transport.write(data)
+        await self.protocol.drain()
+
+    async def expect(self, command=None, pattern=None, timeout=EXPECT_TIMEOUT, quiet=QUIET_TIME):
         """
-        Send a command out the serial port
+        Send a command and collect the lines that come back, until a pattern matches (in a line, or in an
+        unterminated prompt), or until timeout.  Without a pattern, output is done once the port has been quiet
+        for quiet seconds after the first data comes back (a console slow to echo isn't taken as silent).  Only
+        data received after the command is written is matched, so a prompt that was already waiting (or that an
+        earlier expect matched) doesn't end collection.
 
-        :param command: Command to send
+        :param command: (optional) Command to send, None only collects
+        :param pattern: (optional) Regular expression (str or bytes) that ends collection, like a shell prompt
+        :param timeout: Seconds to wait for pattern
+        :param quiet: Seconds of silence, after the first data received, that end collection when there is no
+                      pattern
+        :return: Dictionary of {'lines': [lines received], 'matched': True/False if pattern was seen}
         """
-        self.writer.write('\r\n'.encode())
-        await self.writer.drain()
-        await asyncio.sleep(0.1)
-        cmd = command['command']
-        log.debug(f'WRITING: {cmd}')
-        self.writer.write(f'{cmd}\r\n'.encode())
-        await self.writer.drain()
-        await asyncio.sleep(0.1)
+        if isinstance(pattern, str):
+            pattern = pattern.encode()
+        regex = re.compile(pattern) if pattern is not None else None
+        loop = asyncio.get_running_loop()
+        lines = []
+        matched = asyncio.Event()
+        activity = asyncio.Event()
+        # Bytes of the current line that arrived before the command was written
+        stale = [self.protocol.pending_bytes() if self.protocol is not None else 0]
+
+        def collect(line):
+            lines.append(line)
+            activity.set()
+            data, stale[0] = line.data[stale[0]:], 0
+            if regex is not None and regex.search(data):
+                matched.set()
+
+        def collect_partial(partial):
+            activity.set()
+            if regex is not None and regex.search(partial[stale[0]:]):
+                matched.set()
 
+        self.listeners.append(collect)
+        self.partial_listeners.append(collect_partial)
+        try:
+            if command is not None:
+                log.debug(f'WRITING: {command}')
+                await self._write(f'{command}\r\n'.encode())
+            deadline = loop.time() + timeout
+            if regex is not None:
+                try:
+                    await asyncio.wait_for(matched.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # Wait for the response to start before timing silence
+                try:
+                    await asyncio.wait_for(activity.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                while activity.is_set() and loop.time() < deadline:
+                    activity.clear()
+                    try:
+                        await asyncio.wait_for(activity.wait(), timeout=min(quiet, deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        break
+        finally:
+            self.listeners.remove(collect)
+            self.partial_listeners.remove(collect_partial)
+        return {
+            'lines': [line.data.decode('utf-8', 'backslashreplace') for line in lines],
+            'matched': matched.is_set(),
+        }
 
+    async def command(self, command):
+        """
+        Send a command out the serial port, and collect its output.
 
+        :param command: Command options, {'command': command to send, 'expect': (optional) regex ending output
+                        such as a prompt, 'timeout': (optional) seconds to wait for it, 'quiet': (optional) seconds
+                        of silence ending output when there is nothing to expect}
+        :return: Dictionary of {'lines': [lines received], 'matched': True/False if expected pattern was seen}
+        """
+        pattern = command.get('expect')
+        timeout = command.get('timeout') or EXPECT_TIMEOUT
+        if pattern is not None:
+            # Wake console and wait for its prompt, so the prompt isn't mistaken for the end of the output
+            await self.expect('', pattern, timeout=min(timeout, WAKE_TIMEOUT))
+            return await self.expect(command['command'], pattern, timeout=timeout)
+        await self._write('\r\n'.encode())
+        return await self.expect(command['command'], timeout=timeout, quiet=command.get('quiet') or QUIET_TIME)
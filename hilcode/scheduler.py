@@ -0,0 +1,243 @@
+import asyncio
+import collections
+import resource
+import logging
+
+log = logging.getLogger(__name__)
+
+JOB_TIMEOUT = 10
+# Seconds between cancels of jobs that haven't stopped yet
+CANCEL_RETRY = 0.1
+# Event loop lag is sampled this often, and the last LAG_SAMPLES samples kept
+LAG_INTERVAL = 0.05
+LAG_SAMPLES = 1200
+
+
+async def _cancel_tasks(tasks):
+    """
+    Cancel tasks and wait for them to end.
+
+    :param tasks: Set of tasks
+    """
+    while tasks:
+        # A cancel landing just as a job finishes can be swallowed by wait_for, so cancel again until gone
+        for task in tasks:
+            task.cancel()
+        _, tasks = await asyncio.wait(tasks, timeout=CANCEL_RETRY)
+
+
+class PeriodicJob(object):
+    """
+    A coroutine function run at a fixed rate, with timing statistics.
+    """
+
+    def __init__(self, name, period, func, timeout=JOB_TIMEOUT):
+        """
+        Create a periodic job.
+
+        :param name: Name of job
+        :param period: Seconds between job starts
+        :param func: Coroutine function (no arguments) to run each period
+        :param timeout: Seconds before a single run is cancelled (default is JOB_TIMEOUT)
+        """
+        self.name = name
+        self.period = period
+        self.func = func
+        self.timeout = timeout
+        self.runs = 0
+        self.overruns = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+
+    def stats(self):
+        """
+        Job timing statistics.
+
+        :return: Dictionary of job statistics
+        """
+        return {
+            'period': self.period,
+            'runs': self.runs,
+            'overruns': self.overruns,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'last_duration': self.last_duration,
+            'max_duration': self.max_duration,
+        }
+
+
+class Scheduler(object):
+    """
+    Runs every periodic job as its own task, so a slow job only delays itself.
+    """
+
+    def __init__(self):
+        """
+        Create an empty scheduler.
+        """
+        self.jobs = {}
+        self._tasks = {}
+        self._running = False
+
+    def add_job(self, name, period, func, timeout=JOB_TIMEOUT):
+        """
+        Add a periodic job.  Starts immediately if scheduler is already running.
+
+        :param name: Name of job
+        :param period: Seconds between job starts
+        :param func: Coroutine function (no arguments) to run each period
+        :param timeout: Seconds before a single run is cancelled
+        :return: The periodic job
+        """
+        job = PeriodicJob(name, period, func, timeout=timeout)
+        self.jobs[name] = job
+        if self._running:
+            self._tasks[name] = asyncio.create_task(self._job_loop(job))
+        return job
+
+    async def remove_job(self, name):
+        """
+        Stop and remove a periodic job.
+
+        :param name: Name of job
+        """
+        self.jobs.pop(name)
+        task = self._tasks.pop(name, None)
+        if task is not None:
+            await _cancel_tasks({task})
+
+    async def start(self):
+        """
+        Start all jobs.
+        """
+        self._running = True
+        for name, job in self.jobs.items():
+            self._tasks[name] = asyncio.create_task(self._job_loop(job))
+
+    async def close(self):
+        """
+        Stop all jobs.
+        """
+        self._running = False
+        await _cancel_tasks(set(self._tasks.values()))
+        self._tasks = {}
+
+    def stats(self):
+        """
+        Timing statistics for every job.
+
+        :return: Dictionary of {job name: job statistics}
+        """
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+    async def _job_loop(self, job):
+        """
+        Coroutine that runs one job at its rate.  Runs that go past the next start are counted as overruns, and
+        the missed starts are skipped rather than run back to back.
+
+        :param job: Periodic job to run
+        """
+        loop = asyncio.get_running_loop()
+        next_run = loop.time()
+        while True:
+            start = loop.time()
+            try:
+                await asyncio.wait_for(job.func(), timeout=job.timeout)
+            except asyncio.TimeoutError:
+                job.timeouts += 1
+                log.warning(f'Job {job.name} timed out after {job.timeout}s')
+            except Exception:
+                job.errors += 1
+                log.exception(f'Job {job.name} failed')
+            job.runs += 1
+            job.last_duration = loop.time() - start
+            job.max_duration = max(job.max_duration, job.last_duration)
+            next_run += job.period
+            now = loop.time()
+            if now > next_run:
+                job.overruns += 1
+                log.warning(f'Job {job.name} overran period {job.period}s (took {job.last_duration:.3f}s)')
+                next_run = now
+            await asyncio.sleep(next_run - now)
+
+
+def memory_usage():
+    """
+    Memory used by this process.
+
+    :return: Dictionary of {'rss_bytes': resident set size (None where /proc is missing), 'max_rss_bytes': peak}
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            rss = int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        rss = None
+    return {'rss_bytes': rss, 'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+
+class LoopMonitor(object):
+    """
+    Measures event loop lag: how late a sleep that should have ended every interval actually wakes up.  Lag is the
+    time callbacks waited for the loop, so it grows as the loop saturates.
+    """
+
+    def __init__(self, interval=LAG_INTERVAL, samples=LAG_SAMPLES):
+        """
+        Create a loop monitor.
+
+        :param interval: Seconds between lag samples
+        :param samples: Number of recent samples kept for statistics
+        """
+        self.interval = interval
+        self.max_lag = 0.0
+        self._lags = collections.deque(maxlen=samples)
+        self._task = None
+
+    async def start(self):
+        """
+        Start sampling.
+        """
+        self._task = asyncio.create_task(self._monitor_loop())
+
+    async def close(self):
+        """
+        Stop sampling.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def reset(self):
+        """
+        Forget samples so far.
+        """
+        self.max_lag = 0.0
+        self._lags.clear()
+
+    def stats(self):
+        """
+        Lag statistics over recent samples, and process memory.
+
+        :return: Dictionary of lag statistics (seconds) and memory usage (see memory_usage)
+        """
+        lags = sorted(self._lags)
+        return {
+            'samples': len(lags),
+            'mean_lag': sum(lags) / len(lags) if lags else 0.0,
+            'p99_lag': lags[int(len(lags) * 0.99)] if lags else 0.0,
+            'max_lag': self.max_lag,
+            **memory_usage(),
+        }
+
+    async def _monitor_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self._lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
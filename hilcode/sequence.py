@@ -0,0 +1,271 @@
+import asyncio
+import time
+import logging
+from hilcode.command import Command, CommandResult, CommandStatus, CommandWarning, Operation
+from hilcode.telemetry_watch import ChannelPredicate, channel_path
+
+log = logging.getLogger(__name__)
+
+# Seconds a whole sequence (option 'timeout' overrides) and one of its steps (step 'timeout' overrides) may take
+SEQUENCE_TIMEOUT = 600
+STEP_TIMEOUT = 60
+# Steps run before a sequence is stopped, so a branch that loops forever can't run forever
+MAX_SEQUENCE_STEPS = 1000
+# Step kinds, by the key naming them in a step
+STEP_KINDS = ('command', 'wait_state', 'sleep', 'goto')
+# Where to go after a step, other than a label
+NEXT = 'next'
+ABORT = 'abort'
+END = 'end'
+
+
+class SequenceStep(object):
+    """
+    One step of a sequence.  Steps are dictionaries with one kind key:
+
+    {'command': {'operation': 'ENABLE', 'target': 'leonardo', 'options': None}}  runs a command
+    {'command': {'operation': 'WAIT_ON_VAR', 'options': {'channel': 'psu.pri_meas_curr', 'op': '>', 'value': 1}}}
+        waits for a telemetry condition, the channel named relative to the step's target (here
+        'leonardo.psu.pri_meas_curr', any command can be a step)
+    {'wait_state': 'idle', 'target': 'leonardo'}  waits for a VCU to reach a state (or list of states)
+    {'sleep': 2.5}  waits a number of seconds
+    {'goto': 'label'}  jumps to a labelled step
+
+    and optionally 'label', 'timeout' (seconds), and 'on_success' / 'on_failure', each a label, 'next' (default on
+    success), 'abort' (default on failure, the sequence fails with the step's status) or 'end' (the sequence
+    succeeds).  A command that doesn't succeed, a wait that times out, or a sleep the sequence runs out of time
+    for, is a failure.
+    """
+
+    def __init__(self, index, spec, target=''):
+        """
+        Create a step from its dictionary.
+
+        :param index: Position of step in sequence
+        :param spec: Step dictionary
+        :param target: Target of steps that don't name one (the sequence command's target)
+        """
+        if not isinstance(spec, dict):
+            raise CommandWarning(f'Sequence step {index} is not a dictionary')
+        kinds = [kind for kind in STEP_KINDS if kind in spec]
+        if len(kinds) != 1:
+            raise CommandWarning(f'Sequence step {index} needs exactly one of {", ".join(STEP_KINDS)}')
+        self.index = index
+        self.kind = kinds[0]
+        self.label = spec.get('label')
+        self.on_success = spec.get('on_success', NEXT)
+        self.on_failure = spec.get('on_failure', ABORT)
+        try:
+            self.timeout = float(spec.get('timeout', STEP_TIMEOUT))
+        except (TypeError, ValueError):
+            raise CommandWarning(f'Sequence step {index} timeout is not a number')
+        self.command = None
+        self.states = None
+        self.target = spec.get('target', target)
+        self.seconds = None
+        if self.kind == 'command':
+            self.command = self._parse_command(spec['command'], target)
+        elif self.kind == 'wait_state':
+            states = spec['wait_state']
+            self.states = [states] if isinstance(states, str) else list(states)
+        elif self.kind == 'sleep':
+            try:
+                self.seconds = float(spec['sleep'])
+            except (TypeError, ValueError):
+                raise CommandWarning(f'Sequence step {index} sleep is not a number')
+            self.timeout = max(self.timeout, self.seconds)
+        else:
+            self.on_success = spec['goto']
+
+    def _parse_command(self, spec, target):
+        if not isinstance(spec, dict) or 'operation' not in spec:
+            raise CommandWarning(f'Sequence step {self.index} command needs an operation')
+        operation = spec['operation']
+        try:
+            operation = Operation[operation] if isinstance(operation, str) else Operation(operation)
+        except (KeyError, ValueError):
+            raise CommandWarning(f'Sequence step {self.index} operation {operation} not recognized')
+        if operation == Operation.SEQUENCE:
+            raise CommandWarning(f'Sequence step {self.index} is a sequence, sequences can not be nested')
+        if operation == Operation.WAIT_ON_VAR:
+            options = spec.get('options')
+            if not isinstance(options, dict) or 'channel' not in options:
+                raise CommandWarning(f'Sequence step {self.index} WAIT_ON_VAR needs a channel')
+            try:
+                ChannelPredicate.from_options(options)
+            except CommandWarning as e:
+                raise CommandWarning(f'Sequence step {self.index}: {e}')
+        return {'operation': operation, 'options': spec.get('options'), 'target': spec.get('target', target)}
+
+    def channel(self):
+        """
+        Path of the telemetry channel a WAIT_ON_VAR step waits on.
+
+        :return: Channel path, or None if step doesn't wait on a channel
+        """
+        if self.command is None or self.command['operation'] != Operation.WAIT_ON_VAR:
+            return None
+        return channel_path(self.command['target'], self.command['options']['channel'])
+
+    def jumps(self):
+        """
+        Labels this step can jump to.
+
+        :return: List of labels (and next/abort/end)
+        """
+        return [self.on_success, self.on_failure]
+
+    def describe(self):
+        """
+        Dictionary identifying step, for progress and results.
+
+        :return: Dictionary of step index, label and kind
+        """
+        return {'step': self.index, 'label': self.label, 'kind': self.kind}
+
+
+class Sequence(object):
+    """
+    Steps (commands, waits and branches) run one after another inside the service, so a flow like power on, wait
+    for boot, reset, wait again costs one request instead of a round trip and a poll per step.  Commands are queued
+    like any other command (so they keep their order with other commands to their VCU), waits are woken by state
+    changes instead of polling.
+    """
+
+    def __init__(self, steps, timeout=SEQUENCE_TIMEOUT):
+        """
+        Create a sequence.
+
+        :param steps: List of SequenceStep
+        :param timeout: Seconds the whole sequence may take
+        """
+        self.steps = steps
+        self.timeout = timeout
+        self.labels = {}
+        for step in steps:
+            if step.label is None:
+                continue
+            if step.label in self.labels or step.label in (NEXT, ABORT, END):
+                raise CommandWarning(f'Sequence label {step.label} is used twice or reserved')
+            self.labels[step.label] = step.index
+        for step in steps:
+            for jump in step.jumps():
+                if jump not in (NEXT, ABORT, END) and jump not in self.labels:
+                    raise CommandWarning(f'Sequence step {step.index} jumps to unknown label {jump}')
+
+    @classmethod
+    def from_options(cls, options, target=''):
+        """
+        Build a sequence from the options of a SEQUENCE command: {'steps': [step, ...], 'timeout': seconds}.
+
+        :param options: SEQUENCE command options
+        :param target: Target of steps that don't name one
+        :return: Sequence
+        """
+        if not isinstance(options, dict) or not isinstance(options.get('steps'), list) or not options['steps']:
+            raise CommandWarning('SEQUENCE needs a list of steps')
+        try:
+            timeout = float(options.get('timeout', SEQUENCE_TIMEOUT))
+        except (TypeError, ValueError):
+            raise CommandWarning('SEQUENCE timeout is not a number')
+        return cls([SequenceStep(index, spec, target) for index, spec in enumerate(options['steps'])],
+                   timeout=timeout)
+
+    def check_channels(self, hil):
+        """
+        Make sure every channel the sequence waits on exists (see HIL.check_channel), so a misnamed channel fails
+        the sequence before its first step instead of when its step runs.
+
+        :param hil: HIL
+        """
+        for step in self.steps:
+            path = step.channel()
+            if path is None:
+                continue
+            try:
+                hil.check_channel(path)
+            except CommandWarning as e:
+                raise CommandWarning(f'Sequence step {step.index}: {e}')
+
+    async def run(self, submit, hil, progress=None):
+        """
+        Run steps until the last one finishes, a step aborts or jumps to end, or the sequence runs out of time.
+
+        :param submit: Function queueing a tracked command for execution
+        :param hil: HIL, wait_state targets are looked up in it
+        :param progress: (optional) Function called with a progress dictionary as each step starts and finishes
+        :return: CommandResult, value is {'steps': [finished step dictionaries]}
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        finished = []
+        status, warning = CommandStatus.SUCCESS, None
+        index = 0
+        while index < len(self.steps):
+            if len(finished) >= MAX_SEQUENCE_STEPS:
+                status, warning = CommandStatus.ERROR, f'Sequence stopped after {MAX_SEQUENCE_STEPS} steps'
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                status, warning = CommandStatus.TIMEOUT, f'Sequence took longer than {self.timeout}s'
+                break
+            step = self.steps[index]
+            if progress is not None:
+                progress({**step.describe(), 'event': 'started', 'elapsed': time.monotonic() - started})
+            step_started = time.monotonic()
+            result = await self._run_step(step, submit, hil, min(step.timeout, remaining))
+            record = {**step.describe(), 'status': result.status.value, 'warning': result.warning,
+                      'value': result.value, 'seconds': time.monotonic() - step_started}
+            finished.append(record)
+            if progress is not None:
+                progress({**record, 'event': 'finished', 'elapsed': time.monotonic() - started})
+            jump = step.on_success if result.status == CommandStatus.SUCCESS else step.on_failure
+            if jump == ABORT:
+                status = result.status
+                warning = f'Step {step.index}{f" ({step.label})" if step.label else ""} failed: {result.warning}'
+                break
+            elif jump == END:
+                break
+            elif jump == NEXT:
+                index += 1
+            else:
+                index = self.labels[jump]
+        return CommandResult(status=status, warning=warning,
+                             value={'steps': finished, 'elapsed': time.monotonic() - started})
+
+    async def _run_step(self, step, submit, hil, timeout):
+        """
+        Run one step.
+
+        :param step: SequenceStep
+        :param submit: Function queueing a tracked command for execution
+        :param hil: HIL
+        :param timeout: Seconds step may take
+        :return: CommandResult of step
+        """
+        if step.kind == 'command':
+            cmd = Command(operation=step.command['operation'], options=step.command['options'],
+                          target=step.command['target'])
+            cmd.track()
+            submit(cmd)
+            return await cmd.wait(timeout)
+        elif step.kind == 'wait_state':
+            try:
+                vcu = hil.get_component(step.target)
+            except CommandWarning as e:
+                return CommandResult(status=CommandStatus.WARNING, warning=str(e))
+            if not hasattr(vcu, 'wait_for_state'):
+                return CommandResult(status=CommandStatus.WARNING, warning=f'{step.target} is not a VCU')
+            if await vcu.wait_for_state(step.states, timeout):
+                return CommandResult(status=CommandStatus.SUCCESS, value=vcu.state)
+            return CommandResult(status=CommandStatus.TIMEOUT, value=vcu.state,
+                                 warning=f'{step.target} not {" or ".join(step.states)} after {timeout:.1f}s')
+        elif step.kind == 'sleep':
+            if step.seconds > timeout:
+                # Cut short by the sequence running out of time
+                await asyncio.sleep(timeout)
+                return CommandResult(status=CommandStatus.TIMEOUT,
+                                     warning=f'Sleep of {step.seconds}s cut short after {timeout:.1f}s')
+            await asyncio.sleep(step.seconds)
+            return CommandResult(status=CommandStatus.SUCCESS)
+        return CommandResult(status=CommandStatus.SUCCESS)
@@ -0,0 +1,168 @@
+import collections
+import struct
+import tempfile
+import logging
+
+log = logging.getLogger(__name__)
+
+BUFFER_BYTES = 1024 * 1024
+SPILL_BYTES = 64 * 1024 * 1024
+# Bookkeeping cost of one line, on top of its data
+LINE_OVERHEAD = 64
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+SPILL = 'spill'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, SPILL)
+
+# Spill file record header: timestamp, data length
+_SPILL_HEADER = struct.Struct('<dI')
+
+
+class SerialLineBuffer(object):
+    """
+    Byte-budgeted buffer of serial lines for one port.  When a line doesn't fit the overflow policy decides what
+    happens:
+
+    * drop_oldest: oldest lines are dropped to make room
+    * drop_newest: the incoming line is dropped
+    * spill: lines go to a temporary file on disk (up to spill_bytes) and are read back in order as the buffer drains
+
+    Dropped lines and bytes are counted.
+    """
+
+    def __init__(self, max_bytes=BUFFER_BYTES, policy=DROP_OLDEST, spill_bytes=SPILL_BYTES, line_class=None):
+        """
+        Create a serial line buffer.
+
+        :param max_bytes: Bytes of lines held in memory
+        :param policy: Overflow policy, one of OVERFLOW_POLICIES
+        :param spill_bytes: Bytes of spill file (lines and headers) with the spill policy, further lines are dropped
+        :param line_class: Class lines are rebuilt with when read back from disk, called as line_class(time, data)
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'Serial overflow policy {policy} not one of {OVERFLOW_POLICIES}')
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.spill_bytes = spill_bytes
+        self.line_class = line_class
+        self.bytes = 0
+        self.dropped_lines = 0
+        self.dropped_bytes = 0
+        self.spilled_lines = 0
+        self._lines = collections.deque()
+        self._spill = None
+        self._spill_read = 0
+        self._spill_write = 0
+        self._spill_count = 0
+
+    def __len__(self):
+        return len(self._lines) + self._spill_count
+
+    def __bool__(self):
+        return bool(self._lines) or self._spill_count > 0
+
+    @staticmethod
+    def _size(line):
+        return len(line.data) + LINE_OVERHEAD
+
+    def append(self, line):
+        """
+        Add a line, applying the overflow policy if it doesn't fit.
+
+        :param line: SerialLine
+        """
+        size = self._size(line)
+        if self._spill_count:
+            # Already spilling, keep order by sending everything to disk until it is read back
+            self._spill_line(line)
+            return
+        if self.bytes + size > self.max_bytes:
+            if self.policy == DROP_NEWEST:
+                self._drop(1, len(line.data))
+                return
+            elif self.policy == SPILL:
+                self._spill_line(line)
+                return
+            while self._lines and self.bytes + size > self.max_bytes:
+                old = self._lines.popleft()
+                self.bytes -= self._size(old)
+                self._drop(1, len(old.data))
+        self._lines.append(line)
+        self.bytes += size
+
+    def popleft(self):
+        """
+        Take oldest line.
+
+        :return: Oldest SerialLine, or an IndexError if empty
+        """
+        if not self._lines and self._spill_count:
+            self._unspill()
+        line = self._lines.popleft()
+        self.bytes -= self._size(line)
+        return line
+
+    def stats(self):
+        """
+        Buffer counters.
+
+        :return: Dictionary of buffer counters
+        """
+        return {
+            'lines': len(self),
+            'bytes': self.bytes,
+            'spilled_bytes': self._spill_write - self._spill_read,
+            'dropped_lines': self.dropped_lines,
+            'dropped_bytes': self.dropped_bytes,
+            'spilled_lines': self.spilled_lines,
+        }
+
+    def close(self):
+        """
+        Remove spill file, if any.
+        """
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        self._spill_read = self._spill_write = self._spill_count = 0
+
+    def _drop(self, lines, nbytes):
+        self.dropped_lines += lines
+        self.dropped_bytes += nbytes
+
+    def _spill_line(self, line):
+        """
+        Append a line to the spill file.
+
+        :param line: SerialLine
+        """
+        if self._spill_write - self._spill_read + _SPILL_HEADER.size + len(line.data) > self.spill_bytes:
+            self._drop(1, len(line.data))
+            return
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(prefix='vcuhil_serial_')
+            log.warning('Serial buffer full, spilling to disk')
+        self._spill.seek(self._spill_write)
+        self._spill.write(_SPILL_HEADER.pack(line.time, len(line.data)))
+        self._spill.write(line.data)
+        self._spill_write = self._spill.tell()
+        self._spill_count += 1
+        self.spilled_lines += 1
+
+    def _unspill(self):
+        """
+        Read spilled lines back into memory, up to the memory budget.
+        """
+        self._spill.seek(self._spill_read)
+        while self._spill_count and (not self._lines or self.bytes < self.max_bytes):
+            timestamp, length = _SPILL_HEADER.unpack(self._spill.read(_SPILL_HEADER.size))
+            line = self.line_class(timestamp, self._spill.read(length))
+            self._lines.append(line)
+            self.bytes += self._size(line)
+            self._spill_count -= 1
+        self._spill_read = self._spill.tell()
+        if not self._spill_count:
+            # All read back, start the file over
+            self._spill.truncate(0)
+            self._spill_read = self._spill_write = 0
@@ -0,0 +1,230 @@
+import asyncio
+import gzip
+import os
+import time
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+CAPTURE_DIR = 'serial_capture'
+BLOCK_BYTES = 64 * 1024
+BLOCK_AGE = 5.0
+SEGMENT_BYTES = 16 * 1024 * 1024
+SEGMENT_AGE = 3600
+KEEP_SEGMENTS = 48
+
+
+def _compressor(compression):
+    """
+    Compress and decompress functions for a compression name.
+
+    :param compression: 'zstd' or 'gzip'
+    :return: Tuple of (compress, decompress, file suffix)
+    """
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd serial capture needs the zstandard package')
+        return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress, '.log.zst'
+    elif compression == 'gzip':
+        return gzip.compress, gzip.decompress, '.log.gz'
+    else:
+        raise RuntimeError(f'Compression {compression} not recognized')
+
+
+def _parse_block(data):
+    """
+    Split a decompressed block back into (timestamp, line) tuples.
+
+    :param data: Decompressed block
+    :return: List of (timestamp, line bytes)
+    """
+    lines = []
+    for record in data.split(b'\n')[:-1]:
+        timestamp, _, line = record.partition(b' ')
+        lines.append((float(timestamp), line))
+    return lines
+
+
+class SerialCapture(object):
+    """
+    Writes one serial port's lines to rotating compressed segment files.
+
+    Lines are stored as '<timestamp> <line>\\n' in independently compressed blocks, so a block can be decompressed on
+    its own.  Each segment has a text index with one row per block ('first_ts last_ts offset length lines'), so a
+    time range is found by reading the index and seeking, not by decompressing the whole segment.
+    """
+
+    def __init__(self,
+                 directory,
+                 port,
+                 compression=None,
+                 block_bytes=BLOCK_BYTES,
+                 block_age=BLOCK_AGE,
+                 segment_bytes=SEGMENT_BYTES,
+                 segment_age=SEGMENT_AGE,
+                 keep_segments=KEEP_SEGMENTS):
+        """
+        Create a serial capture for one port.
+
+        :param directory: Directory segment files are written to
+        :param port: Port name, segment files are named '<port>-<start time>'
+        :param compression: 'zstd' or 'gzip' (default is zstd if the zstandard package is installed)
+        :param block_bytes: Uncompressed bytes collected before a block is compressed and written
+        :param block_age: Seconds a line waits in a block before the block is written anyway
+        :param segment_bytes: Compressed bytes written before starting a new segment
+        :param segment_age: Seconds before starting a new segment
+        :param keep_segments: Number of segments kept, older ones are deleted
+        """
+        if compression is None:
+            compression = 'zstd' if zstandard is not None else 'gzip'
+        self.directory = directory
+        self.port = port
+        self.compression = compression
+        self._compress, self._decompress, self._suffix = _compressor(compression)
+        self.block_bytes = block_bytes
+        self.block_age = block_age
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.keep_segments = keep_segments
+        self.lines = 0
+        self.bytes = 0
+        self.write_errors = 0
+        self._block = []
+        self._block_bytes = 0
+        self._block_first = None
+        self._block_last = None
+        self._segment = None
+        self._segment_started = 0
+        self._segment_size = 0
+        self._lock = asyncio.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, line):
+        """
+        Add a serial line to the current block.  Never blocks, call flush() to write blocks to disk.
+
+        :param line: SerialLine (data as bytes or str)
+        """
+        data = line.data
+        if isinstance(data, str):
+            data = data.encode('utf-8', 'backslashreplace')
+        record = b'%.6f %s\n' % (line.time, data.replace(b'\n', b'\\n'))
+        self._block.append(record)
+        self._block_bytes += len(record)
+        if self._block_first is None:
+            self._block_first = line.time
+        self._block_last = line.time
+        self.lines += 1
+        self.bytes += len(data)
+
+    def block_ready(self):
+        """
+        Is the current block ready to be written?
+
+        :return: True/False if block has reached block_bytes or block_age
+        """
+        if not self._block:
+            return False
+        return self._block_bytes >= self.block_bytes or time.time() - self._block_first >= self.block_age
+
+    async def flush(self, force=False):
+        """
+        Compress and write the current block, off the event loop.
+
+        :param force: Write the block even if it isn't ready
+        """
+        if not self._block or not (force or self.block_ready()):
+            return
+        block, first, last = self._block, self._block_first, self._block_last
+        self._block, self._block_bytes, self._block_first, self._block_last = [], 0, None, None
+        async with self._lock:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write_block, block, first, last)
+            except OSError as e:
+                self.write_errors += 1
+                log.warning(f'Serial capture of {self.port} failed: {e}')
+
+    async def close(self):
+        """
+        Write what is left and close segment.
+        """
+        await self.flush(force=True)
+        self._segment = None
+
+    def _segment_path(self, started):
+        return os.path.join(self.directory, f'{self.port}-{int(started * 1e6)}{self._suffix}')
+
+    def _write_block(self, block, first, last):
+        """
+        Compress a block and append it to the current segment, rotating first if needed (runs in executor).
+
+        :param block: List of line records
+        :param first: Timestamp of first line
+        :param last: Timestamp of last line
+        """
+        now = time.time()
+        rotated = self._segment is None or self._segment_size >= self.segment_bytes or \
+            now - self._segment_started >= self.segment_age
+        if rotated:
+            self._segment_started = now
+            self._segment = self._segment_path(now)
+            self._segment_size = 0
+        data = self._compress(b''.join(block))
+        with open(self._segment, 'ab') as segment:
+            segment.write(data)
+        with open(f'{self._segment}.idx', 'a') as index:
+            index.write(f'{first:.6f} {last:.6f} {self._segment_size} {len(data)} {len(block)}\n')
+        self._segment_size += len(data)
+        if rotated:
+            self._remove_old_segments()
+
+    def segments(self):
+        """
+        Segment files of this port, oldest first.
+
+        :return: List of segment paths
+        """
+        prefix = f'{self.port}-'
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(prefix) and name.endswith(self._suffix)
+                 and name[len(prefix):-len(self._suffix)].isdigit()]
+        names.sort(key=lambda name: int(name[len(prefix):-len(self._suffix)]))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _remove_old_segments(self):
+        for path in self.segments()[:-self.keep_segments]:
+            for name in (path, f'{path}.idx'):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+
+    def read_range(self, start, end):
+        """
+        Lines captured between two times.  Only blocks overlapping the range are read from disk.
+
+        :param start: Start of range (UNIX time)
+        :param end: End of range (UNIX time)
+        :return: List of (timestamp, line bytes), oldest first
+        """
+        lines = []
+        for path in self.segments():
+            try:
+                with open(f'{path}.idx') as index:
+                    blocks = [row.split() for row in index]
+            except FileNotFoundError:
+                continue
+            with open(path, 'rb') as segment:
+                for first, last, offset, length, _ in blocks:
+                    if float(last) < start or float(first) > end:
+                        continue
+                    segment.seek(int(offset))
+                    for timestamp, line in _parse_block(self._decompress(segment.read(int(length)))):
+                        if start <= timestamp <= end:
+                            lines.append((timestamp, line))
+        return lines
@@ -0,0 +1,113 @@
+import re
+import logging
+
+log = logging.getLogger(__name__)
+
+# Default console patterns, by event name
+BOOTED_PATTERN = rb'login:\s*$'
+REBOOT_PATTERN = rb'Kernel panic|U-Boot \d|Booting Linux on physical CPU'
+DEFAULT_PATTERNS = {
+    'booted': BOOTED_PATTERN,
+    'reboot': REBOOT_PATTERN,
+}
+# Default patterns that are also matched against unterminated input, a getty prints its login prompt with no newline
+PROMPT_PATTERNS = ('booted',)
+
+
+class SerialMatcher(object):
+    """
+    Matches serial lines against many named patterns at once.  Patterns are compiled into a single alternation
+    with one named group each, so a line is scanned once no matter how many patterns there are.  When a line
+    matches, the callbacks of the pattern matching leftmost in the line run with (port, name, line) (where two
+    match at the same place, the one added first).
+    Prompt patterns are also matched against the unterminated end of the input (see feed_partial).
+    """
+
+    def __init__(self, patterns=None, prompts=PROMPT_PATTERNS):
+        """
+        Create a serial matcher.
+
+        :param patterns: (optional) Dictionary of {name: regex (bytes)} to start with
+        :param prompts: Names of patterns in patterns that are prompts (see add_pattern)
+        """
+        self._patterns = {}
+        self._prompts = set()
+        self._callbacks = {}
+        self._groups = {}
+        self._regex = None
+        self._prompt_regex = None
+        self.matches = {}
+        for name, pattern in (patterns or {}).items():
+            self.add_pattern(name, pattern, prompt=name in prompts)
+
+    def add_pattern(self, name, pattern, prompt=False):
+        """
+        Add (or replace) a named pattern.
+
+        :param name: Pattern name, the event reported when it matches
+        :param pattern: Regular expression (bytes), matched anywhere in a line
+        :param prompt: Also match unterminated input, for prompts printed without a newline (like 'login: ')
+        """
+        re.compile(pattern)
+        self._patterns[name] = pattern
+        if prompt:
+            self._prompts.add(name)
+        else:
+            self._prompts.discard(name)
+        self.matches.setdefault(name, 0)
+        self._compile()
+
+    def on_match(self, name, callback):
+        """
+        Call a function whenever a pattern matches.
+
+        :param name: Pattern name
+        :param callback: Function called as callback(port, name, line)
+        """
+        self._callbacks.setdefault(name, []).append(callback)
+
+    def _compile(self):
+        # Group names have to be identifiers, pattern names don't
+        self._groups = {f'p{i}': name for i, name in enumerate(self._patterns)}
+        self._regex = re.compile(b'|'.join(
+            b'(?P<%s>%s)' % (group.encode(), self._patterns[name]) for group, name in self._groups.items()))
+        prompts = [(group, name) for group, name in self._groups.items() if name in self._prompts]
+        self._prompt_regex = re.compile(b'|'.join(
+            b'(?P<%s>%s)' % (group.encode(), self._patterns[name]) for group, name in prompts)) if prompts else None
+
+    def feed(self, port, line):
+        """
+        Match one serial line.
+
+        :param port: Name of serial port line came from
+        :param line: SerialLine
+        :return: Name of pattern matched, or None
+        """
+        return self._match(self._regex, port, line)
+
+    def feed_partial(self, port, line):
+        """
+        Match the unterminated end of a port's input against prompt patterns only.  It is fed again as more of the
+        line arrives, and once more as a complete line, so prompt callbacks have to cope with repeats.
+
+        :param port: Name of serial port input came from
+        :param line: SerialLine of the unterminated input
+        :return: Name of pattern matched, or None
+        """
+        return self._match(self._prompt_regex, port, line)
+
+    def _match(self, regex, port, line):
+        if regex is None:
+            return None
+        match = regex.search(line.data)
+        if match is None:
+            return None
+        # The outermost group that matched is the pattern's own, whichever alternation it was compiled into
+        name = self._groups[match.lastgroup]
+        self.matches[name] += 1
+        for callback in self._callbacks.get(name, ()):
+            try:
+                callback(port, name, line)
+            except Exception:
+                log.exception(f'Serial match callback for {name} on {port} failed')
+        return name
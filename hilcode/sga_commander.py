@@ -2,6 +2,8 @@ import asyncio
 import asyncssh
 import socket
 import logging
+from hilcode.ssh_session import VCUSSHSession
+from hilcode.lifecycle import DriverTask
 
 log = logging.getLogger(__name__)
 
@@ -12,18 +14,32 @@ class VCUSGA(object):
     Abstraction layer for interfacing with VCU SGA
     """
 
-    def __init__(self, host, port=22):
+    def __init__(self, host, port=22, session=None):
         """
         Create VCUSGA Abstraction Layer object
 
         :param host: SGA Hostname/IP
         :param port: SGA Port (default is 22)
+        :param session: (optional) Shared VCUSSHSession for this VCU, one is created if not given
         """
         self.host = host
         self.port = port
-        self._pinger_task = None
+        self._owns_session = session is None
+        if session is None:
+            session = VCUSSHSession(host, port)
+        self.session = session
+        self._pinger = DriverTask('sga_pinger')
         self._pinger_connected = asyncio.Event()
-        self._pinger_stop = asyncio.Event()
+        self.cycle_time = PINGER_CYCLE_TIME
+
+    def set_cycle_time(self, cycle_time):
+        """
+        Change how often the SGA is pinged, and ping now.
+
+        :param cycle_time: Seconds between pings
+        """
+        self.cycle_time = cycle_time
+        self._pinger.wake()
 
     def is_connected(self):
         """
@@ -37,52 +53,44 @@ class VCUSGA(object):
         """
         Coroutine that constantly pings SGA to see if it's alive.
         """
-        while not self._pinger_stop.is_set():
-            await asyncio.sleep(PINGER_CYCLE_TIME)
+        while await self._pinger.sleep(self.cycle_time):
             try:
-                async with await asyncio.wait_for(asyncssh.connect(
-                    self.host,
-                    port=self.port,
-                    username = 'root',
-                    password='root',
-                    login_timeout=10,
-                    preferred_auth='password',
-                    known_hosts=None,
-                    ), timeout=10) as conn:
-                    result = await asyncio.wait_for(conn.run('echo "Test"', check=True), timeout=10)
+                # Probe runs as a new channel on the shared, already open connection
+                conn = await self.session.sga()
+                result = await asyncio.wait_for(conn.run('echo "Test"', check=True), timeout=10)
                 if result.exit_status == 0:
                     # ping succeeded
                     self._pinger_connected.set()
                 else:
                     # ping failed
                     self._pinger_connected.clear()
-            except asyncio.exceptions.TimeoutError:
+            except ConnectionRefusedError:
+                # Includes reconnect backoff, connection already dropped
+                self._pinger_connected.clear()
+            except asyncssh.ProcessError:
+                # Command failed, but the session itself is fine
                 self._pinger_connected.clear()
-            except OSError:
+            except (asyncio.exceptions.TimeoutError, OSError, asyncssh.Error):
                 self._pinger_connected.clear()
+                self.session.drop_sga()
             except Exception as e:
-                log.error(f'WTF HPA ERROR!!! {e.format_exc()}')
+                log.error(f'WTF SGA ERROR!!! {e}')
                 raise e
 
     async def setup(self):
         """
         Setup SGA abstraction layer.
         """
-        self._pinger_stop.clear()
         self._pinger_connected.clear()
-        self._pinger_task = asyncio.create_task(self.pinger_loop())
+        self._pinger.start(self.pinger_loop())
 
     async def close(self):
         """
         Close SGA abstraction layer.
         """
         log.debug('closing sga')
-        self._pinger_stop.set()
-        while not self._pinger_task.done():
-            await asyncio.sleep(0.1)
+        # Nothing in a ping is worth finishing, cancel it rather than wait out a stuck connect
+        await self._pinger.stop(timeout=0)
+        if self._owns_session:
+            await self.session.close()
         log.debug('closed sga')
-
-
-
-
-
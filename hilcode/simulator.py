@@ -0,0 +1,395 @@
+import asyncio
+import fcntl
+import os
+import tty
+import asyncssh
+import logging
+from hilcode.lifecycle import DriverTask
+from hilcode.supply_simulator import SimulatedSorensenServer
+
+log = logging.getLogger(__name__)
+
+HOST = '127.0.0.1'
+USERNAME = 'root'
+PASSWORD = 'root'
+# Serial consoles of a simulated VCU, the first two are the boot ports (see components.BOOT_PORTS)
+CONSOLES = ('sga_serial', 'hpa_serial', 'hia', 'hib', 'lpa')
+# Console lines per second once booted, per console
+LINE_RATE = 10.0
+# Seconds from power on to login prompt, SSH comes up when the prompt does
+BOOT_TIME = 2.0
+# Simulated consoles and power are updated this often
+TICK = 0.1
+PROMPT = b'root@vcu-sim:~# '
+
+BOOT_LOG = (
+    b'U-Boot 2020.04-l4t-r32.5 (Jan 01 2021 - 00:00:00 +0000)',
+    b'DRAM:  31.8 GiB',
+    b'Hit any key to stop autoboot:  0',
+    b'Booting Linux on physical CPU 0x0000000000 [0x4e0f0040]',
+    b'[    0.000000] Linux version 4.9.201-tegra (buildbrain@vcu-sim) (gcc version 7.3.1)',
+    b'[    0.000000] Machine model: NVIDIA Drive AGX Pegasus',
+    b'[    0.412117] tegra-pcie 14180000.pcie: PCIE: Enable power rails',
+    b'[    1.837203] EXT4-fs (mmcblk0p1): mounted filesystem with ordered data mode',
+    b'[    2.503118] systemd[1]: Detected architecture arm64.',
+    b'[  OK  ] Started Network Manager.',
+    b'[  OK  ] Reached target Multi-User System.',
+    b'Ubuntu 18.04.5 LTS vcu-sim ttyTCU0',
+)
+LOGIN_PROMPT = b'vcu-sim login: '
+
+SSH_RESPONSES = {
+    'echo "Test"': 'Test\n',
+    'uname -a': 'Linux vcu-sim 4.9.201-tegra #1 SMP PREEMPT aarch64 aarch64 aarch64 GNU/Linux\n',
+    'cat /usr/libnvidia/version-pdk.txt': '5.2.6.0-24941322\n',
+}
+
+
+class SimulatedConsole(object):
+    """
+    Pseudo terminal standing in for one VCU serial console.  Writes a boot log when powered on, then log lines at a
+    steady rate, and answers anything typed at it with a prompt.
+    """
+
+    def __init__(self, name, line_rate=LINE_RATE, boot_time=BOOT_TIME):
+        """
+        Create a simulated console.
+
+        :param name: Console name, shows up in its log lines
+        :param line_rate: Log lines per second once booted
+        :param boot_time: Seconds the boot log takes
+        """
+        self.name = name
+        self.line_rate = line_rate
+        self.boot_time = boot_time
+        self.path = None
+        self.lines_written = 0
+        self.dropped_lines = 0
+        self._master = None
+        self._slave = None
+        self._boot_line = None
+        self._owed = 0.0
+
+    def open(self):
+        """
+        Open the pseudo terminal.
+        """
+        self._master, self._slave = os.openpty()
+        # Slave stays open so the port survives the service reopening it
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        fcntl.fcntl(self._master, fcntl.F_SETFL, fcntl.fcntl(self._master, fcntl.F_GETFL) | os.O_NONBLOCK)
+        asyncio.get_running_loop().add_reader(self._master, self._typed)
+
+    def close(self):
+        """
+        Close the pseudo terminal.
+        """
+        if self._master is None:
+            return
+        asyncio.get_running_loop().remove_reader(self._master)
+        os.close(self._master)
+        os.close(self._slave)
+        self._master = self._slave = None
+
+    def power_on(self):
+        """
+        Start the boot log.
+        """
+        self._boot_line = 0
+        self._owed = 0.0
+
+    def power_off(self):
+        """
+        Go quiet.
+        """
+        self._boot_line = None
+
+    def booted(self):
+        """
+        Has the console shown its login prompt?
+
+        :return: True/False if booted
+        """
+        return self._boot_line is not None and self._boot_line > len(BOOT_LOG)
+
+    def tick(self, now, elapsed):
+        """
+        Write the lines due since the last tick.
+
+        :param now: Seconds since power on
+        :param elapsed: Seconds since last tick
+        """
+        if self._boot_line is None:
+            return
+        lines = []
+        prompt = b''
+        if self._boot_line <= len(BOOT_LOG):
+            # Boot log spread evenly over boot time, login prompt last (with no line ending, like a getty)
+            due = min(len(BOOT_LOG) + 1, int(now / self.boot_time * (len(BOOT_LOG) + 1)))
+            while self._boot_line < due:
+                if self._boot_line < len(BOOT_LOG):
+                    lines.append(BOOT_LOG[self._boot_line])
+                else:
+                    prompt = LOGIN_PROMPT
+                self._boot_line += 1
+        else:
+            self._owed += elapsed * self.line_rate
+            while self._owed >= 1:
+                lines.append(b'[%12.6f] %s: heartbeat %d' % (now, self.name.encode(), self.lines_written))
+                self._owed -= 1
+        if lines or prompt:
+            self._write(b''.join(line + b'\r\n' for line in lines) + prompt, len(lines))
+
+    def _write(self, data, lines):
+        try:
+            os.write(self._master, data)
+            self.lines_written += lines
+        except BlockingIOError:
+            # Nobody reading the port, like a real console
+            self.dropped_lines += lines
+        except OSError:
+            self.dropped_lines += lines
+
+    def _typed(self):
+        try:
+            data = os.read(self._master, 4096)
+        except OSError:
+            return
+        if self._boot_line is not None and b'\n' in data.replace(b'\r', b'\n'):
+            self._write(data.replace(b'\r', b'\r\n') + PROMPT, 0)
+
+
+class _SimulatedSSHServer(asyncssh.SSHServer):
+    def __init__(self, host):
+        self.host = host
+        self._conn = None
+
+    def connection_made(self, conn):
+        self._conn = conn
+        self.host.connections.add(conn)
+
+    def connection_lost(self, exc):
+        self.host.connections.discard(self._conn)
+
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return self.host.up and username == USERNAME and password == PASSWORD
+
+    def connection_requested(self, dest_host, dest_port, orig_host, orig_port):
+        # Only tunnels to the VCU's own HPA, like the SGA's private network
+        return self.host.up and (dest_host, dest_port) in self.host.forwards
+
+
+class SimulatedSSHHost(object):
+    """
+    asyncssh server standing in for an SGA or HPA.  Answers the commands the pingers run, and (for an SGA) allows
+    tunnels to its HPA.  Logins are refused while the host is down.
+    """
+
+    def __init__(self, host_key, responses=SSH_RESPONSES):
+        """
+        Create a simulated SSH host.
+
+        :param host_key: asyncssh private key the server identifies with
+        :param responses: Dictionary of {command: output}, other commands fail
+        """
+        self.host_key = host_key
+        self.responses = responses
+        self.forwards = set()
+        self.connections = set()
+        self.commands_run = 0
+        self.up = False
+        self.port = None
+        self._server = None
+
+    async def start(self, host=HOST, port=0):
+        """
+        Start listening.
+
+        :param host: Address to listen on
+        :param port: Port to listen on (default of 0 picks a free port)
+        """
+        self._server = await asyncssh.create_server(
+            lambda: _SimulatedSSHServer(self), host, port,
+            server_host_keys=[self.host_key], process_factory=self._run)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def set_up(self, up):
+        """
+        Bring host up or down, going down drops every connection.
+
+        :param up: True/False if host is up
+        """
+        self.up = up
+        if not up:
+            for conn in list(self.connections):
+                conn.close()
+
+    async def close(self):
+        """
+        Stop listening and drop connections.
+        """
+        self.set_up(False)
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _run(self, process):
+        self.commands_run += 1
+        output = self.responses.get(process.command)
+        if output is None:
+            process.stderr.write(f'{process.command}: command not found\n')
+            process.exit(127)
+        else:
+            process.stdout.write(output)
+            process.exit(0)
+
+
+class SimulatedVCU(object):
+    """
+    In-process stand-in for one VCU: a telnet power supply, serial consoles on pseudo terminals, and SSH servers
+    for the SGA and HPA.  The VCU boots when both supply outputs are switched on (like after an ENABLE command)
+    and goes dark when either is switched off.
+    """
+
+    def __init__(self, name, host_key, line_rate=LINE_RATE, boot_time=BOOT_TIME):
+        """
+        Create a simulated VCU.
+
+        :param name: VCU name
+        :param host_key: asyncssh private key for SSH servers
+        :param line_rate: Console log lines per second once booted, per console
+        :param boot_time: Seconds from power on to login prompt and SSH
+        """
+        self.name = name
+        self.supply = SimulatedSorensenServer()
+        self.consoles = {console: SimulatedConsole(f'{name}_{console}', line_rate, boot_time)
+                         for console in CONSOLES}
+        self.sga = SimulatedSSHHost(host_key)
+        self.hpa = SimulatedSSHHost(host_key)
+        self.boots = 0
+        self._on = False
+        self._powered_at = None
+        self._task = DriverTask(f'simulated_vcu_{name}')
+
+    async def start(self):
+        """
+        Start stand-ins.
+        """
+        await self.supply.start(HOST)
+        await self.sga.start()
+        await self.hpa.start()
+        self.sga.forwards.add((HOST, self.hpa.port))
+        for console in self.consoles.values():
+            console.open()
+        self._task.start(self._power_loop())
+
+    async def close(self):
+        """
+        Stop stand-ins.
+        """
+        await self._task.stop()
+        for console in self.consoles.values():
+            console.close()
+        await asyncio.gather(self.supply.close(), self.sga.close(), self.hpa.close())
+
+    def config(self, psu_defaults):
+        """
+        VCU config (like hil_config.VCU_CONFIGS entries) pointing at the stand-ins.
+
+        :param psu_defaults: Power supply defaults
+        :return: VCU config dictionary
+        """
+        config = {
+            'sga': {'type': 'sga', 'hostname': HOST, 'odb': HOST, 'port': self.sga.port,
+                    'username': USERNAME, 'password': PASSWORD},
+            'hpa': {'type': 'hpa', 'hostname': HOST, 'port': self.hpa.port, 'sga_odb': HOST,
+                    'sga_port': self.sga.port, 'username': USERNAME, 'password': PASSWORD},
+            'psu': {'type': 'sorensen_psu', 'host': HOST, 'port': self.supply.port, 'defaults': psu_defaults},
+        }
+        for name, console in self.consoles.items():
+            config[name] = {'type': 'micro', 'serial': console.path, 'baudrate': 115200}
+        return config
+
+    async def _power_loop(self):
+        loop = asyncio.get_running_loop()
+        last = loop.time()
+        while await self._task.sleep(TICK):
+            now = loop.time()
+            on = all(channel['OP'] for channel in self.supply.channels.values())
+            if on and not self._on:
+                self.boots += 1
+                self._powered_at = now
+                for console in self.consoles.values():
+                    console.power_on()
+            elif self._on and not on:
+                for console in self.consoles.values():
+                    console.power_off()
+                self.sga.set_up(False)
+                self.hpa.set_up(False)
+            self._on = on
+            if on:
+                for console in self.consoles.values():
+                    console.tick(now - self._powered_at, now - last)
+                if not self.sga.up and all(console.booted() for console in self.consoles.values()):
+                    self.sga.set_up(True)
+                    self.hpa.set_up(True)
+            last = now
+
+
+class DiscardingInfluxClient(object):
+    """
+    Stand-in influx client that counts and throws away points.
+    """
+
+    def __init__(self):
+        self.points = 0
+
+    def write_points(self, points, **kwargs):
+        self.points += len(points)
+        return True
+
+
+class Simulator(object):
+    """
+    A fleet of simulated VCUs, for running the service without hardware.
+    """
+
+    def __init__(self, count, line_rate=LINE_RATE, boot_time=BOOT_TIME):
+        """
+        Create a simulator.
+
+        :param count: Number of VCUs
+        :param line_rate: Console log lines per second once booted, per console
+        :param boot_time: Seconds from power on to login prompt and SSH
+        """
+        host_key = asyncssh.generate_private_key('ssh-ed25519')
+        self.vcus = {f'sim{i:03d}': SimulatedVCU(f'sim{i:03d}', host_key, line_rate, boot_time)
+                     for i in range(count)}
+
+    async def start(self):
+        """
+        Start every simulated VCU.
+        """
+        await asyncio.gather(*(vcu.start() for vcu in self.vcus.values()))
+        log.info(f'Simulating {len(self.vcus)} VCUs')
+
+    async def close(self):
+        """
+        Stop every simulated VCU.
+        """
+        await asyncio.gather(*(vcu.close() for vcu in self.vcus.values()))
+
+    def vcu_configs(self, psu_defaults):
+        """
+        VCU configs (like hil_config.VCU_CONFIGS) for the simulated VCUs.
+
+        :param psu_defaults: Power supply defaults
+        :return: Dictionary of {VCU name: VCU config}
+        """
+        return {name: vcu.config(psu_defaults) for name, vcu in self.vcus.items()}
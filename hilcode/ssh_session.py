@@ -0,0 +1,152 @@
+import asyncio
+import asyncssh
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 10
+KEEPALIVE_INTERVAL = 5
+BACKOFF_MIN = 0.5
+BACKOFF_MAX = 30
+
+
+class VCUSSHSession(object):
+    """
+    Shared SSH connections to a VCU.  Keeps one SGA connection alive and tunnels HPA connections over it, so
+    pingers open channels on existing sessions instead of doing a handshake every ping.
+    """
+
+    def __init__(self, sga_host, sga_port=22, username='root', password='root'):
+        """
+        Create a shared SSH session manager for one VCU.
+
+        :param sga_host: SGA Hostname/IP
+        :param sga_port: SGA SSH Port (default is 22)
+        :param username: SSH username (same for SGA and HPA)
+        :param password: SSH password (same for SGA and HPA)
+        """
+        self.sga_host = sga_host
+        self.sga_port = sga_port
+        self.username = username
+        self.password = password
+        self.handshakes = 0
+        self._sga_conn = None
+        self._hpa_conns = {}
+        self._sga_lock = asyncio.Lock()
+        self._hpa_lock = asyncio.Lock()
+        self._backoff = {}
+
+    def _connect_kwargs(self):
+        return {
+            'username': self.username,
+            'password': self.password,
+            'preferred_auth': 'password',
+            'known_hosts': None,
+            'login_timeout': CONNECT_TIMEOUT,
+            'keepalive_interval': KEEPALIVE_INTERVAL,
+        }
+
+    def _check_backoff(self, key):
+        """
+        Raise if a reconnect to this endpoint was attempted too recently.
+
+        :param key: Endpoint key
+        """
+        backoff = self._backoff.get(key)
+        if backoff is not None and time.monotonic() < backoff[1]:
+            raise ConnectionRefusedError(f'SSH reconnect to {key} backing off')
+
+    def _record_failure(self, key):
+        """
+        Push back next reconnect attempt to this endpoint (exponential backoff).
+
+        :param key: Endpoint key
+        """
+        delay = self._backoff.get(key, (BACKOFF_MIN / 2, 0))[0] * 2
+        delay = min(delay, BACKOFF_MAX)
+        self._backoff[key] = (delay, time.monotonic() + delay)
+        log.debug(f'SSH connect to {key} failed, next try in {delay}s')
+
+    async def _connect(self, key, host, port, **kwargs):
+        """
+        Open a new SSH connection, respecting backoff.
+
+        :param key: Endpoint key for backoff tracking
+        :param host: Hostname/IP
+        :param port: SSH port
+        :return: SSH connection
+        """
+        self._check_backoff(key)
+        self.handshakes += 1
+        try:
+            conn = await asyncio.wait_for(asyncssh.connect(
+                host,
+                port=port,
+                **self._connect_kwargs(),
+                **kwargs
+            ), timeout=CONNECT_TIMEOUT)
+        except (asyncio.TimeoutError, OSError, asyncssh.Error):
+            self._record_failure(key)
+            raise
+        self._backoff.pop(key, None)
+        return conn
+
+    async def sga(self):
+        """
+        Get the open SGA connection, connecting if there isn't one.
+
+        :return: SGA SSH connection
+        """
+        async with self._sga_lock:
+            if self._sga_conn is None or self._sga_conn.is_closed():
+                self._drop_hpa_all()
+                self._sga_conn = await self._connect('sga', self.sga_host, self.sga_port)
+            return self._sga_conn
+
+    async def hpa(self, host, port=22):
+        """
+        Get the open HPA connection (tunneled through SGA), connecting if there isn't one.
+
+        :param host: HPA Hostname/IP (from SGA)
+        :param port: HPA SSH Port (default is 22)
+        :return: HPA SSH connection
+        """
+        sga_conn = await self.sga()
+        async with self._hpa_lock:
+            conn = self._hpa_conns.get((host, port))
+            if conn is None or conn.is_closed():
+                conn = await self._connect((host, port), host, port, tunnel=sga_conn)
+                self._hpa_conns[(host, port)] = conn
+            return conn
+
+    def drop_sga(self):
+        """
+        Throw away SGA connection (and every HPA connection tunneled through it), next use reconnects.
+        """
+        self._drop_hpa_all()
+        if self._sga_conn is not None:
+            self._sga_conn.close()
+            self._sga_conn = None
+
+    def drop_hpa(self, host, port=22):
+        """
+        Throw away an HPA connection, next use reconnects.
+
+        :param host: HPA Hostname/IP
+        :param port: HPA SSH Port
+        """
+        conn = self._hpa_conns.pop((host, port), None)
+        if conn is not None:
+            conn.close()
+
+    def _drop_hpa_all(self):
+        for key in list(self._hpa_conns.keys()):
+            self.drop_hpa(*key)
+
+    async def close(self):
+        """
+        Close all connections.
+        """
+        self.drop_sga()
+        self._backoff = {}
@@ -0,0 +1,189 @@
+import abc
+import logging
+
+log = logging.getLogger(__name__)
+
+# Power supply drivers, by config type
+SUPPLY_DRIVERS = {}
+
+
+def register_supply(supply_type):
+    """
+    Class decorator registering a power supply driver for a config type.
+
+    :param supply_type: Config 'type' the driver handles (like 'sorensen_psu')
+    :return: Decorator
+    """
+    def register(cls):
+        if supply_type in SUPPLY_DRIVERS:
+            raise RuntimeError(f'Power supply type {supply_type} already registered to {SUPPLY_DRIVERS[supply_type]}')
+        SUPPLY_DRIVERS[supply_type] = cls
+        cls.supply_type = supply_type
+        return cls
+    return register
+
+
+def is_supply(supply_type):
+    """
+    Is there a power supply driver for a config type?
+
+    :param supply_type: Config 'type'
+    :return: True/False if a driver is registered
+    """
+    return supply_type in SUPPLY_DRIVERS
+
+
+def create_supply(config):
+    """
+    Create the power supply driver for a config.
+
+    :param config: Power supply config dictionary, 'type' picks the driver
+    :return: Power supply driver (not yet opened, see PowerSupplyDriver.open)
+    """
+    try:
+        cls = SUPPLY_DRIVERS[config['type']]
+    except KeyError:
+        raise RuntimeError(f'No power supply driver for type {config["type"]}, '
+                           f'registered types are {sorted(SUPPLY_DRIVERS)}')
+    return cls.from_config(config)
+
+
+class SupplyChannelReading(object):
+    """
+    Readback of one power supply output channel.
+    """
+    __slots__ = ('meas_voltage', 'meas_current', 'set_voltage', 'set_current', 'output_enabled')
+
+    def __init__(self, meas_voltage, meas_current, set_voltage, set_current, output_enabled):
+        """
+        Create a channel reading.
+
+        :param meas_voltage: Measured voltage (volts)
+        :param meas_current: Measured current (amperes)
+        :param set_voltage: Voltage setpoint (volts)
+        :param set_current: Current limit setpoint (amperes)
+        :param output_enabled: True/False if output is on
+        """
+        self.meas_voltage = float(meas_voltage)
+        self.meas_current = float(meas_current)
+        self.set_voltage = float(set_voltage)
+        self.set_current = float(set_current)
+        self.output_enabled = bool(output_enabled)
+
+    def get_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SupplyReading(object):
+    """
+    Readback of a whole power supply, one SupplyChannelReading per output channel.
+    """
+    __slots__ = ('idn', 'channels')
+
+    def __init__(self, idn, channels):
+        """
+        Create a supply reading.
+
+        :param idn: Identity string of supply
+        :param channels: Dictionary of {channel number: SupplyChannelReading}
+        """
+        self.idn = idn
+        self.channels = channels
+
+    def get_dict(self):
+        return {
+            'idn': self.idn,
+            'channels': {number: channel.get_dict() for number, channel in self.channels.items()},
+        }
+
+
+class PowerSupplyDriver(object):
+    """
+    Common interface of power supply drivers.  Setpoints are queued, flush() waits until they have reached the
+    supply, reading() returns a SupplyReading.
+    """
+    supply_type = None
+    # Output channel numbers
+    channels = (1, 2)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create driver from a power supply config.
+
+        :param config: Power supply config dictionary
+        :return: Driver
+        """
+        return cls()
+
+    @abc.abstractmethod
+    async def open(self, config):
+        """
+        Connect to supply.
+
+        :param config: Power supply config dictionary
+        """
+
+    @abc.abstractmethod
+    async def close(self):
+        """
+        Disconnect from supply.
+        """
+
+    @abc.abstractmethod
+    async def set_voltage(self, channel, voltage):
+        """
+        Queue a voltage setpoint.
+
+        :param channel: Channel number
+        :param voltage: Voltage setpoint
+        """
+
+    @abc.abstractmethod
+    async def set_current(self, channel, current):
+        """
+        Queue a current limit setpoint.
+
+        :param channel: Channel number
+        :param current: Current setpoint
+        """
+
+    @abc.abstractmethod
+    async def set_output(self, channel, enabled):
+        """
+        Queue an output enable setpoint.
+
+        :param channel: Channel number
+        :param enabled: Output enable
+        """
+
+    async def flush(self):
+        """
+        Wait until queued setpoints have reached the supply.
+        """
+
+    @abc.abstractmethod
+    async def reading(self):
+        """
+        Read back supply.
+
+        :return: SupplyReading
+        """
+
+    async def set_voltage_channel1(self, voltage):
+        await self.set_voltage(1, voltage)
+
+    async def set_voltage_channel2(self, voltage):
+        await self.set_voltage(2, voltage)
+
+    async def set_current_channel1(self, current):
+        await self.set_current(1, current)
+
+    async def set_current_channel2(self, current):
+        await self.set_current(2, current)
+
+    async def set_output_channel1(self, boolean):
+        await self.set_output(1, boolean)
+
+    async def set_output_channel2(self, boolean):
+        await self.set_output(2, boolean)
@@ -1,29 +1,116 @@
 import asyncio
 import telnetlib3
 import logging
+from hilcode.lifecycle import DriverTask
+from hilcode.supply import PowerSupplyDriver, SupplyReading, SupplyChannelReading, register_supply
 
 log = logging.getLogger(__name__)
 
 CYCLE_TIME = 0.1
+PORT = 9221
+# Seconds to connect and get the supply's *IDN? reply
+CONNECT_TIMEOUT = 5.0
+PIPELINED_READBACK = True
+TERMINATOR = '\n'
+SEPARATOR = ';'
+# Setpoint command headers, a later setpoint with the same header replaces an earlier one not yet sent
+SETPOINT_HEADERS = ('V1', 'V2', 'I1', 'I2')
+# Output enable headers, never merged or dropped (an off then on is a power cycle) and setpoints don't cross them
+OUTPUT_HEADERS = ('OP1', 'OP2')
 
 def _trim_string(string):
         return str(string).strip()
 
+def _terminate(command):
+    """
+    Append the SCPI message terminator to a command, if it is missing.
+
+    :param command: Command string
+    :return: Terminated command string
+    """
+    if command.endswith(TERMINATOR):
+        return command
+    return f'{command}{TERMINATOR}'
 
-class SorensenXPF6020DP(object):
+def coalesce_commands(commands):
+    """
+    Merge commands waiting to be sent into as few lines as possible.  Runs of setpoints and output enables become
+    one compound line.  A voltage or current setpoint superseded by a later one to the same header is dropped (the
+    later value keeps the earlier position), but never across an output enable: every output enable is sent, in
+    order, so an off then on still power cycles.  Anything else (like *RST) goes on its own line, and nothing is
+    moved across it.
+
+    :param commands: List of commands, in the order queued
+    :return: List of command lines
+    """
+    lines = []
+    parts = []
+    setpoints = {}
+    for command in commands:
+        header = command.split(' ', 1)[0]
+        if header in SETPOINT_HEADERS:
+            setpoints[header] = command
+            continue
+        parts.extend(setpoints.values())
+        setpoints = {}
+        if header in OUTPUT_HEADERS:
+            parts.append(command)
+            continue
+        if parts:
+            lines.append(SEPARATOR.join(parts))
+            parts = []
+        lines.append(command)
+    parts.extend(setpoints.values())
+    if parts:
+        lines.append(SEPARATOR.join(parts))
+    return lines
+
+def _parse_measured(response):
+    return float(response[:-1])
+
+def _parse_setpoint(response):
+    return float(response[3:])
+
+def _parse_output(response):
+    return int(response)
+
+# (channel, field, query, parser) for every value read back each telemetry cycle
+TELEM_QUERIES = (
+    (1, 'meas_voltage', 'V1O?', _parse_measured),
+    (1, 'meas_current', 'I1O?', _parse_measured),
+    (1, 'set_voltage', 'V1?', _parse_setpoint),
+    (1, 'set_current', 'I1?', _parse_setpoint),
+    (1, 'output_enabled', 'OP1?', _parse_output),
+    (2, 'meas_voltage', 'V2O?', _parse_measured),
+    (2, 'meas_current', 'I2O?', _parse_measured),
+    (2, 'set_voltage', 'V2?', _parse_setpoint),
+    (2, 'set_current', 'I2?', _parse_setpoint),
+    (2, 'output_enabled', 'OP2?', _parse_output),
+)
+
+
+@register_supply('sorensen_psu')
+class SorensenXPF6020DP(PowerSupplyDriver):
     """
     Abstraction layer for interfacing with Sorensen XPF 60-20DP Power Supplies
     """
 
-    def __init__(self):
+    def __init__(self, pipelined=PIPELINED_READBACK):
         """
         Abstraction layer for Sorensen XPF 60-20DP Power Supply
+
+        :param pipelined: Write all telemetry queries before reading any replies (default is PIPELINED_READBACK)
         """
-        self._comm_loop_exit = asyncio.Event()
+        self.pipelined = pipelined
+        self._idn = None
         self._new_telem = asyncio.Event()
+        self._connected = asyncio.Event()
         self._comm_telem_queue = asyncio.Queue()
         self._comm_cmd_queue = asyncio.Queue()
-        self._comm_task = None
+        self._last_queued = None
+        self._comm = DriverTask('sorensen_psu')
+        self.commands_sent = 0
+        self.lines_sent = 0
 
     async def _on_connection(self):
         """
@@ -31,47 +118,94 @@ class SorensenXPF6020DP(object):
         """
         await self._generic_command('*RST')
 
-    async def connect(self, host, port=9221):
+    async def open(self, config):
+        """
+        Connect to supply from its config.
+
+        :param config: Power supply config dictionary ('host', optional 'port' and 'connect_timeout')
         """
-        Connect to Sorensen XPF 60-20DP
+        await self.connect(config['host'], config.get('port', PORT), config.get('connect_timeout', CONNECT_TIMEOUT))
+
+    async def connect(self, host, port=PORT, timeout=CONNECT_TIMEOUT):
+        """
+        Connect to Sorensen XPF 60-20DP, returning once it has answered *IDN?.
 
         :param host: Hostname/IP of Supply
         :param port: Port of Supply (default is 9221)
+        :param timeout: Seconds to wait for the supply
+        :return: Nothing, or a ConnectionError if the supply can't be reached or doesn't answer in time
         """
-        self._comm_task = asyncio.create_task(self._comm_loop(host, port))
+        # Readings and wakeups left from an earlier connection don't apply to this one
+        self._comm_telem_queue = asyncio.Queue()
+        self._new_telem.clear()
+        self._connected.clear()
+        self._comm.start(self._comm_loop(host, port))
+        connected = asyncio.ensure_future(self._connected.wait())
+        try:
+            await asyncio.wait((connected, self._comm.task), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            connected.cancel()
+        if not self._connected.is_set():
+            task = self._comm.task
+            error = task.exception() if task.done() and not task.cancelled() else None
+            await self._comm.stop(timeout=0)
+            if error is not None:
+                raise ConnectionError(f'Power supply {host}:{port} connection failed: {error}') from error
+            raise ConnectionError(f'Power supply {host}:{port} did not answer within {timeout}s')
         await self._on_connection()
         log.debug('CONNECTED')
 
-    async def _comm_loop(self, host, port=9221):
+    async def _comm_loop(self, host, port=PORT):
         """
         Coroutine that facilitates communication with power supply.
 
         :param host: Supply hostname/IP
         :param port: Supply port (default is 9221)
         """
-        # Connect to power supply
-        reader, writer = await telnetlib3.open_connection(host, port)
-        while not self._comm_loop_exit.is_set():
-            # Get Telemetry
-            if not self._new_telem.is_set():
-                await self._comm_telem_queue.put(await self._telem_readback(reader, writer))
-                self._new_telem.set() # Flag that new telemetry is available
-            # Send Commands
+        writer = None
+        try:
+            # Connect to power supply
+            reader, writer = await telnetlib3.open_connection(host, port)
+            # Identity doesn't change while connected, so only ask once
+            self._idn = await self._telem_response(reader, writer, '*IDN?')
+            self._connected.set()
+            while not self._comm.stopping():
+                # Send Commands, ahead of telemetry
+                if not self._comm_cmd_queue.empty():
+                    await self._send_commands(writer)
+                # Get Telemetry
+                elif not self._new_telem.is_set():
+                    await self._comm_telem_queue.put(await self._telem_readback(reader, writer))
+                    self._new_telem.set() # Flag that new telemetry is available
+                # Woken early by new commands and telemetry requests
+                else:
+                    await self._comm.sleep(CYCLE_TIME)
+        finally:
+            if writer is not None:
+                writer.close()
+            # Anyone waiting on telemetry or commands would wait forever
+            self._comm_telem_queue.put_nowait(None)
             while not self._comm_cmd_queue.empty():
-                await self._generic_command_loop(writer, await self._comm_cmd_queue.get())
-            await asyncio.sleep(CYCLE_TIME)
-        writer.close()
+                _, sent = self._comm_cmd_queue.get_nowait()
+                sent.set_result(False)
 
-    async def _generic_command_loop(self, writer, command):
+    async def _send_commands(self, writer):
         """
-        Sends a generic command from the communications loop
+        Sends every queued command from the communications loop, coalesced, in one write.
 
-        :param writer: Writer object to write command to
-        :param command: Command to send
+        :param writer: Writer object to write commands to
         """
-        log.debug(f'WRITING: {command}')
-        writer.write(command)
+        queued = []
+        while not self._comm_cmd_queue.empty():
+            queued.append(self._comm_cmd_queue.get_nowait())
+        lines = coalesce_commands([command for command, _ in queued])
+        log.debug(f'WRITING: {lines}')
+        writer.write(''.join(_terminate(line) for line in lines))
         await writer.drain()
+        self.commands_sent += len(queued)
+        self.lines_sent += len(lines)
+        for _, sent in queued:
+            sent.set_result(True)
 
     async def _telem_readback(self, reader, writer):
         """
@@ -80,26 +214,39 @@ class SorensenXPF6020DP(object):
         :param reader: Reader stream to get information from
         :param writer: Writer stream to push information to
         """
-        return {
+        if self.pipelined:
+            responses = await self._telem_responses_pipelined(reader, writer, [q[2] for q in TELEM_QUERIES])
+        else:
+            responses = [await self._telem_response(reader, writer, q[2]) for q in TELEM_QUERIES]
+        readback = {
             0: {
-                'idn':await self._telem_response(reader, writer, '*IDN?'),
-            },
-            1: {
-                'meas_voltage':float((await self._telem_response(reader, writer, f'V1O?'))[:-1]),
-                'meas_current':float((await self._telem_response(reader, writer, f'I1O?'))[:-1]),
-                'set_voltage':float((await self._telem_response(reader, writer, f'V1?'))[3:]),
-                'set_current':float((await self._telem_response(reader, writer, f'I1?'))[3:]),
-                'output_enabled':int((await self._telem_response(reader, writer, 'OP1?'))[:]),
+                'idn': self._idn,
             },
-            2: {
-                'meas_voltage':float((await self._telem_response(reader, writer, f'V2O?'))[:-1]),
-                'meas_current':float((await self._telem_response(reader, writer, f'I2O?'))[:-1]),
-                'set_voltage':float((await self._telem_response(reader, writer, f'V2?'))[3:]),
-                'set_current':float((await self._telem_response(reader, writer, f'I2?'))[3:]),
-                'output_enabled':int((await self._telem_response(reader, writer, 'OP2?'))[:]),
-            }
+            1: {},
+            2: {},
         }
+        for (channel, field, _, parser), response in zip(TELEM_QUERIES, responses):
+            readback[channel][field] = parser(response)
+        return readback
 
+    async def _telem_responses_pipelined(self, reader, writer, commands):
+        """
+        Write every query in one go, then read the replies.  Replies come back in query order.
+
+        :param reader: Reader stream for supply
+        :param writer: Writer stream for supply
+        :param commands: List of commands to send supply
+        :return: List of responses, one per command
+        """
+        log.debug(f'WRITING: {commands}')
+        writer.write(''.join(_terminate(command) for command in commands))
+        await writer.drain()
+        responses = []
+        for _ in commands:
+            response = await reader.readline()
+            log.debug(f'RECV: {response}')
+            responses.append(_trim_string(response))
+        return responses
 
     async def _telem_response(self, reader, writer, command):
         """
@@ -111,7 +258,7 @@ class SorensenXPF6020DP(object):
         :return: Response to command
         """
         log.debug(f'WRITING: {command}')
-        writer.write(command)
+        writer.write(_terminate(command))
         await writer.drain()
         response = await reader.readline()
         log.debug(f'RECV: {response}')
@@ -128,72 +275,84 @@ class SorensenXPF6020DP(object):
         """
         Close power supply communications
         """
-        self._comm_loop_exit.set()
-        while not self._comm_task.done():
-            await asyncio.sleep(0.1)
+        await self._comm.stop()
 
     async def _generic_command(self, command):
         """
-        Send a command to the supply.
+        Queue a command for the supply.  Commands queued together are sent together (see coalesce_commands), use
+        flush() to wait until they have been written.
 
         :param command: Command to send
+        :return: Nothing, or a ConnectionError if the communications loop isn't running (nothing would send it)
         """
-        await self._comm_cmd_queue.put(command)
+        if not self._comm.running():
+            raise ConnectionError('Power supply communications loop not running')
+        self._last_queued = asyncio.get_running_loop().create_future()
+        await self._comm_cmd_queue.put((command, self._last_queued))
+        self._comm.wake()
 
-    async def set_voltage_channel1(self, voltage):
+    async def flush(self):
         """
-        Set Channel 1 Voltage Setpoint
+        Wait until every command queued so far has been written to the supply.
 
-        :param voltage: Voltage setpoint
+        :return: Nothing, or a ConnectionError if the communications loop stopped first
         """
-        await self._generic_command(f'V1 {float(voltage)}')
+        if self._last_queued is not None and not await self._last_queued:
+            raise ConnectionError('Power supply communications loop stopped before commands were sent')
 
-    async def set_voltage_channel2(self, voltage):
+    async def set_voltage(self, channel, voltage):
         """
-        Set Channel 2 Voltage Setpoint
+        Set Voltage Setpoint
 
+        :param channel: Channel number
         :param voltage: Voltage setpoint
         """
-        await self._generic_command(f'V2 {float(voltage)}')
+        await self._generic_command(f'V{int(channel)} {float(voltage)}')
 
-    async def set_current_channel1(self, current):
+    async def set_current(self, channel, current):
         """
-        Set Channel 1 Current Setpoint
+        Set Current Setpoint
 
+        :param channel: Channel number
         :param current: Current setpoint
         """
-        await self._generic_command(f'I1 {float(current)}')
+        await self._generic_command(f'I{int(channel)} {float(current)}')
 
-    async def set_current_channel2(self, current):
+    async def set_output(self, channel, boolean):
         """
-        Set Channel 2 Current Setpoint
-
-        :param current: Current setpoint
-        """
-        await self._generic_command(f'I2 {float(current)}')
-
-    async def set_output_channel1(self, boolean):
-        """
-        Set Channel 1 Output Enable
+        Set Output Enable
 
+        :param channel: Channel number
         :param boolean: Output Enable
         """
-        await self._generic_command(f'OP1 {int(boolean)}')
+        await self._generic_command(f'OP{int(channel)} {int(boolean)}')
 
-    async def set_output_channel2(self, boolean):
+    async def reading(self):
         """
-        Set Channel 1 Output Enable
+        Read back supply.
 
-        :param boolean: Output Enable
+        :return: SupplyReading
         """
-        await self._generic_command(f'OP2 {int(boolean)}')
+        state = await self.supply_state()
+        return SupplyReading(state[0]['idn'], {
+            channel: SupplyChannelReading(**state[channel]) for channel in self.channels
+        })
 
     async def supply_state(self):
         """
         Get state of power supply.
+
+        :return: Telemetry data, or a ConnectionError if the communications loop isn't running
         """
         log.debug('Get Supply State')
+        if not self._comm.running():
+            # A reading left over from before the loop stopped would be stale
+            raise ConnectionError('Power supply communications loop not running')
         # Tell loop to acquire new telemetry
         self._new_telem.clear()
+        self._comm.wake()
         # Return telemetry from queue
-        return await self._comm_telem_queue.get()
+        readback = await self._comm_telem_queue.get()
+        if readback is None:
+            raise ConnectionError('Power supply communications loop stopped')
+        return readback
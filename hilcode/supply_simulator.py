@@ -0,0 +1,250 @@
+import asyncio
+import logging
+from hilcode.supply import PowerSupplyDriver, SupplyReading, SupplyChannelReading, register_supply
+
+log = logging.getLogger(__name__)
+
+IDN = 'THURLBY THANDAR, XPF 60-20DP, 000000, 3.02-4.06'
+LOAD_RESISTANCE = 4.0
+
+# Telnet protocol bytes, stripped from anything a telnet client sends
+IAC = 255
+SB = 250
+SE = 240
+WILL_WONT_DO_DONT = (251, 252, 253, 254)
+
+
+def _strip_telnet(data):
+    """
+    Remove telnet negotiation sequences from received bytes.
+
+    :param data: Bytes received from client
+    :return: Bytes with telnet negotiation removed
+    """
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        if data[i] != IAC:
+            out.append(data[i])
+            i += 1
+        elif i + 1 < len(data) and data[i + 1] in WILL_WONT_DO_DONT:
+            i += 3
+        elif i + 1 < len(data) and data[i + 1] == SB:
+            end = data.find(bytes((IAC, SE)), i)
+            i = len(data) if end < 0 else end + 2
+        else:
+            i += 2
+    return bytes(out)
+
+
+class SupplyModel(object):
+    """
+    Deterministic model of a two channel supply driving a resistive load: voltage, current limit and output state
+    per channel, constant voltage until the load would draw more than the current limit, constant current after.
+    """
+
+    def __init__(self, load_resistance=LOAD_RESISTANCE):
+        """
+        Create a supply model.
+
+        :param load_resistance: Resistance (ohms) of simulated load on each channel
+        """
+        self.load_resistance = load_resistance
+        self.reset()
+
+    def reset(self):
+        """
+        Reset supply to power on state.
+        """
+        self.channels = {
+            1: {'V': 0.0, 'I': 0.0, 'OP': 0},
+            2: {'V': 0.0, 'I': 0.0, 'OP': 0},
+        }
+
+    def measured(self, channel):
+        """
+        Measured output of a channel, resistive load limited by current setpoint.
+
+        :param channel: Channel number
+        :return: Tuple of (volts, amperes)
+        """
+        ch = self.channels[channel]
+        if not ch['OP']:
+            return 0.0, 0.0
+        current = ch['V'] / self.load_resistance
+        if current > ch['I']:
+            # Constant current mode
+            return ch['I'] * self.load_resistance, ch['I']
+        return ch['V'], current
+
+
+@register_supply('simulated_psu')
+class SimulatedSupply(PowerSupplyDriver):
+    """
+    Power supply driver for an in-process SupplyModel, no network or hardware.  Setpoints apply when flushed (or
+    read back), like queued commands on a real supply.
+    """
+
+    def __init__(self, latency=0.0, load_resistance=LOAD_RESISTANCE):
+        """
+        Create a simulated supply.
+
+        :param latency: Seconds each flush and readback takes (simulates device round trip)
+        :param load_resistance: Resistance (ohms) of simulated load on each channel
+        """
+        self.latency = latency
+        self.model = SupplyModel(load_resistance)
+        self._pending = []
+        self._open = False
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(latency=config.get('latency', 0.0), load_resistance=config.get('load_resistance', LOAD_RESISTANCE))
+
+    async def open(self, config):
+        self.model.reset()
+        self._open = True
+
+    async def close(self):
+        self._open = False
+        self._pending = []
+
+    async def set_voltage(self, channel, voltage):
+        self._pending.append((channel, 'V', float(voltage)))
+
+    async def set_current(self, channel, current):
+        self._pending.append((channel, 'I', float(current)))
+
+    async def set_output(self, channel, enabled):
+        self._pending.append((channel, 'OP', int(enabled)))
+
+    async def flush(self):
+        if not self._open:
+            raise ConnectionError('Simulated supply not open')
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        pending, self._pending = self._pending, []
+        for channel, name, value in pending:
+            self.model.channels[channel][name] = value
+
+    async def reading(self):
+        await self.flush()
+        channels = {}
+        for channel in self.channels:
+            ch = self.model.channels[channel]
+            volts, amps = self.model.measured(channel)
+            channels[channel] = SupplyChannelReading(volts, amps, ch['V'], ch['I'], ch['OP'])
+        return SupplyReading(IDN, channels)
+
+
+class SimulatedSorensenServer(object):
+    """
+    Stand-in for a Sorensen XPF 60-20DP, speaking its SCPI-like telnet dialect on a local port.
+    """
+
+    def __init__(self, latency=0.0, load_resistance=LOAD_RESISTANCE):
+        """
+        Create a simulated supply server.
+
+        :param latency: Seconds to wait before answering each received packet (simulates network round trip)
+        :param load_resistance: Resistance (ohms) of simulated load on each channel
+        """
+        self.latency = latency
+        self.model = SupplyModel(load_resistance)
+        self.host = None
+        self.port = None
+        self.packets_received = 0
+        self.commands_received = 0
+        self._server = None
+        self._clients = {}
+
+    @property
+    def channels(self):
+        return self.model.channels
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Start listening.
+
+        :param host: Address to listen on
+        :param port: Port to listen on (default of 0 picks a free port)
+        """
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        """
+        Stop listening.
+        """
+        self._server.close()
+        for writer in list(self._clients):
+            writer.close()
+        await asyncio.gather(*self._clients.values(), return_exceptions=True)
+        await self._server.wait_closed()
+
+    def respond(self, command):
+        """
+        Execute one command.
+
+        :param command: Command string (no terminator)
+        :return: Response string, or None if command has no response
+        """
+        self.commands_received += 1
+        command = command.strip()
+        if command == '*IDN?':
+            return IDN
+        if command == '*RST':
+            self.model.reset()
+            return None
+        header, _, value = command.partition(' ')
+        for name in ('OP', 'V', 'I'):
+            if header.startswith(name) and header[len(name):len(name) + 1] in ('1', '2'):
+                channel = int(header[len(name)])
+                suffix = header[len(name) + 1:]
+                if suffix == '':
+                    self.channels[channel][name] = int(float(value)) if name == 'OP' else float(value)
+                    return None
+                elif suffix == '?':
+                    if name == 'OP':
+                        return str(self.channels[channel]['OP'])
+                    return f'{name}{channel} {self.channels[channel][name]:.3f}'
+                elif suffix == 'O?':
+                    volts, amps = self.model.measured(channel)
+                    return f'{volts:.3f}V' if name == 'V' else f'{amps:.3f}A'
+        log.warning(f'Simulated supply got unknown command {command}')
+        return None
+
+    async def _handle_client(self, reader, writer):
+        """
+        Serve one client connection.
+
+        :param reader: Socket stream reader
+        :param writer: Socket stream writer
+        """
+        buffer = b''
+        self._clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                self.packets_received += 1
+                buffer += _strip_telnet(data)
+                *messages, buffer = buffer.split(b'\n')
+                responses = []
+                for message in messages:
+                    for command in message.decode(errors='replace').split(';'):
+                        if command.strip():
+                            response = self.respond(command)
+                            if response is not None:
+                                responses.append(f'{response}\r\n')
+                if responses:
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    writer.write(''.join(responses).encode())
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.pop(writer, None)
+            writer.close()
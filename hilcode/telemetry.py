@@ -1,5 +1,7 @@
 import pprint
 import json
+import sys
+from array import array
 
 class TelemetryJsonLine(object):
     """
@@ -47,20 +49,88 @@ class TelemetryJsonLine(object):
         return [tlm_ch.get_dict() for tlm_ch in self.telemetry]
 
 
+# Typed array codes for numeric channel types, every other type is held in a list
+ARRAY_TYPECODES = {
+    'unit': 'd',
+    'float': 'd',
+    'boolean': 'b',
+}
+
+
 class TelemetryChannel(object):
     """
-    A telemetry channel, which contains a list of points that have accumulated about that channel.
+    A telemetry channel, which contains the points that have accumulated about that channel.  Points are stored
+    column-wise: a typed array of timestamps and a typed array (or list of interned strings) of values.  The latest
+    point is kept after the columns are drained, and watchers are called with every point as it is added.
     """
+    __slots__ = ('name', 'fqn', 'type', 'unit', 'timestamps', 'values', 'last_timestamp', 'last_value', 'watchers')
 
-    def __init__(self, name):
+    def __init__(self, name, type=None, unit=None):
         """
         Create a telemetry channel
 
         :param name: Name of channel
+        :param type: (optional) Point type of channel ('unit', 'float', 'boolean', 'string', 'default'), taken from
+                     the first point added if not given
+        :param unit: (optional) Unit of channel values, for 'unit' channels
         """
         self.name = name
-        self.points = []
-        self.type = 'default'
+        self.fqn = name
+        self.type = type
+        self.unit = unit
+        self.timestamps = array('d')
+        self.values = self._new_values()
+        self.last_timestamp = None
+        self.last_value = None
+        self.watchers = []
+
+    def _new_values(self):
+        """
+        Empty value column for channel type.
+
+        :return: Typed array, or list for non-numeric channels
+        """
+        typecode = ARRAY_TYPECODES.get(self.type)
+        if typecode is None:
+            return []
+        return array(typecode)
+
+    def append(self, timestamp, value):
+        """
+        Add a value to channel (fast path, no point object).
+
+        :param timestamp: Timestamp of value
+        :param value: Value
+        """
+        if self.type is None:
+            self.type = 'default'
+            self.values = self._new_values()
+        if isinstance(value, str):
+            value = sys.intern(value)
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+        self.last_timestamp = timestamp
+        self.last_value = value
+        if self.watchers:
+            for watcher in tuple(self.watchers):
+                watcher(timestamp, value)
+
+    def watch(self, callback):
+        """
+        Call a function with every point added to channel, until unwatch().
+
+        :param callback: Function called as callback(timestamp, value), it must not block
+        """
+        self.watchers.append(callback)
+
+    def unwatch(self, callback):
+        """
+        Stop calling a function added with watch().
+
+        :param callback: Function
+        """
+        if callback in self.watchers:
+            self.watchers.remove(callback)
 
     def add_point(self, point):
         """
@@ -68,7 +138,40 @@ class TelemetryChannel(object):
 
         :param point: Telemetry point
         """
-        self.points.append(point)
+        if self.type is None:
+            self.type = point.type
+            self.unit = getattr(point, 'unit', None)
+            self.values = self._new_values()
+        self.append(point.timestamp, point.value)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def drain(self):
+        """
+        Take all points in channel, without copying.  The channel starts new columns, the returned ones are owned
+        by the caller.
+
+        :return: Tuple of (timestamps, values) columns
+        """
+        timestamps, values = self.timestamps, self.values
+        self.timestamps = array('d')
+        self.values = self._new_values()
+        return timestamps, values
+
+    def _point_dict(self, timestamp, value):
+        """
+        Dictionary representation of one point in channel.
+
+        :param timestamp: Timestamp of point
+        :param value: Value of point
+        :return: Dictionary representation of point
+        """
+        if self.type == 'boolean':
+            value = bool(value)
+        point = _point_dict(self.name, self.type, self.unit, value)
+        point['timestamp'] = timestamp
+        return point
 
     def get_points(self):
         """
@@ -76,7 +179,7 @@ class TelemetryChannel(object):
 
         :return: All telemetry points in channel currently
         """
-        return [point.get_dict() for point in self.points]
+        return [self._point_dict(t, v) for t, v in zip(self.timestamps, self.values)]
 
     def pop_points(self):
         """
@@ -84,9 +187,8 @@ class TelemetryChannel(object):
 
         :return: All telemetry points in channel currently
         """
-        points = [point.get_dict() for point in self.points]
-        self.points = []
-        return points
+        timestamps, values = self.drain()
+        return [self._point_dict(t, v) for t, v in zip(timestamps, values)]
 
     def pop_point(self):
         """
@@ -94,13 +196,20 @@ class TelemetryChannel(object):
 
         :return: Latest telemetry point from channel
         """
-        return self.points.pop()
+        timestamp = self.timestamps.pop()
+        value = self.values.pop()
+        if self.type == 'boolean':
+            value = bool(value)
+        if self.type == 'unit':
+            return UnitTelemetryPoint(self.name, timestamp, value, self.unit)
+        return POINT_CLASSES.get(self.type, TelemetryPoint)(self.name, timestamp, value)
 
 
 class TelemetryPoint(object):
     """
     Generic Telemetry Point (You probably want a child class)
     """
+    __slots__ = ('name', 'value', 'timestamp', 'type')
 
     def __init__(self, name, timestamp, value):
         """
@@ -140,6 +249,7 @@ class StringTelemetryPoint(TelemetryPoint):
     """
     A telemetry point containing a string value.
     """
+    __slots__ = ()
     def __init__(self, name, timestamp, value):
         """
         Create a telemetry point containing a string value
@@ -155,6 +265,7 @@ class BooleanTelemetryPoint(TelemetryPoint):
     """
     A telemetry point containing a boolean value.
     """
+    __slots__ = ()
     def __init__(self, name, timestamp, value):
         """
         Create a telemetry point containing a boolean value
@@ -170,6 +281,7 @@ class FloatTelemetryPoint(TelemetryPoint):
     """
     A telemetry point containing a float value.
     """
+    __slots__ = ()
     def __init__(self, name, timestamp, value):
         """
         Create a telemetry point containing a float value
@@ -185,6 +297,7 @@ class UnitTelemetryPoint(FloatTelemetryPoint):
     """
     A telemetry point containing a float value and unit string.
     """
+    __slots__ = ('unit',)
     def __init__(self, name, timestamp, value, unit):
         """
         Create a telemetry point containing a float value and a unit string
@@ -214,6 +327,14 @@ class UnitTelemetryPoint(FloatTelemetryPoint):
         }
 
 
+POINT_CLASSES = {
+    'default': TelemetryPoint,
+    'string': StringTelemetryPoint,
+    'boolean': BooleanTelemetryPoint,
+    'float': FloatTelemetryPoint,
+}
+
+
 class TelemetryKeeper(object):
     """
     Class for managing multiple telemetry channels associated with an object.
@@ -226,8 +347,11 @@ class TelemetryKeeper(object):
         :param name: Name for set of telemetry channels
         """
         self.name = name
+        self.fqn = name
+        self.parent = None
         self.telemetry_channels = {}
         self.telemetry_keepers = {}
+        self._purge_listeners = []
 
     def purge(self, name):
         """
@@ -238,9 +362,24 @@ class TelemetryKeeper(object):
         if name in self.telemetry_channels.keys():
             self.telemetry_channels.pop(name)
         elif name in self.telemetry_keepers.keys():
-            self.telemetry_keepers.pop(name)
+            self.telemetry_keepers.pop(name).parent = None
         else:
             RuntimeError(f'{name} not found in telemetry channels or keepers.')
+            return
+        fqn = f'{self.fqn}.{name}'
+        keeper = self
+        while keeper is not None:
+            for listener in keeper._purge_listeners:
+                listener(fqn)
+            keeper = keeper.parent
+
+    def on_purge(self, listener):
+        """
+        Call a function whenever a channel or keeper is purged from this keeper or any keeper under it.
+
+        :param listener: Function called as listener(fully qualified name of purged channel or keeper)
+        """
+        self._purge_listeners.append(listener)
 
     def add_telemetry_channel(self, channel):
         """
@@ -248,6 +387,7 @@ class TelemetryKeeper(object):
 
         :param channel: Telemetry channel to add
         """
+        channel.fqn = f'{self.fqn}.{channel.name}'
         self.telemetry_channels[channel.name] = channel
 
     def add_telemetry_keeper(self, keeper):
@@ -256,8 +396,22 @@ class TelemetryKeeper(object):
 
         :param keeper: Keeper with telemetry channels to add to this keeper as a subset
         """
+        keeper._set_prefix(f'{self.fqn}.')
+        keeper.parent = self
         self.telemetry_keepers[keeper.name] = keeper
 
+    def _set_prefix(self, prefix):
+        """
+        Recompute fully qualified names of this keeper, its channels and sub-keepers after it's placed in a tree.
+
+        :param prefix: Fully qualified name of parent keeper, plus '.'
+        """
+        self.fqn = f'{prefix}{self.name}'
+        for name, channel in self.telemetry_channels.items():
+            channel.fqn = f'{self.fqn}.{name}'
+        for keeper in self.telemetry_keepers.values():
+            keeper._set_prefix(f'{self.fqn}.')
+
     def __str__(self):
         """
         Pretty formatted text of all telemetry objects
@@ -266,57 +420,150 @@ class TelemetryKeeper(object):
         """
         return pprint.pformat(self.current_data_dict())
 
-    def current_data_dict(self, prefix=''):
+    def drain_columns(self):
+        """
+        Take all points from every channel in keeper (and sub-keepers), without copying.
+
+        :return: Generator of (name, type, unit, timestamps, values) tuples, one per channel
+        """
+        for channel in self.telemetry_channels.values():
+            timestamps, values = channel.drain()
+            yield channel.fqn, channel.type, channel.unit, timestamps, values
+        for tk in self.telemetry_keepers.values():
+            yield from tk.drain_columns()
+
+    def records(self):
+        """
+        Take all points from every channel in keeper (and sub-keepers), in one pass over the tree.
+
+        :return: Generator of (timestamp, name, type, value, unit) records
+        """
+        for channel in self.telemetry_channels.values():
+            if not channel.timestamps:
+                continue
+            name, point_type, unit = channel.fqn, channel.type, channel.unit
+            timestamps, values = channel.drain()
+            if point_type == 'boolean':
+                values = map(bool, values)
+            for timestamp, value in zip(timestamps, values):
+                yield timestamp, name, point_type, value, unit
+        for tk in self.telemetry_keepers.values():
+            yield from tk.records()
+
+    def drain_to(self, *stages):
+        """
+        Take all points and feed each record to every consumer stage.
+
+        :param stages: Objects with an add(timestamp, name, type, value, unit) method
+        """
+        for record in self.records():
+            for stage in stages:
+                stage.add(*record)
+
+    def find_channel(self, name):
+        """
+        Look up a channel by its name below this keeper, like 'leonardo.psu.pri_meas_curr' from the HIL's keeper.
+
+        :param name: Dot separated keeper names, then channel name
+        :return: Telemetry channel, or None if there is no such channel
+        """
+        *keepers, channel = str(name).split('.')
+        keeper = self
+        for keeper_name in keepers:
+            keeper = keeper.telemetry_keepers.get(keeper_name)
+            if keeper is None:
+                return None
+        return keeper.telemetry_channels.get(channel)
+
+    def current_data_dict(self):
         """
         Dump status of all telemetry objects in keeper.
 
-        :param prefix: Append this prefix to each telemetry object name.
         :return: Dictionary containing all telemetry objects.
         """
-        # All Telem Channels
-        data = {f'{prefix}{self.name}.{name}':x.pop_points() for name, x in self.telemetry_channels.items()}
-        # TODO(bhendrix) FIX HACK, why are we doing it this way again?
-        for name, points in data.items():
-            for point in points:
-                point['name'] = name
-        # All telem keepers
-        for tk_name, tk in self.telemetry_keepers.items():
-            tk_data = tk.current_data_dict(prefix=f'{prefix}{self.name}.')
-            data.update(tk_data)
+        data = {channel.fqn: [] for channel in self.channels()}
+        for timestamp, name, point_type, value, unit in self.records():
+            point = _point_dict(name, point_type, unit, value)
+            point['timestamp'] = timestamp
+            data[name].append(point)
         return data
 
+    def channels(self):
+        """
+        Every telemetry channel in keeper and sub-keepers.
+
+        :return: Generator of telemetry channels
+        """
+        yield from self.telemetry_channels.values()
+        for tk in self.telemetry_keepers.values():
+            yield from tk.channels()
+
     def timestamped_data(self):
         """
         Dump status of all telemetry objects in keeper, but in a list of tuples contianing (timestamp, data_point)
 
         :return: List of tuples containing (timestamp, data_point)
         """
-        data = self.current_data_dict()
-        ts_dict = {}
-        for name, points in data.items():
-            for point in points:
-                #remove extraneous timestamp
-                timestamp = point['timestamp']
-                if point['type'] == 'unit':
-                    point = {
-                        'name': point['name'],
-                        'type': point['type'],
-                        'value': point['value'],
-                        'unit': point['unit']
-                    }
-                else:
-                    point = {
-                        'name': point['name'],
-                        'type': point['type'],
-                        'value': point['value']
-                    }
-                # Create timestamped dict
-                if timestamp in ts_dict.keys():
-                    ts_dict[timestamp].append(point)
-                else:
-                    ts_dict[timestamp] = [point]
-        return ts_dict
+        return group_by_timestamp(self.records())
+
+
+def _point_dict(name, point_type, unit, value):
+    """
+    Dictionary representation of a point's value (no timestamp).
+
+    :param name: Channel name
+    :param point_type: Channel point type
+    :param unit: Channel unit
+    :param value: Point value
+    :return: Dictionary representation of point
+    """
+    if point_type == 'unit':
+        return {
+            'name': name,
+            'type': point_type,
+            'value': value,
+            'unit': unit
+        }
+    return {
+        'name': name,
+        'type': point_type,
+        'value': value
+    }
 
 
+class TimestampGrouper(object):
+    """
+    Consumer stage that groups telemetry records by timestamp (the HTTP/stream snapshot format).
+    """
 
+    def __init__(self):
+        self.data = {}
 
+    def add(self, timestamp, name, point_type, value, unit):
+        """
+        Add one telemetry record.
+
+        :param timestamp: Timestamp of record
+        :param name: Fully qualified channel name
+        :param point_type: Channel point type
+        :param value: Value
+        :param unit: Channel unit
+        """
+        point = _point_dict(name, point_type, unit, value)
+        if timestamp in self.data:
+            self.data[timestamp].append(point)
+        else:
+            self.data[timestamp] = [point]
+
+
+def group_by_timestamp(records):
+    """
+    Group telemetry records by timestamp.
+
+    :param records: Iterable of (timestamp, name, type, value, unit) records (see TelemetryKeeper.records)
+    :return: Dictionary of {timestamp: [point dictionaries]}
+    """
+    grouper = TimestampGrouper()
+    for record in records:
+        grouper.add(*record)
+    return grouper.data
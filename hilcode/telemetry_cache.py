@@ -0,0 +1,155 @@
+import bisect
+import fnmatch
+import json
+import logging
+from hilcode.command import is_broadcast
+from hilcode.telemetry import _point_dict
+
+log = logging.getLogger(__name__)
+
+
+class LatestValueCache(object):
+    """
+    Latest point of every telemetry channel, updated as channels are gathered and kept as pre-serialized JSON.
+    Each channel's JSON is rebuilt only when it has a new point (it is dirty), so a query costs joining strings,
+    not encoding every channel again, and reading it takes nothing away from other telemetry consumers.  Channels
+    are named by target path (see update), like HIL.find_channel, so 'leonardo.hia.serial_out' is both a query and
+    a WAIT_ON_VAR channel.
+    """
+
+    def __init__(self, prefix=''):
+        """
+        Create an empty cache.
+
+        :param prefix: Prefix stripped from channel names (the root keeper's name and a dot), so names match command
+                       targets like 'leonardo.psu.pri_meas_curr'
+        """
+        self.prefix = prefix
+        self.updates = 0
+        self.serializations = 0
+        self.evictions = 0
+        self._points = {}
+        self._fqns = {}
+        self._fragments = {}
+        self._names = []
+        self._dirty = set()
+        self._buffer = '{}'
+        self._buffer_stale = False
+
+    def __len__(self):
+        return len(self._points)
+
+    def update(self, channels, keeper=None, target=None):
+        """
+        Take the latest point of channels that have a newer one than cached.
+
+        :param channels: Iterable of TelemetryChannel
+        :param keeper: (optional) TelemetryKeeper the channels are in, named by target instead of by keeper path
+                       (a micro 'hia' keeps its channels in keeper 'micro_hia')
+        :param target: (optional) Target path of component owning keeper, like 'leonardo.hia'
+        """
+        if keeper is not None:
+            prefix, replacement = keeper.fqn, target
+        else:
+            prefix, replacement = self.prefix.rstrip('.'), ''
+        for channel in channels:
+            timestamp = channel.last_timestamp
+            if timestamp is None:
+                continue
+            fqn = channel.fqn
+            name = f'{replacement}{fqn[len(prefix):]}'.lstrip('.') if fqn.startswith(f'{prefix}.') else fqn
+            cached = self._points.get(name)
+            if cached is not None and cached[0] == timestamp:
+                continue
+            if cached is None:
+                bisect.insort(self._names, name)
+            value = bool(channel.last_value) if channel.type == 'boolean' else channel.last_value
+            self._points[name] = (timestamp, channel.type, value, channel.unit)
+            self._fqns[name] = fqn
+            self._dirty.add(name)
+            self._buffer_stale = True
+            self.updates += 1
+
+    def evict(self, fqn):
+        """
+        Forget a channel, or every channel of a keeper, that was purged (like a VCU's subcomponents at desetup).
+
+        :param fqn: Fully qualified name of purged channel or keeper
+        """
+        # Cached names are target paths, purges name keeper paths
+        evicted = [name for name, cached in self._fqns.items() if cached == fqn or cached.startswith(f'{fqn}.')]
+        if not evicted:
+            return
+        for name in evicted:
+            del self._points[name]
+            del self._fqns[name]
+            self._fragments.pop(name, None)
+            self._dirty.discard(name)
+        self._names = [name for name in self._names if name in self._points]
+        self._buffer_stale = True
+        self.evictions += len(evicted)
+
+    def _fragment(self, name):
+        """
+        JSON of one channel ('"name": {point}'), re-encoded only if it changed since last time.
+
+        :param name: Channel name
+        :return: JSON fragment
+        """
+        if name in self._dirty:
+            timestamp, point_type, value, unit = self._points[name]
+            point = _point_dict(name, point_type, unit, value)
+            point['timestamp'] = timestamp
+            self._fragments[name] = f'{json.dumps(name)}: {json.dumps(point)}'
+            self._dirty.discard(name)
+            self.serializations += 1
+        return self._fragments[name]
+
+    def names(self, pattern):
+        """
+        Channel names a query selects: a channel name, a glob matched one dot separated part at a time
+        ('*.psu.pri_meas_curr', 'leonardo.psu.*'), or a VCU or component name selecting every channel under it.
+
+        :param pattern: Channel name, glob or prefix
+        :return: Sorted list of channel names
+        """
+        if pattern in self._points:
+            return [pattern]
+        if is_broadcast(pattern):
+            tokens = pattern.split('.')
+            return [name for name in self._names if len(name.split('.')) == len(tokens) and
+                    all(fnmatch.fnmatchcase(part, token) for part, token in zip(name.split('.'), tokens))]
+        start = bisect.bisect_left(self._names, f'{pattern}.')
+        end = bisect.bisect_left(self._names, f'{pattern}/')
+        return self._names[start:end]
+
+    def json(self, pattern=None):
+        """
+        Latest points as a JSON object of {channel name: point}.
+
+        :param pattern: (optional) Channel name, glob or prefix (see names), every channel if not given
+        :return: JSON string, or None if pattern selects nothing
+        """
+        if pattern is None:
+            if self._buffer_stale:
+                self._buffer = f'{{{", ".join(self._fragment(name) for name in self._names)}}}'
+                self._buffer_stale = False
+            return self._buffer
+        names = self.names(pattern)
+        if not names:
+            return None
+        return f'{{{", ".join(self._fragment(name) for name in names)}}}'
+
+    def stats(self):
+        """
+        Cache counters.
+
+        :return: Dictionary of channel count, updates taken, channels serialized and channels evicted
+        """
+        return {
+            'channels': len(self._points),
+            'updates': self.updates,
+            'serializations': self.serializations,
+            'evictions': self.evictions,
+            'dirty': len(self._dirty),
+        }
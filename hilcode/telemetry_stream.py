@@ -0,0 +1,168 @@
+import asyncio
+import collections
+import logging
+
+log = logging.getLogger(__name__)
+
+HISTORY_SIZE = 200
+SUBSCRIBER_BUFFER = 100
+
+
+class TelemetrySubscriber(object):
+    """
+    One consumer of broadcast telemetry, with its own bounded buffer.  A slow subscriber loses its oldest entries
+    (counted in dropped), it never holds back the broadcaster or other subscribers.
+    """
+
+    def __init__(self, buffer_size=SUBSCRIBER_BUFFER):
+        """
+        Create a subscriber.
+
+        :param buffer_size: Maximum number of entries held for this subscriber
+        """
+        self.buffer_size = buffer_size
+        self.buffer = collections.deque()
+        self.dropped = 0
+        self.cursor = 0
+        self.reset = False
+        self._ready = asyncio.Event()
+
+    def push(self, seq, data):
+        """
+        Add an entry to this subscriber's buffer.
+
+        :param seq: Sequence number of entry
+        :param data: Entry data
+        """
+        if len(self.buffer) >= self.buffer_size:
+            self.buffer.popleft()
+            self.dropped += 1
+        self.buffer.append((seq, data))
+        self._ready.set()
+
+    async def get(self, timeout=None):
+        """
+        Wait for entries, then take everything buffered.
+
+        :param timeout: (optional) Seconds to wait, returns an empty list on timeout
+        :return: List of (sequence number, data) tuples
+        """
+        if not self.buffer:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return []
+        entries = list(self.buffer)
+        self.buffer.clear()
+        if entries:
+            self.cursor = entries[-1][0]
+        return entries
+
+
+class TelemetryBroadcaster(object):
+    """
+    Fans out each published telemetry snapshot to any number of subscribers.  Keeps a short history so a consumer
+    can resume from a cursor (the sequence number of the last entry it saw).
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        """
+        Create a broadcaster.
+
+        :param history_size: Number of entries kept for resuming and polling
+        """
+        self.seq = 0
+        self.history = collections.deque(maxlen=history_size)
+        self.subscribers = set()
+        self._published = asyncio.Event()
+
+    def publish(self, data):
+        """
+        Publish a telemetry snapshot to every subscriber.
+
+        :param data: Telemetry snapshot (see TelemetryKeeper.timestamped_data)
+        :return: Sequence number of snapshot
+        """
+        self.seq += 1
+        self.history.append((self.seq, data))
+        for subscriber in self.subscribers:
+            subscriber.push(self.seq, data)
+        # Wake pollers, and give the next ones a fresh event to wait on
+        self._published.set()
+        self._published = asyncio.Event()
+        return self.seq
+
+    def is_reset(self, cursor):
+        """
+        Can't a cursor be resumed from?  It is either ahead of the last entry (the service restarted and numbering
+        started over) or older than history (entries after it are gone).
+
+        :param cursor: Sequence number of last entry seen
+        :return: True/False if consumer has to start over from everything held
+        """
+        if cursor > self.seq:
+            return True
+        oldest = self.history[0][0] if self.history else self.seq + 1
+        return 0 < cursor < oldest - 1
+
+    def since(self, cursor):
+        """
+        Entries newer than a cursor, from history.  A cursor that can't be resumed from (see is_reset) gets
+        everything held, a fresh snapshot to continue from the last entry's cursor.
+
+        :param cursor: Sequence number of last entry seen (0 for everything held)
+        :return: Tuple of (list of (sequence number, data), number of entries missed because history moved past them,
+                 True/False if cursor was reset)
+        """
+        if self.is_reset(cursor):
+            entries = list(self.history)
+            oldest = entries[0][0] if entries else self.seq + 1
+            # Entries missed can only be counted when history moved past cursor, not after a restart
+            missed = oldest - cursor - 1 if cursor <= self.seq else 0
+            return entries, missed, True
+        return [(seq, data) for seq, data in self.history if seq > cursor], 0, False
+
+    async def wait_since(self, cursor, timeout):
+        """
+        Like since(), but waits (up to timeout) for something newer than cursor if there is nothing yet.
+
+        :param cursor: Sequence number of last entry seen
+        :param timeout: Seconds to wait
+        :return: Tuple of (list of (sequence number, data), number of entries missed, True/False if cursor was reset)
+        """
+        if self.seq == cursor:
+            try:
+                await asyncio.wait_for(self._published.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.since(cursor)
+
+    def subscribe(self, cursor=None, buffer_size=SUBSCRIBER_BUFFER):
+        """
+        Add a subscriber.
+
+        :param cursor: (optional) Resume after this sequence number, history newer than it is replayed (all of it if
+                       cursor can't be resumed from, see is_reset)
+        :param buffer_size: Maximum number of entries held for subscriber
+        :return: TelemetrySubscriber
+        """
+        subscriber = TelemetrySubscriber(buffer_size)
+        subscriber.cursor = self.seq
+        if cursor is not None:
+            entries, missed, reset = self.since(cursor)
+            subscriber.dropped += missed
+            subscriber.reset = reset
+            subscriber.cursor = entries[0][0] - 1 if reset and entries else min(cursor, self.seq)
+            for seq, data in entries:
+                subscriber.push(seq, data)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """
+        Remove a subscriber.
+
+        :param subscriber: TelemetrySubscriber
+        """
+        self.subscribers.discard(subscriber)
@@ -0,0 +1,121 @@
+import asyncio
+import operator
+import re
+import logging
+from hilcode.command import CommandWarning
+
+log = logging.getLogger(__name__)
+
+# Comparisons a predicate can make, by operator name
+COMPARISONS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+# Operator matching a regular expression anywhere in a string channel's value
+MATCH = 'match'
+# Operators that only make sense for numbers
+THRESHOLDS = ('<', '<=', '>', '>=')
+
+
+class ChannelPredicate(object):
+    """
+    Condition on a telemetry channel's value, like == 'idle', > 1.5, or match 'login:'.
+    """
+
+    def __init__(self, op, value):
+        """
+        Create a predicate.
+
+        :param op: Operator, one of ==, !=, <, <=, >, >= or match
+        :param value: Value compared against (a number for thresholds, a regular expression for match)
+        """
+        if op != MATCH and op not in COMPARISONS:
+            raise CommandWarning(f'Operator {op} not recognized, use one of {", ".join([*COMPARISONS, MATCH])}')
+        self.op = op
+        self.value = value
+        self._regex = None
+        if op == MATCH:
+            try:
+                self._regex = re.compile(str(value))
+            except re.error as e:
+                raise CommandWarning(f'Bad regular expression {value!r}: {e}')
+        elif op in THRESHOLDS:
+            try:
+                self.value = float(value)
+            except (TypeError, ValueError):
+                raise CommandWarning(f'Operator {op} needs a number, not {value!r}')
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        Build a predicate from WAIT_ON_VAR options: {'op': operator, 'value': value}.
+
+        :param options: Command options
+        :return: ChannelPredicate
+        """
+        if 'value' not in options:
+            raise CommandWarning('WAIT_ON_VAR needs a value to compare against')
+        return cls(options.get('op', '=='), options['value'])
+
+    def test(self, value):
+        """
+        Does a channel value meet the condition?
+
+        :param value: Channel value
+        :return: True/False if condition holds
+        """
+        if self._regex is not None:
+            return isinstance(value, str) and self._regex.search(value) is not None
+        if self.op in THRESHOLDS:
+            if isinstance(value, str):
+                return False
+        try:
+            return bool(COMPARISONS[self.op](value, self.value))
+        except TypeError:
+            return False
+
+    def __str__(self):
+        return f'{self.op} {self.value!r}'
+
+
+def channel_path(target, channel):
+    """
+    Path of a channel named relative to a command target (see HIL.find_channel).
+
+    :param target: Command target, or empty for a path from the HIL
+    :param channel: Channel name, relative to target
+    :return: Channel path, like 'leonardo.psu.pri_meas_curr'
+    """
+    return f'{target}.{channel}' if target else str(channel)
+
+
+async def wait_for_channel(channel, predicate, timeout=None):
+    """
+    Wait until a channel's value meets a predicate.  The latest value is checked first, then every new point is
+    checked as the channel's gather adds it, so the wait ends on the sample that meets it (no polling).
+
+    :param channel: TelemetryChannel
+    :param predicate: ChannelPredicate
+    :param timeout: (optional) Seconds to wait
+    :return: Tuple of (True/False if predicate was met, timestamp, value), the channel's latest point if not met
+    """
+    if channel.last_timestamp is not None and predicate.test(channel.last_value):
+        return True, channel.last_timestamp, channel.last_value
+    met = asyncio.get_running_loop().create_future()
+
+    def watcher(timestamp, value):
+        if not met.done() and predicate.test(value):
+            met.set_result((timestamp, value))
+
+    channel.watch(watcher)
+    try:
+        timestamp, value = await asyncio.wait_for(met, timeout=timeout)
+        return True, timestamp, value
+    except asyncio.TimeoutError:
+        return False, channel.last_timestamp, channel.last_value
+    finally:
+        channel.unwatch(watcher)
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import pytest
+from hilcode.command import Command, CommandError, CommandResult, CommandStatus, Operation, is_broadcast
+
+
+def _tracked():
+    cmd = Command(operation=Operation.NO_OP, target='leonardo', command_id=7)
+    cmd.track()
+    return cmd
+
+
+def test_wait_returns_result_when_command_finishes():
+    async def run():
+        cmd = _tracked()
+        asyncio.get_running_loop().call_later(0.01, cmd.finish, CommandStatus.SUCCESS, None, 'OK')
+        result = await cmd.wait(1)
+        assert (result.command_id, result.status, result.value) == (7, CommandStatus.SUCCESS, 'OK')
+        assert result.queued_at <= result.finished_at
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_wait_times_out_without_cancelling_command():
+    async def run():
+        cmd = _tracked()
+        cmd.start()
+        result = await cmd.wait(0.01)
+        assert result.status == CommandStatus.TIMEOUT and result.started_at is not None
+        assert not cmd.done()
+        # The command still finishes, and a later wait sees it
+        cmd.finish(CommandStatus.SUCCESS)
+        assert (await cmd.wait(1)).status == CommandStatus.SUCCESS
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_first_finish_wins():
+    async def run():
+        cmd = _tracked()
+        cmd.finish(CommandStatus.ERROR, 'broken')
+        cmd.finish(CommandStatus.SUCCESS)
+        result = await cmd.wait(1)
+        assert (result.status, result.warning) == (CommandStatus.ERROR, 'broken')
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_untracked_command_cannot_be_waited_on():
+    async def run():
+        with pytest.raises(CommandError):
+            await Command(operation=Operation.NO_OP).wait(1)
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_result_round_trips_through_dict():
+    result = CommandResult(command_id='a1', status=CommandStatus.WARNING, warning='slow', value=[1, 2],
+                           queued_at=10.0, started_at=10.5, finished_at=12.0)
+    d = json.loads(str(result))
+    assert d['latency'] == 2.0
+    again = CommandResult.from_dict(d)
+    assert again.to_dict() == result.to_dict()
+
+
+def test_command_id_round_trips_through_json():
+    cmd = Command(operation=Operation.NO_OP, target='leonardo.psu', command_id=3)
+    again = Command(str(cmd))
+    assert (again.operation, again.target, again.command_id) == (Operation.NO_OP, 'leonardo.psu', 3)
+    assert 'id' not in Command(operation=Operation.NO_OP).to_dict()
+
+
+def test_lists_and_globs_are_broadcasts():
+    assert is_broadcast(['leonardo']) and is_broadcast('*.psu') and is_broadcast('leonardo.h[ia]*')
+    assert not is_broadcast('leonardo.psu') and not Command(operation=Operation.NO_OP, target='').is_broadcast()
+
+
+def test_combined_result_takes_worst_status():
+    results = {
+        'leonardo': CommandResult(status=CommandStatus.SUCCESS, value=1),
+        'donatello': CommandResult(status=CommandStatus.TIMEOUT),
+        'raphael': CommandResult(status=CommandStatus.WARNING, warning='no psu'),
+    }
+    combined = CommandResult.combine('b1', results)
+    assert (combined.command_id, combined.status) == ('b1', CommandStatus.TIMEOUT)
+    assert combined.warning == '2 of 3 targets did not succeed: donatello, raphael'
+    assert combined.value['targets']['raphael']['warning'] == 'no psu'
+    assert combined.value['targets']['leonardo']['value'] == 1
+    results['michelangelo'] = CommandResult(status=CommandStatus.ERROR)
+    assert CommandResult.combine('b1', results).status == CommandStatus.ERROR
+
+
+def test_all_succeeded_broadcast_has_no_warning():
+    combined = CommandResult.combine('b1', {'leonardo': CommandResult(status=CommandStatus.SUCCESS)})
+    assert (combined.status, combined.warning) == (CommandStatus.SUCCESS, None)
+
+
+def test_fan_out_gives_each_target_its_own_tracked_command():
+    async def run():
+        cmd = Command(operation=Operation.PWR_SUPPLY_CMD, target='*.psu', options={'command': 'set_defaults'})
+        commands = cmd.fan_out(['leonardo.psu', 'donatello.psu'])
+        assert [target_command.target for target_command in commands] == ['leonardo.psu', 'donatello.psu']
+        commands[0].options['command'] = 'enable'
+        assert commands[1].options == cmd.options == {'command': 'set_defaults'}
+        assert all(target_command.result.queued_at is not None for target_command in commands)
+    asyncio.run(asyncio.wait_for(run(), 5))
@@ -0,0 +1,137 @@
+import asyncio
+import time
+import pytest
+from hilcode.command import CommandWarning, RoutingError
+from hilcode.components import HIL, VCU, Component
+from hilcode.supply import register_supply
+from hilcode.supply_simulator import SimulatedSupply
+
+SIMULATED_PSU = {'type': 'simulated_psu', 'defaults': {}}
+
+
+@register_supply('hanging_test_psu')
+class HangingSupply(SimulatedSupply):
+    """
+    Simulated supply that never finishes connecting.
+    """
+    closed = 0
+
+    async def open(self, config):
+        await asyncio.sleep(3600)
+
+    async def close(self):
+        HangingSupply.closed += 1
+        await super().close()
+
+
+def test_component_telemetry_is_in_vcu_tree_when_component_is_added():
+    async def run():
+        vcu = VCU('leonardo', {'psu': SIMULATED_PSU})
+        added = []
+        component_added = vcu._component_added
+
+        def record(name, comp):
+            added.append((name, comp.telemetry.fqn))
+            component_added(name, comp)
+        vcu._component_added = record
+        for _ in range(2):
+            await vcu.setup('leonardo')
+            await vcu.desetup()
+        assert added == [('psu', 'leonardo.psu'), ('psu', 'leonardo.psu')]
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_failed_components_degrade_while_others_set_up(tmp_path):
+    async def run():
+        vcu = VCU('leonardo', {
+            'psu': {'type': 'hanging_test_psu', 'defaults': {}, 'setup_timeout': 0.2},
+            'hia': {'type': 'micro', 'serial': str(tmp_path / 'no_such_port'), 'baudrate': 115200,
+                    'capture_dir': str(tmp_path)},
+            'vlan': {'type': 'vlan'},
+        })
+        started = time.monotonic()
+        await vcu.setup('leonardo')
+        assert time.monotonic() - started < 1
+        assert list(vcu.components) == ['vlan']
+        assert vcu.degraded['psu'] == 'setup timed out'
+        assert 'hia' in vcu.degraded
+        assert {name: report['status'] for name, report in vcu.setup_report.items()} == \
+            {'psu': 'degraded', 'hia': 'degraded', 'vlan': 'ok'}
+        # A component that didn't set up is still closed, and left out of the VCU's telemetry
+        assert HangingSupply.closed == 1
+        assert not {'psu', 'micro_hia'} & set(vcu.telemetry.telemetry_keepers)
+        await vcu.desetup()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_unknown_component_type_rejected_before_setup():
+    async def run():
+        vcu = VCU('leonardo', {'psu': SIMULATED_PSU, 'toaster': {'type': 'toaster'}})
+        try:
+            await vcu.setup('leonardo')
+        except RuntimeError as e:
+            assert 'toaster' in str(e)
+        else:
+            raise AssertionError('toaster component was set up')
+        assert vcu.components == {}
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def _hil():
+    # HIL with two VCUs, leonardo's subcomponents added before it joins the HIL and donatello's after
+    hil = HIL('HIL')
+    leonardo, donatello = Component('leonardo'), Component('donatello')
+    for name in ('psu', 'hia', 'hib'):
+        leonardo.components[name] = Component(name)
+    hil.components['leonardo'] = leonardo
+    hil.components['donatello'] = donatello
+    donatello.components['psu'] = Component('psu')
+    return hil, leonardo, donatello
+
+
+def test_index_follows_components_added_and_removed():
+    hil, leonardo, donatello = _hil()
+    assert len(hil.index) == 6
+    stack, psu = hil.get_component_cmdstack('donatello.psu')
+    assert stack == [hil, donatello] and psu is donatello.components['psu']
+    assert hil.get_component('leonardo.hia') is leonardo.components['hia']
+    del leonardo.components['hia']
+    assert 'leonardo.hia' not in hil.index
+    # Removing a VCU drops everything under it
+    hil.components.pop('leonardo')
+    assert 'leonardo.psu' not in hil.index and len(hil.index) == 2
+    # Replacing a VCU's subcomponents (like desetup does) re-indexes them
+    donatello.components = {'hia': Component('hia')}
+    assert 'donatello.psu' not in hil.index and 'donatello.hia' in hil.index
+
+
+def test_glob_matches_one_part_at_a_time():
+    hil, _, _ = _hil()
+    assert hil.match_components('*') == ['donatello', 'leonardo']
+    assert hil.match_components('*.psu') == ['donatello.psu', 'leonardo.psu']
+    assert hil.match_components('leonardo.h*') == ['leonardo.hia', 'leonardo.hib']
+    assert hil.match_components('leonardo.psu') == ['leonardo.psu']
+    assert hil.match_components('*.sga') == []
+
+
+@pytest.mark.parametrize('target, message', [
+    ('leonardo.pus', "Unknown target 'leonardo.pus': no component 'pus' in 'leonardo', did you mean 'psu'?"),
+    ('leonardo.sga', "Unknown target 'leonardo.sga': no component 'sga' in 'leonardo' (has hia, hib, psu)"),
+    ('raphael.psu', "Unknown target 'raphael.psu': no component 'raphael' in HIL (has donatello, leonardo)"),
+    ('leonard', "Unknown target 'leonard': no component 'leonard' in HIL, did you mean 'leonardo'?"),
+])
+def test_routing_error_names_what_exists(target, message):
+    hil, _, _ = _hil()
+    with pytest.raises(RoutingError) as error:
+        hil.get_component(target)
+    assert str(error.value) == message
+    # Callers catching either of the old exception types still catch it
+    assert isinstance(error.value, KeyError) and isinstance(error.value, CommandWarning)
+
+
+def test_broadcast_targets_expand_in_order_without_repeats():
+    hil, _, _ = _hil()
+    assert hil.expand_targets('*.psu') == ['donatello.psu', 'leonardo.psu']
+    assert hil.expand_targets(['leonardo.psu', '*.psu', 'raphael']) == ['leonardo.psu', 'donatello.psu', 'raphael']
+    with pytest.raises(RoutingError):
+        hil.expand_targets('*.sga')
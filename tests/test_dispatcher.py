@@ -0,0 +1,117 @@
+import asyncio
+from hilcode.command import Command, CommandStatus, Operation, RoutingError
+from hilcode.components import HIL, Component
+from hilcode.dispatcher import CommandDispatcher
+import vcuhil_service
+
+VCUS = ('leonardo', 'donatello')
+
+
+def _check_vcu(key):
+    if key not in VCUS:
+        raise RoutingError(f"Unknown target '{key}'")
+
+
+def _command(target):
+    cmd = Command(operation=Operation.NO_OP, target=target)
+    cmd.track()
+    return cmd
+
+
+def test_unknown_target_is_rejected_without_a_worker():
+    async def run():
+        executed = []
+
+        async def execute(cmd):
+            executed.append(cmd.target)
+            cmd.finish(CommandStatus.SUCCESS)
+        dispatcher = CommandDispatcher(execute, check_key=_check_vcu)
+        typo = _command('leonardoo.psu')
+        assert not dispatcher.submit(typo)
+        result = await typo.wait(1)
+        assert result.status == CommandStatus.WARNING and 'leonardoo' in result.warning
+        good = _command('leonardo.psu')
+        assert dispatcher.submit(good)
+        assert (await good.wait(1)).status == CommandStatus.SUCCESS
+        assert list(dispatcher.stats()) == ['leonardo'] and dispatcher.rejected == 1
+        assert executed == ['leonardo.psu']
+        await dispatcher.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_commands_to_one_vcu_run_in_order_and_vcus_run_at_once():
+    async def run():
+        running = set()
+        overlap = []
+        order = []
+
+        async def execute(cmd):
+            vcu = cmd.target.split('.')[0]
+            assert vcu not in running, 'two commands ran on one VCU at once'
+            running.add(vcu)
+            overlap.append(len(running))
+            await asyncio.sleep(0.05)
+            order.append(cmd.target)
+            running.discard(vcu)
+            cmd.finish(CommandStatus.SUCCESS)
+        dispatcher = CommandDispatcher(execute, check_key=_check_vcu)
+        commands = [_command(f'{vcu}.{n}') for n in range(3) for vcu in VCUS]
+        for cmd in commands:
+            dispatcher.submit(cmd)
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(cmd.wait(2) for cmd in commands))
+        elapsed = asyncio.get_running_loop().time() - started
+        for vcu in VCUS:
+            assert [target for target in order if target.startswith(vcu)] == [f'{vcu}.{n}' for n in range(3)]
+        # Two VCUs of three commands each take three command times, not six
+        assert max(overlap) == 2 and elapsed < 0.25
+        assert dispatcher.stats()['leonardo']['executed'] == 3
+        await dispatcher.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_failing_command_does_not_stop_worker():
+    async def run():
+        async def execute(cmd):
+            if cmd.target == 'leonardo.bad':
+                raise RuntimeError('broken')
+            cmd.finish(CommandStatus.SUCCESS)
+        dispatcher = CommandDispatcher(execute)
+        bad, good = _command('leonardo.bad'), _command('leonardo.good')
+        dispatcher.submit(bad)
+        dispatcher.submit(good)
+        assert (await good.wait(1)).status == CommandStatus.SUCCESS
+        assert dispatcher.stats()['leonardo']['failed'] == 1
+        await dispatcher.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_broadcast_combines_results_of_its_targets():
+    async def run():
+        hil = HIL('HIL')
+        for vcu_name in VCUS:
+            hil.components[vcu_name] = Component(vcu_name)
+            hil.components[vcu_name].components['psu'] = Component('psu')
+        state = {'hil': hil}
+
+        async def execute(cmd):
+            await vcuhil_service.execute_command(state, cmd)
+        state['dispatcher'] = CommandDispatcher(execute, check_key=hil.index.route)
+        cmd = Command(operation=Operation.PWR_SUPPLY_CMD, target=['*.psu', 'leonardo.sga', 'raphael.psu'],
+                      command_id='b1')
+        cmd.track()
+        await vcuhil_service.dispatch_broadcast(state, cmd)
+        result = await cmd.wait(1)
+        # Unknown targets fail on their own, the others still run
+        assert result.status == CommandStatus.WARNING
+        statuses = {target: target_result['status'] for target, target_result in result.value['targets'].items()}
+        assert statuses == {'donatello.psu': 'success', 'leonardo.psu': 'success', 'leonardo.sga': 'warning',
+                            'raphael.psu': 'warning'}
+        assert result.warning == '2 of 4 targets did not succeed: leonardo.sga, raphael.psu'
+
+        nothing = Command(operation=Operation.PWR_SUPPLY_CMD, target='*.sga')
+        nothing.track()
+        assert vcuhil_service.dispatch_broadcast(state, nothing) is None
+        assert (await nothing.wait(1)).status == CommandStatus.WARNING
+        await state['dispatcher'].close()
+    asyncio.run(asyncio.wait_for(run(), 5))
@@ -0,0 +1,139 @@
+import asyncio
+import http.server
+import threading
+import time
+from influxdb import InfluxDBClient
+from hilcode.influx_writer import InfluxWriter
+from hilcode.telemetry import TelemetryChannel, TelemetryKeeper
+
+
+class InfluxStandIn(object):
+    """
+    HTTP server answering influx /write requests like influx does, keeping the lines written.  'delay' holds each
+    write that many seconds, 'status' is the HTTP status writes get.
+    """
+
+    def __init__(self, delay=0, status=204):
+        self.lines = []
+        self.requests = 0
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+                stand_in.requests += 1
+                time.sleep(delay)
+                if status == 204:
+                    stand_in.lines.extend(body.splitlines())
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def writer(self, **kwargs):
+        return InfluxWriter(client=InfluxDBClient('127.0.0.1', self.port, database='vcuhil'), **kwargs)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _add(writer, count, start=0):
+    for n in range(start, start + count):
+        writer.add(1700000000.0 + n, f'HIL.leonardo.psu.pri_meas_curr', 'unit', n, 'amperes')
+
+
+def test_lines_batched_by_size():
+    async def run():
+        stand_in = InfluxStandIn()
+        writer = stand_in.writer(batch_size=10, batch_age=60)
+        await writer.start()
+        _add(writer, 25)
+        await writer.close()
+        stand_in.close()
+        assert len(stand_in.lines) == 25
+        assert stand_in.lines[0] == 'pri_meas_curr,HIL=HIL,VCU=leonardo,subcomponent=psu value=0.0 1700000000000000000'
+        assert writer.stats()['written_points'] == 25 and writer.stats()['batches'] == 3
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_close_writes_batch_being_collected():
+    async def run():
+        stand_in = InfluxStandIn()
+        writer = stand_in.writer(batch_size=100, batch_age=60)
+        await writer.start()
+        _add(writer, 5)
+        # Writer task has taken the lines and is waiting for more to fill its batch
+        await asyncio.sleep(0.1)
+        assert writer.stats()['queue_depth'] == 0
+        await writer.close()
+        stand_in.close()
+        assert len(stand_in.lines) == 5
+        assert writer.stats()['dropped_points'] == 0
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_close_finishes_write_in_progress():
+    async def run():
+        stand_in = InfluxStandIn(delay=0.3)
+        writer = stand_in.writer(batch_size=5, batch_age=60)
+        await writer.start()
+        _add(writer, 5)
+        await asyncio.sleep(0.1)
+        _add(writer, 3, start=5)
+        await writer.close()
+        stand_in.close()
+        assert len(stand_in.lines) == 8
+        assert writer.stats()['written_points'] == 8
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_close_counts_lines_not_written_in_time():
+    async def run():
+        stand_in = InfluxStandIn(delay=1)
+        writer = stand_in.writer(batch_size=5, batch_age=60)
+        await writer.start()
+        _add(writer, 12)
+        await writer.close(timeout=0.2)
+        assert writer.stats()['written_points'] + writer.stats()['dropped_points'] == 12
+        assert writer.stats()['dropped_points'] > 0
+        stand_in.close()
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_failed_write_is_counted():
+    async def run():
+        stand_in = InfluxStandIn(status=400)
+        writer = stand_in.writer(batch_size=5, batch_age=60)
+        await writer.start()
+        _add(writer, 5)
+        await writer.close()
+        stand_in.close()
+        assert writer.stats()['write_errors'] == 1 and writer.stats()['dropped_points'] == 5
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_untyped_channel_written_as_string():
+    async def run():
+        stand_in = InfluxStandIn()
+        writer = stand_in.writer(batch_size=10, batch_age=60)
+        await writer.start()
+        keeper = TelemetryKeeper('HIL')
+        untyped = TelemetryChannel('status')
+        keeper.add_telemetry_channel(untyped)
+        keeper.add_telemetry_channel(TelemetryChannel('volts', 'unit', 'volts'))
+        untyped.append(1700000000.0, 'say "hi"')
+        keeper.telemetry_channels['volts'].append(1700000000.0, 12.0)
+        keeper.drain_to(writer)
+        await writer.close()
+        stand_in.close()
+        assert sorted(stand_in.lines) == ['status,HIL=HIL value="say \\"hi\\"" 1700000000000000000',
+                                          'volts,HIL=HIL value=12.0 1700000000000000000']
+    asyncio.run(asyncio.wait_for(run(), 10))
@@ -0,0 +1,52 @@
+import asyncio
+import json
+from hilcode.command import CommandStatus, Operation
+import vcuhil_service
+
+
+async def _serve():
+    queue = asyncio.Queue()
+    vcuhil_service.command_queue.set(queue)
+    server = await asyncio.start_server(vcuhil_service.json_server, '127.0.0.1', 0)
+    return server, queue, server.sockets[0].getsockname()[1]
+
+
+def _message(command_id=None, wait=False):
+    message = {'operation': Operation.NO_OP.value, 'options': None, 'target': 'leonardo'}
+    if command_id is not None:
+        message['id'] = command_id
+    if wait:
+        message['wait'] = True
+    return f'{json.dumps(message)}\n'.encode()
+
+
+def test_first_waiting_command_does_not_block_pipeline():
+    async def run():
+        server, queue, port = await _serve()
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(_message(1, wait=True) + _message(2))
+            await writer.drain()
+            first = await queue.get()
+            await queue.get()
+            # The second command is answered while the first is still running
+            assert json.loads(await reader.readline()) == {'id': 2, 'result': ['ACK']}
+            first.finish(CommandStatus.SUCCESS)
+            reply = json.loads(await reader.readline())
+            assert reply['id'] == 1 and reply['result'][0] == 'DONE'
+            writer.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_one_shot_command_gets_service_id():
+    async def run():
+        server, queue, port = await _serve()
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(_message())
+            await writer.drain()
+            assert json.loads(await reader.read()) == ['ACK']
+            cmd = await queue.get()
+            assert cmd.command_id.startswith(vcuhil_service.SERVER_ID_PREFIX)
+            writer.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
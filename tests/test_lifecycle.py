@@ -0,0 +1,89 @@
+import asyncio
+from hilcode.lifecycle import DriverTask
+
+
+async def _poller(driver, polls, period=3600):
+    while True:
+        polls.append(asyncio.get_running_loop().time())
+        if not await driver.sleep(period):
+            return
+
+
+def test_stop_ends_sleeping_task_without_waiting_for_period():
+    async def run():
+        driver = DriverTask('poller')
+        polls = []
+        driver.start(_poller(driver, polls))
+        await asyncio.sleep(0.01)
+        task = driver.task
+        started = asyncio.get_running_loop().time()
+        await driver.stop(timeout=1)
+        assert asyncio.get_running_loop().time() - started < 0.1
+        # Task returned by itself, it wasn't cancelled
+        assert task.done() and not task.cancelled()
+        assert not driver.running()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_stuck_task_cancelled_at_deadline():
+    async def run():
+        driver = DriverTask('connecting')
+        cancelled = asyncio.Event()
+
+        async def stuck():
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        driver.start(stuck())
+        await asyncio.sleep(0)
+        started = asyncio.get_running_loop().time()
+        await driver.stop(timeout=0.1)
+        assert 0.1 <= asyncio.get_running_loop().time() - started < 0.5
+        assert cancelled.is_set()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_zero_timeout_cancels_straight_away():
+    async def run():
+        driver = DriverTask('connecting')
+        driver.start(asyncio.sleep(3600))
+        await asyncio.sleep(0)
+        task = driver.task
+        await driver.stop(timeout=0)
+        assert task.cancelled()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_wake_ends_sleep_early():
+    async def run():
+        driver = DriverTask('poller')
+        polls = []
+        driver.start(_poller(driver, polls))
+        await asyncio.sleep(0.01)
+        driver.wake()
+        await asyncio.sleep(0.01)
+        assert len(polls) == 2 and driver.running()
+        await driver.stop()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_stop_after_task_failed_or_never_started():
+    async def run():
+        driver = DriverTask('poller')
+        await driver.stop()
+
+        async def broken():
+            raise RuntimeError('no supply')
+        driver.start(broken())
+        await asyncio.sleep(0.01)
+        assert not driver.running()
+        await driver.stop()
+        # Restarts after a stop
+        polls = []
+        driver.start(_poller(driver, polls))
+        await asyncio.sleep(0.01)
+        assert polls and driver.running()
+        await driver.stop()
+    asyncio.run(asyncio.wait_for(run(), 5))
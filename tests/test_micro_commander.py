@@ -0,0 +1,181 @@
+import asyncio
+import os
+import pty
+import tty
+from hilcode.micro_commander import VCUSerialDevice, SerialLineProtocol, SerialLine, MAX_LINE_LENGTH
+
+PROMPT = b'user@vcu:~$ '
+OUTPUTS = {
+    b'': b'',
+    b'ls': b'file1\r\nfile2\r\n',
+}
+
+
+class FakeConsole(object):
+    """
+    Shell on the master side of a pty: echoes each line typed and answers with its output and a fresh prompt.
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.path = os.ttyname(self.slave)
+        self.typed = []
+        self._input = b''
+        asyncio.get_running_loop().add_reader(self.master, self._read)
+
+    def _read(self):
+        self._input += os.read(self.master, 4096)
+        while b'\r\n' in self._input:
+            command, self._input = self._input.split(b'\r\n', 1)
+            self.typed.append(command)
+            reply = command + b'\r\n' + OUTPUTS.get(command, b'') + PROMPT
+            if self.delay:
+                asyncio.get_running_loop().call_later(self.delay, os.write, self.master, reply)
+            else:
+                os.write(self.master, reply)
+
+    def write(self, data):
+        os.write(self.master, data)
+
+    def close(self):
+        asyncio.get_running_loop().remove_reader(self.master)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+async def _device(console):
+    device = VCUSerialDevice()
+    await device.connect(console.path)
+    return device
+
+
+async def _settle(device, pending):
+    # Wait until the device has seen a prompt written by the console
+    for _ in range(100):
+        if device.protocol.pending_bytes() == pending:
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_expect_waits_for_output_after_stale_prompt():
+    async def run():
+        console = FakeConsole()
+        device = await _device(console)
+        try:
+            console.write(PROMPT)
+            await _settle(device, len(PROMPT))
+            result = await device.command({'command': 'ls', 'expect': r'\$ $', 'timeout': 2})
+            assert result['matched']
+            assert 'file1' in result['lines'] and 'file2' in result['lines']
+            assert console.typed == [b'', b'ls']
+        finally:
+            await device.close()
+            console.close()
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_expect_ignores_prompt_received_before_write():
+    async def run():
+        console = FakeConsole()
+        device = await _device(console)
+        try:
+            console.write(PROMPT)
+            await _settle(device, len(PROMPT))
+            # Nothing is written, so only the prompt already waiting could match
+            result = await device.expect(None, r'\$ $', timeout=0.3)
+            assert not result['matched']
+        finally:
+            await device.close()
+            console.close()
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_quiet_timer_starts_when_slow_console_answers():
+    async def run():
+        console = FakeConsole(delay=0.3)
+        device = await _device(console)
+        try:
+            result = await device.command({'command': 'ls', 'timeout': 2, 'quiet': 0.1})
+            assert 'file1' in result['lines'] and 'file2' in result['lines']
+        finally:
+            await device.close()
+            console.close()
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_command_with_unset_options_uses_defaults():
+    async def run():
+        console = FakeConsole()
+        device = await _device(console)
+        try:
+            result = await device.command({'command': 'ls', 'expect': r'\$ $', 'timeout': None})
+            assert result['matched']
+            assert 'file2' in result['lines']
+            result = await device.command({'command': 'ls', 'expect': None, 'timeout': None, 'quiet': None})
+            assert 'file1' in result['lines']
+        finally:
+            await device.close()
+            console.close()
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def _protocol():
+    lines, partials = [], []
+    protocol = SerialLineProtocol(lines, asyncio.Event(), partial_listeners=[partials.append])
+    return protocol, lines, partials
+
+
+def test_protocol_splits_lines_across_chunks():
+    async def run():
+        protocol, lines, partials = _protocol()
+        protocol.data_received(b'first\r\nsec')
+        protocol.data_received(b'ond\r\nthird\r\n')
+        assert [line.data for line in lines] == [b'first', b'second', b'third']
+        # Lines that arrive in the same chunk share a timestamp
+        assert lines[1].time == lines[2].time
+        assert partials == [b'sec']
+        assert protocol.line_ready.is_set()
+    asyncio.run(run())
+
+
+def test_protocol_reports_prompt_and_flushes_it_on_close():
+    async def run():
+        protocol, lines, partials = _protocol()
+        protocol.data_received(b'login: ')
+        assert lines == [] and partials == [b'login: ']
+        assert protocol.pending_bytes() == len(b'login: ')
+        protocol.connection_lost(None)
+        assert [line.data for line in lines] == [b'login: ']
+        assert protocol.closed.is_set()
+    asyncio.run(run())
+
+
+def test_protocol_cuts_lines_without_endings():
+    async def run():
+        protocol, lines, _ = _protocol()
+        protocol.data_received(b'x' * (MAX_LINE_LENGTH + 10))
+        assert [len(line.data) for line in lines] == [MAX_LINE_LENGTH + 10]
+        assert protocol.pending_bytes() == 0
+    asyncio.run(run())
+
+
+def test_device_reads_lines_from_pty():
+    async def run():
+        console = FakeConsole()
+        device = await _device(console)
+        try:
+            assert not await device.wait_line(timeout=0.05)
+            console.write(b'[    0.1] booting\r\n[    0.2] done\r\n')
+            assert await device.wait_line(timeout=2)
+            received = []
+            while len(received) < 2 and await device.wait_line(timeout=2):
+                received.append(device.get_line_nowait())
+            assert [line.data for line in received] == [b'[    0.1] booting', b'[    0.2] done']
+            assert all(isinstance(line, SerialLine) for line in received)
+        finally:
+            await device.close()
+            console.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
@@ -0,0 +1,62 @@
+import asyncio
+from hilcode.scheduler import Scheduler
+
+
+def test_slow_job_overruns_without_delaying_others():
+    async def run():
+        scheduler = Scheduler()
+        fast_runs = []
+
+        async def slow():
+            await asyncio.sleep(0.15)
+
+        async def fast():
+            fast_runs.append(asyncio.get_running_loop().time())
+        slow_job = scheduler.add_job('slow', 0.05, slow)
+        fast_job = scheduler.add_job('fast', 0.02, fast)
+        await scheduler.start()
+        await asyncio.sleep(0.5)
+        await scheduler.close()
+        # Every slow run goes past its next start, missed starts are skipped rather than run back to back
+        assert slow_job.runs >= 2 and slow_job.overruns == slow_job.runs
+        assert slow_job.runs <= 4
+        assert fast_job.overruns == 0 and fast_job.runs >= 15
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_job_timeouts_and_errors_are_counted():
+    async def run():
+        scheduler = Scheduler()
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        async def fail():
+            raise RuntimeError('broken')
+        hung = scheduler.add_job('hang', 0.01, hang, timeout=0.05)
+        failing = scheduler.add_job('fail', 0.05, fail)
+        await scheduler.start()
+        await asyncio.sleep(0.3)
+        await scheduler.close()
+        assert hung.timeouts >= 2 and hung.timeouts == hung.runs
+        assert failing.errors >= 2 and failing.errors == failing.runs
+        assert scheduler.stats()['fail']['errors'] == failing.errors
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_job_added_while_running_starts_and_removed_job_stops():
+    async def run():
+        scheduler = Scheduler()
+        await scheduler.start()
+        runs = []
+
+        async def job():
+            runs.append(1)
+        scheduler.add_job('late', 0.01, job)
+        await asyncio.sleep(0.1)
+        await scheduler.remove_job('late')
+        count = len(runs)
+        await asyncio.sleep(0.05)
+        assert count > 0 and len(runs) == count and 'late' not in scheduler.jobs
+        await scheduler.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
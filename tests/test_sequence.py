@@ -0,0 +1,140 @@
+import asyncio
+import pytest
+import hilcode.sequence as sequence
+from hilcode.command import CommandStatus, CommandWarning, Operation
+from hilcode.components import HIL, VCU
+from hilcode.sequence import Sequence
+
+
+class Runner(object):
+    """
+    Stand-in for the service's command queue: finishes each command with the status its target is given (SUCCESS
+    by default), or leaves it running if its status is None.
+    """
+
+    def __init__(self, statuses=None):
+        self.statuses = statuses or {}
+        self.submitted = []
+
+    def submit(self, cmd):
+        self.submitted.append((cmd.operation, cmd.target))
+        status = self.statuses.get(cmd.target, CommandStatus.SUCCESS)
+        if status is not None:
+            cmd.finish(status, warning=None if status == CommandStatus.SUCCESS else f'{cmd.target} failed')
+
+
+def _run(options, runner=None, hil=None, target='leonardo'):
+    runner = runner or Runner()
+    events = []
+
+    async def run():
+        return await Sequence.from_options(options, target=target).run(runner.submit, hil, progress=events.append)
+    return asyncio.run(asyncio.wait_for(run(), 5)), runner, events
+
+
+def _labels(result):
+    return [step['label'] for step in result.value['steps']]
+
+
+def test_steps_run_in_order_with_progress():
+    result, runner, events = _run({'steps': [
+        {'command': {'operation': 'ENABLE'}},
+        {'sleep': 0.01},
+        {'command': {'operation': 'PWR_SUPPLY_CMD', 'target': 'leonardo.psu', 'options': {'command': 'x'}}},
+    ]})
+    assert result.status == CommandStatus.SUCCESS and result.warning is None
+    assert runner.submitted == [(Operation.ENABLE, 'leonardo'), (Operation.PWR_SUPPLY_CMD, 'leonardo.psu')]
+    assert [(event['step'], event['event']) for event in events] == [
+        (0, 'started'), (0, 'finished'), (1, 'started'), (1, 'finished'), (2, 'started'), (2, 'finished')]
+    assert [step['kind'] for step in result.value['steps']] == ['command', 'sleep', 'command']
+
+
+def test_failure_branches_to_label():
+    result, runner, _ = _run({'steps': [
+        {'label': 'reset', 'command': {'operation': 'RESTART', 'target': 'leonardo.hia'},
+         'on_failure': 'power_cycle'},
+        {'label': 'done', 'goto': 'finish'},
+        {'label': 'power_cycle', 'command': {'operation': 'POWER_OFF'}},
+        {'label': 'finish', 'command': {'operation': 'ENABLE'}, 'on_success': 'end'},
+        {'label': 'never', 'command': {'operation': 'NO_OP'}},
+    ]}, Runner({'leonardo.hia': CommandStatus.WARNING}))
+    assert result.status == CommandStatus.SUCCESS
+    assert _labels(result) == ['reset', 'power_cycle', 'finish']
+    assert result.value['steps'][0]['status'] == 'warning'
+
+
+def test_failure_aborts_by_default():
+    result, runner, _ = _run({'steps': [
+        {'label': 'reset', 'command': {'operation': 'RESTART', 'target': 'leonardo.hia'}},
+        {'command': {'operation': 'ENABLE'}},
+    ]}, Runner({'leonardo.hia': CommandStatus.ERROR}))
+    assert result.status == CommandStatus.ERROR
+    assert result.warning == 'Step 0 (reset) failed: leonardo.hia failed'
+    assert len(runner.submitted) == 1
+
+
+def test_step_timeout_fails_step():
+    result, _, _ = _run({'steps': [
+        {'command': {'operation': 'ENABLE'}, 'timeout': 0.05},
+        {'command': {'operation': 'NO_OP'}},
+    ]}, Runner({'leonardo': None}))
+    assert result.status == CommandStatus.TIMEOUT
+    assert len(result.value['steps']) == 1 and result.value['steps'][0]['seconds'] < 1
+
+
+def test_sequence_timeout_cuts_sleep_short_and_fails():
+    result, _, _ = _run({'steps': [{'sleep': 5}], 'timeout': 0.05})
+    assert result.status == CommandStatus.TIMEOUT
+    assert result.warning.startswith('Step 0 failed: Sleep of 5.0s cut short')
+    assert result.value['elapsed'] < 1
+
+
+def test_sequence_timeout_stops_before_next_step():
+    result, runner, _ = _run({'steps': [
+        {'sleep': 5, 'on_failure': 'next'},
+        {'command': {'operation': 'ENABLE'}},
+    ], 'timeout': 0.05})
+    assert result.status == CommandStatus.TIMEOUT and 'longer than 0.05s' in result.warning
+    assert runner.submitted == []
+
+
+def test_endless_loop_stopped(monkeypatch):
+    monkeypatch.setattr(sequence, 'MAX_SEQUENCE_STEPS', 6)
+    result, runner, _ = _run({'steps': [
+        {'label': 'poke', 'command': {'operation': 'NO_OP'}},
+        {'goto': 'poke'},
+    ]})
+    assert result.status == CommandStatus.ERROR and result.warning == 'Sequence stopped after 6 steps'
+    assert len(runner.submitted) == 3
+
+
+def test_wait_state_woken_by_state_change():
+    async def run():
+        hil = HIL('HIL')
+        vcu = hil.components['leonardo'] = VCU('leonardo', {})
+        asyncio.get_running_loop().call_later(0.05, vcu.power_on)
+        steps = Sequence.from_options({'steps': [
+            {'wait_state': ['booting', 'idle']},
+            {'wait_state': 'idle', 'timeout': 0.05, 'on_failure': 'end'},
+        ]}, target='leonardo')
+        return await steps.run(Runner().submit, hil)
+    result = asyncio.run(asyncio.wait_for(run(), 5))
+    assert result.status == CommandStatus.SUCCESS
+    first, second = result.value['steps']
+    assert (first['status'], first['value']) == ('success', 'booting')
+    assert second['status'] == 'timeout' and second['warning'] == 'leonardo not idle after 0.1s'
+
+
+@pytest.mark.parametrize('options, message', [
+    ({'steps': []}, 'needs a list of steps'),
+    ({'steps': [{'sleep': 1, 'goto': 'a'}]}, 'exactly one of'),
+    ({'steps': [{'goto': 'nowhere'}]}, 'unknown label nowhere'),
+    ({'steps': [{'label': 'a', 'sleep': 1}, {'label': 'a', 'sleep': 1}]}, 'used twice'),
+    ({'steps': [{'command': {'operation': 'SEQUENCE'}}]}, 'can not be nested'),
+    ({'steps': [{'command': {'operation': 'REBOOT'}}]}, 'REBOOT not recognized'),
+    ({'steps': [{'command': {'operation': 'WAIT_ON_VAR', 'options': {}}}]}, 'needs a channel'),
+    ({'steps': [{'sleep': 'soon'}]}, 'sleep is not a number'),
+])
+def test_bad_sequences_rejected(options, message):
+    with pytest.raises(CommandWarning, match=message):
+        Sequence.from_options(options, target='leonardo')
@@ -0,0 +1,73 @@
+import pytest
+from hilcode.micro_commander import SerialLine
+from hilcode.serial_buffer import _SPILL_HEADER, DROP_NEWEST, DROP_OLDEST, LINE_OVERHEAD, SPILL, SerialLineBuffer
+
+# Room for two ten byte lines
+TWO_LINES = 2 * (10 + LINE_OVERHEAD)
+
+
+def _line(n):
+    return SerialLine(float(n), b'line %05d' % n)
+
+
+def _fill(buffer, count):
+    for n in range(count):
+        buffer.append(_line(n))
+
+
+def _drain(buffer):
+    lines = []
+    while buffer:
+        lines.append(buffer.popleft())
+    return lines
+
+
+def test_drop_oldest_keeps_newest_lines():
+    buffer = SerialLineBuffer(max_bytes=TWO_LINES, policy=DROP_OLDEST)
+    _fill(buffer, 5)
+    assert [line.time for line in _drain(buffer)] == [3.0, 4.0]
+    assert (buffer.dropped_lines, buffer.dropped_bytes) == (3, 30)
+    assert buffer.bytes == 0
+
+
+def test_drop_newest_keeps_oldest_lines():
+    buffer = SerialLineBuffer(max_bytes=TWO_LINES, policy=DROP_NEWEST)
+    _fill(buffer, 5)
+    assert [line.time for line in _drain(buffer)] == [0.0, 1.0]
+    assert buffer.stats()['dropped_lines'] == 3
+
+
+def test_spill_keeps_every_line_in_order():
+    buffer = SerialLineBuffer(max_bytes=TWO_LINES, policy=SPILL, line_class=SerialLine)
+    _fill(buffer, 7)
+    stats = buffer.stats()
+    assert (len(buffer), stats['spilled_lines'], stats['dropped_lines']) == (7, 5, 0)
+    assert stats['bytes'] == TWO_LINES and stats['spilled_bytes'] > 0
+    lines = _drain(buffer)
+    assert [line.time for line in lines] == [float(n) for n in range(7)]
+    assert lines[6].data == b'line 00006'
+    assert buffer.stats()['spilled_bytes'] == 0
+    buffer.close()
+
+
+def test_spill_keeps_order_when_appending_while_draining():
+    buffer = SerialLineBuffer(max_bytes=TWO_LINES, policy=SPILL, line_class=SerialLine)
+    _fill(buffer, 4)
+    first = buffer.popleft()
+    # Lines are still on disk, so a new line goes behind them even though memory has room
+    buffer.append(_line(4))
+    assert [first.time] + [line.time for line in _drain(buffer)] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    buffer.close()
+
+
+def test_spill_drops_past_disk_budget():
+    buffer = SerialLineBuffer(max_bytes=TWO_LINES, policy=SPILL, spill_bytes=2 * (_SPILL_HEADER.size + 10), line_class=SerialLine)
+    _fill(buffer, 6)
+    # Two lines in memory, two on disk, the rest dropped
+    assert (len(buffer), buffer.spilled_lines, buffer.dropped_lines) == (4, 2, 2)
+    buffer.close()
+
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        SerialLineBuffer(policy='drop_everything')
@@ -0,0 +1,60 @@
+import asyncio
+import os
+from hilcode.micro_commander import SerialLine
+from hilcode.serial_capture import SerialCapture
+
+
+async def _capture(capture, blocks):
+    # One block per list of timestamps, each written to its own segment
+    for times in blocks:
+        for timestamp in times:
+            capture.write(SerialLine(timestamp, f'line at {timestamp:g}'))
+        await capture.flush(force=True)
+    await capture.close()
+
+
+def _times(lines):
+    return [timestamp for timestamp, _ in lines]
+
+
+def test_read_range_spans_rotated_segments(tmp_path):
+    capture = SerialCapture(str(tmp_path), 'hia', compression='gzip', segment_bytes=1)
+    asyncio.run(_capture(capture, [[1.0, 2.0, 3.0], [4.0, 5.0], [6.0, 7.0]]))
+    assert len(capture.segments()) == 3
+    lines = capture.read_range(2.5, 6.0)
+    assert _times(lines) == [3.0, 4.0, 5.0, 6.0]
+    assert lines[0][1] == b'line at 3'
+    assert _times(capture.read_range(0, 100)) == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]
+    assert capture.read_range(8.0, 9.0) == []
+
+
+def test_blocks_share_segment_until_it_fills(tmp_path):
+    capture = SerialCapture(str(tmp_path), 'hia', compression='gzip')
+    asyncio.run(_capture(capture, [[1.0], [2.0], [3.0]]))
+    [segment] = capture.segments()
+    with open(f'{segment}.idx') as index:
+        assert len(index.readlines()) == 3
+    assert _times(capture.read_range(2.0, 2.0)) == [2.0]
+
+
+def test_old_segments_removed(tmp_path):
+    capture = SerialCapture(str(tmp_path), 'hia', compression='gzip', segment_bytes=1, keep_segments=2)
+    asyncio.run(_capture(capture, [[1.0], [2.0], [3.0]]))
+    assert len(capture.segments()) == 2
+    assert len(os.listdir(tmp_path)) == 4
+    assert _times(capture.read_range(0, 100)) == [2.0, 3.0]
+
+
+def test_other_ports_segments_ignored(tmp_path):
+    hia = SerialCapture(str(tmp_path), 'hia', compression='gzip')
+    hia_b = SerialCapture(str(tmp_path), 'hia_b', compression='gzip')
+    asyncio.run(_capture(hia, [[1.0]]))
+    asyncio.run(_capture(hia_b, [[2.0]]))
+    assert _times(hia.read_range(0, 100)) == [1.0]
+
+
+def test_newlines_in_line_escaped(tmp_path):
+    capture = SerialCapture(str(tmp_path), 'hia', compression='gzip')
+    capture.write(SerialLine(1.0, b'two\nlines'))
+    asyncio.run(capture.close())
+    assert capture.read_range(0, 100) == [(1.0, b'two\\nlines')]
@@ -0,0 +1,64 @@
+import asyncio
+from hilcode.micro_commander import SerialLine, VCUSerialDevice
+from hilcode.serial_matcher import SerialMatcher, DEFAULT_PATTERNS
+from hilcode.simulator import SimulatedConsole, BOOT_LOG
+
+
+def _matcher():
+    matcher = SerialMatcher(DEFAULT_PATTERNS)
+    events = []
+    for name in DEFAULT_PATTERNS:
+        matcher.on_match(name, lambda port, name, line: events.append((port, name)))
+    return matcher, events
+
+
+def test_unterminated_login_prompt_is_booted():
+    matcher, events = _matcher()
+    assert matcher.feed_partial('sga_serial', SerialLine(0.0, b'tegra-ubuntu login: ')) == 'booted'
+    assert events == [('sga_serial', 'booted')]
+
+
+def test_only_prompt_patterns_match_unterminated_input():
+    matcher, events = _matcher()
+    assert matcher.feed_partial('sga_serial', SerialLine(0.0, b'U-Boot 2020.04')) is None
+    assert matcher.feed('sga_serial', SerialLine(0.0, b'U-Boot 2020.04')) == 'reboot'
+    assert events == [('sga_serial', 'reboot')]
+
+
+def test_prompt_pattern_added_after_other_patterns():
+    matcher = SerialMatcher({'reboot': DEFAULT_PATTERNS['reboot'], 'booted': DEFAULT_PATTERNS['booted']},
+                            prompts=('booted',))
+    assert matcher.feed_partial('sga_serial', SerialLine(0.0, b'tegra-ubuntu login: ')) == 'booted'
+    assert matcher.feed('sga_serial', SerialLine(0.0, b'tegra-ubuntu login:')) == 'booted'
+    assert matcher.feed('sga_serial', SerialLine(0.0, b'Kernel panic - not syncing')) == 'reboot'
+
+
+def test_leftmost_match_in_line_wins():
+    matcher = SerialMatcher({'booted': rb'login:', 'reboot': rb'U-Boot'}, prompts=())
+    assert matcher.feed('sga_serial', SerialLine(0.0, b'U-Boot printed login:')) == 'reboot'
+
+
+def test_simulated_console_boot_detected_from_prompt_without_newline():
+    async def run():
+        console = SimulatedConsole('sga_serial', boot_time=0.1)
+        console.open()
+        device = VCUSerialDevice()
+        matcher, events = _matcher()
+        device.add_line_listener(lambda line: matcher.feed('sga_serial', line))
+        device.add_partial_listener(lambda data: matcher.feed_partial('sga_serial', SerialLine(0.0, data)))
+        await device.connect(console.path)
+        try:
+            console.power_on()
+            console.tick(1.0, 1.0)
+            for _ in range(100):
+                if ('sga_serial', 'booted') in events:
+                    break
+                await asyncio.sleep(0.01)
+            assert ('sga_serial', 'booted') in events
+            # Every boot log line arrived complete, the prompt is still waiting for a newline
+            assert len(device.lines) == len(BOOT_LOG)
+            assert device.protocol.pending_bytes() > 0
+        finally:
+            await device.close()
+            console.close()
+    asyncio.run(asyncio.wait_for(run(), 10))
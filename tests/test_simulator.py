@@ -0,0 +1,78 @@
+import asyncio
+import os
+import select
+import asyncssh
+import pytest
+from hilcode.simulator import BOOT_LOG, LOGIN_PROMPT, PASSWORD, PROMPT, USERNAME, SimulatedConsole, SimulatedVCU
+
+
+def _read(console):
+    # What the service would read from the console's port
+    data = b''
+    while select.select([console._slave], [], [], 0.05)[0]:
+        data += os.read(console._slave, 4096)
+    return data
+
+
+def test_console_boots_then_logs_at_line_rate():
+    async def run():
+        console = SimulatedConsole('leonardo_hia', line_rate=10.0, boot_time=1.0)
+        console.open()
+        console.tick(0.5, 0.5)
+        assert _read(console) == b''
+        console.power_on()
+        console.tick(0.5, 0.5)
+        first_half = _read(console)
+        assert first_half.startswith(BOOT_LOG[0] + b'\r\n') and not console.booted()
+        console.tick(1.0, 0.5)
+        # Whole boot log by boot_time, login prompt last with no line ending
+        assert first_half + _read(console) == b''.join(line + b'\r\n' for line in BOOT_LOG) + LOGIN_PROMPT
+        assert console.booted() and console.lines_written == len(BOOT_LOG)
+        console.tick(1.5, 0.5)
+        heartbeats = _read(console).split(b'\r\n')[:-1]
+        assert len(heartbeats) == 5 and b'leonardo_hia: heartbeat' in heartbeats[0]
+        console.power_off()
+        console.tick(2.0, 0.5)
+        assert _read(console) == b''
+        console.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_console_answers_typed_line_with_prompt():
+    async def run():
+        console = SimulatedConsole('leonardo_hia')
+        console.open()
+        console.power_on()
+        os.write(console._slave, b'ls\r')
+        await asyncio.sleep(0.05)
+        assert _read(console) == b'ls\r\n' + PROMPT
+        console.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_vcu_boots_when_both_outputs_on_and_ssh_follows():
+    async def run():
+        vcu = SimulatedVCU('leonardo', asyncssh.generate_private_key('ssh-ed25519'), boot_time=0.2)
+        await vcu.start()
+        try:
+            login = dict(host='127.0.0.1', port=vcu.sga.port, username=USERNAME, password=PASSWORD,
+                         known_hosts=None)
+            with pytest.raises(asyncssh.PermissionDenied):
+                await asyncssh.connect(**login)
+            vcu.supply.channels[1]['OP'] = 1
+            await asyncio.sleep(0.3)
+            assert vcu.boots == 0
+            vcu.supply.channels[2]['OP'] = 1
+            while not vcu.sga.up:
+                await asyncio.sleep(0.05)
+            assert vcu.boots == 1 and vcu.hpa.up
+            assert all(console.booted() for console in vcu.consoles.values())
+            async with asyncssh.connect(**login) as conn:
+                assert (await conn.run('echo "Test"')).stdout == 'Test\n'
+                assert (await conn.run('reboot')).exit_status == 127
+            vcu.supply.channels[1]['OP'] = 0
+            await asyncio.sleep(0.3)
+            assert not vcu.sga.up and not vcu.hpa.up
+        finally:
+            await vcu.close()
+    asyncio.run(asyncio.wait_for(run(), 10))
@@ -0,0 +1,84 @@
+import asyncio
+import asyncssh
+import pytest
+from hilcode.simulator import SimulatedSSHHost, HOST
+from hilcode.ssh_session import VCUSSHSession
+
+
+async def _hosts():
+    host_key = asyncssh.generate_private_key('ssh-ed25519')
+    sga, hpa = SimulatedSSHHost(host_key), SimulatedSSHHost(host_key)
+    await sga.start()
+    await hpa.start()
+    sga.forwards.add((HOST, hpa.port))
+    sga.set_up(True)
+    hpa.set_up(True)
+    return sga, hpa
+
+
+async def _closed(conn):
+    while not conn.is_closed():
+        await asyncio.sleep(0.01)
+
+
+def test_connections_are_reused():
+    async def run():
+        sga, hpa = await _hosts()
+        session = VCUSSHSession(HOST, sga.port)
+        try:
+            sga_conn = await session.sga()
+            assert await session.sga() is sga_conn
+            hpa_conn = await session.hpa(HOST, hpa.port)
+            for _ in range(3):
+                assert await session.hpa(HOST, hpa.port) is hpa_conn
+                result = await hpa_conn.run('echo "Test"')
+                assert result.stdout == 'Test\n'
+            # One SGA handshake, one HPA handshake tunneled through it, however often they are used
+            assert session.handshakes == 2
+            assert len(sga.connections) == 1 and len(hpa.connections) == 1
+            assert hpa.commands_run == 3
+        finally:
+            await session.close()
+            await sga.close()
+            await hpa.close()
+    asyncio.run(asyncio.wait_for(run(), 20))
+
+
+def test_dropped_sga_reconnects_and_reopens_tunnel():
+    async def run():
+        sga, hpa = await _hosts()
+        session = VCUSSHSession(HOST, sga.port)
+        try:
+            sga_conn = await session.sga()
+            await session.hpa(HOST, hpa.port)
+            sga.set_up(False)
+            await _closed(sga_conn)
+            sga.set_up(True)
+            assert await session.sga() is not sga_conn
+            hpa_conn = await session.hpa(HOST, hpa.port)
+            assert (await hpa_conn.run('uname -a')).exit_status == 0
+            assert session.handshakes == 4
+        finally:
+            await session.close()
+            await sga.close()
+            await hpa.close()
+    asyncio.run(asyncio.wait_for(run(), 20))
+
+
+def test_failed_connect_backs_off():
+    async def run():
+        sga, hpa = await _hosts()
+        sga.set_up(False)
+        session = VCUSSHSession(HOST, sga.port)
+        try:
+            with pytest.raises(asyncssh.Error):
+                await session.sga()
+            # Retried too soon, refused without another handshake
+            with pytest.raises(ConnectionRefusedError):
+                await session.sga()
+            assert session.handshakes == 1
+        finally:
+            await session.close()
+            await sga.close()
+            await hpa.close()
+    asyncio.run(asyncio.wait_for(run(), 20))
@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+from hilcode.command import Operation
+from hilcode.components import PowerSupply
+from hilcode.supply import SUPPLY_DRIVERS, create_supply, is_supply, register_supply
+from hilcode.supply_commander import SorensenXPF6020DP
+from hilcode.supply_simulator import SimulatedSupply, SupplyModel
+
+DEFAULTS = {'voltage_ch1': 12.0, 'voltage_ch2': 8.0, 'current_ch1': 5.0, 'current_ch2': 1.0,
+            'output_ch1': 1, 'output_ch2': 1}
+
+
+def test_registry_creates_driver_for_config_type():
+    assert is_supply('simulated_psu') and is_supply('sorensen_psu') and not is_supply('micro')
+    supply = create_supply({'type': 'simulated_psu', 'latency': 0.5, 'load_resistance': 2.0})
+    assert isinstance(supply, SimulatedSupply)
+    assert (supply.latency, supply.model.load_resistance) == (0.5, 2.0)
+    assert isinstance(create_supply({'type': 'sorensen_psu'}), SorensenXPF6020DP)
+
+
+def test_unknown_supply_type_lists_registered_types():
+    with pytest.raises(RuntimeError, match="registered types are .*'simulated_psu'"):
+        create_supply({'type': 'agilent_psu'})
+
+
+def test_supply_type_registered_once():
+    with pytest.raises(RuntimeError, match='already registered'):
+        register_supply('simulated_psu')(type('OtherSupply', (SimulatedSupply,), {}))
+    assert SUPPLY_DRIVERS['simulated_psu'] is SimulatedSupply
+
+
+def test_model_is_constant_voltage_then_constant_current():
+    model = SupplyModel(load_resistance=4.0)
+    assert model.measured(1) == (0.0, 0.0)
+    model.channels[1].update({'V': 12.0, 'I': 5.0, 'OP': 1})
+    assert model.measured(1) == (12.0, 3.0)
+    # 12 V into 4 ohms would draw 3 A, a 1 A limit holds it to 4 V
+    model.channels[1]['I'] = 1.0
+    assert model.measured(1) == (4.0, 1.0)
+    model.reset()
+    assert model.measured(1) == (0.0, 0.0)
+
+
+def test_simulated_setpoints_apply_when_flushed():
+    async def run():
+        supply = SimulatedSupply()
+        await supply.open({})
+        await supply.set_voltage(2, 8.0)
+        assert supply.model.channels[2]['V'] == 0.0
+        await supply.flush()
+        assert supply.model.channels[2]['V'] == 8.0
+        await supply.set_current(2, 1.0)
+        await supply.set_output(2, True)
+        reading = (await supply.reading()).channels[2]
+        assert (reading.meas_voltage, reading.meas_current, reading.output_enabled) == (4.0, 1.0, True)
+        await supply.close()
+        with pytest.raises(ConnectionError):
+            await supply.reading()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_power_supply_telemetry_from_simulated_reading():
+    async def run():
+        psu = PowerSupply('psu', create_supply({'type': 'simulated_psu'}), defaults=DEFAULTS)
+        await psu.client.open({})
+        await psu.setup('psu')
+        await psu.command(Operation.PWR_SUPPLY_CMD, {'command': 'set_defaults'})
+        await psu.gather_telemetry()
+        latest = {channel.name: channel.last_value for channel in psu.telemetry.channels()}
+        assert latest['pri_meas_volt'] == 12.0 and latest['pri_meas_curr'] == 3.0
+        assert latest['red_meas_volt'] == 4.0 and latest['red_set_volt'] == 8.0
+        assert latest['pri_output_enable'] == 1 and latest['idn'].startswith('THURLBY THANDAR')
+        await psu.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
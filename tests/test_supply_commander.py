@@ -0,0 +1,182 @@
+import asyncio
+import socket
+import pytest
+from hilcode.components import VCU
+from hilcode.supply_commander import SorensenXPF6020DP, coalesce_commands
+from hilcode.supply_simulator import SimulatedSorensenServer
+
+
+class RecordingSorensenServer(SimulatedSorensenServer):
+    """
+    Simulated supply that keeps every command it executes, in order.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.commands = []
+
+    def respond(self, command):
+        self.commands.append(command.strip())
+        return super().respond(command)
+
+
+async def _connected(server):
+    await server.start()
+    psu = SorensenXPF6020DP()
+    await psu.open({'host': server.host, 'port': server.port})
+    await psu.flush()
+    return psu
+
+
+async def _fresh_reading(psu):
+    # The communications loop reads ahead, the first reading can be from before the last flush
+    await psu.reading()
+    return await psu.reading()
+
+
+def test_coalesce_keeps_output_off_then_on():
+    assert coalesce_commands(['OP1 0', 'OP1 1']) == ['OP1 0;OP1 1']
+
+
+def test_coalesce_drops_superseded_setpoints_but_not_across_outputs():
+    assert coalesce_commands(['V1 5', 'V1 6', 'OP1 1', 'V1 10', 'I1 2']) == ['V1 6;OP1 1;V1 10;I1 2']
+
+
+def test_coalesce_never_moves_commands_across_other_commands():
+    assert coalesce_commands(['V1 1', '*RST', 'V1 2']) == ['V1 1', '*RST', 'V1 2']
+
+
+def test_power_cycle_reaches_supply_in_order():
+    async def run():
+        server = RecordingSorensenServer()
+        psu = await _connected(server)
+        try:
+            await psu.set_output(1, False)
+            await psu.set_output(1, True)
+            await psu.flush()
+            await _fresh_reading(psu)
+            outputs = [command for command in server.commands if command.startswith('OP1 ')]
+            assert outputs == ['OP1 0', 'OP1 1']
+            assert server.channels[1]['OP'] == 1
+        finally:
+            await psu.close()
+            await server.close()
+    asyncio.run(run())
+
+
+def test_pipelined_readback_matches_replies_to_queries():
+    async def run():
+        server = SimulatedSorensenServer()
+        psu = await _connected(server)
+        try:
+            await psu.set_voltage(1, 12.5)
+            await psu.set_current(1, 4.0)
+            await psu.set_current(2, 3.0)
+            await psu.set_output(1, True)
+            await psu.flush()
+            reading = await _fresh_reading(psu)
+            assert reading.idn.startswith('THURLBY THANDAR')
+            assert reading.channels[1].set_voltage == 12.5
+            assert reading.channels[1].output_enabled
+            assert reading.channels[2].set_current == 3.0
+            assert not reading.channels[2].output_enabled
+            assert reading.channels[1].meas_voltage == pytest.approx(12.5, abs=0.01)
+        finally:
+            await psu.close()
+            await server.close()
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('pipelined', [True, False])
+def test_readback_modes_agree_and_idn_is_queried_once(pipelined):
+    async def run():
+        server = RecordingSorensenServer()
+        await server.start()
+        psu = SorensenXPF6020DP(pipelined=pipelined)
+        await psu.open({'host': server.host, 'port': server.port})
+        try:
+            await psu.set_voltage(2, 7.5)
+            await psu.flush()
+            for _ in range(3):
+                reading = await _fresh_reading(psu)
+            assert reading.channels[2].set_voltage == 7.5
+            assert reading.idn.startswith('THURLBY THANDAR')
+            # Identity is cached at connect, not polled every cycle
+            assert server.commands.count('*IDN?') == 1
+            assert server.commands.count('V2?') >= 6
+        finally:
+            await psu.close()
+            await server.close()
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_setpoints_queued_together_are_sent_in_one_line():
+    async def run():
+        server = SimulatedSorensenServer()
+        psu = await _connected(server)
+        try:
+            lines = psu.lines_sent
+            for voltage in (1.0, 2.0, 3.0):
+                await psu.set_voltage(1, voltage)
+            await psu.set_current(1, 1.0)
+            await psu.flush()
+            assert psu.lines_sent == lines + 1
+            assert (await _fresh_reading(psu)).channels[1].set_voltage == 3.0
+        finally:
+            await psu.close()
+            await server.close()
+    asyncio.run(run())
+
+
+def test_commands_fail_once_communications_stop():
+    async def run():
+        server = SimulatedSorensenServer()
+        psu = await _connected(server)
+        await psu.close()
+        await server.close()
+        with pytest.raises(ConnectionError):
+            await psu.set_voltage(1, 5.0)
+        with pytest.raises(ConnectionError):
+            await psu.reading()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def _closed_port():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+
+def test_open_fails_when_supply_unreachable():
+    async def run():
+        psu = SorensenXPF6020DP()
+        with pytest.raises(ConnectionError):
+            await psu.open({'host': '127.0.0.1', 'port': _closed_port()})
+        assert not psu._comm.running()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_open_fails_when_supply_does_not_answer():
+    async def run():
+        server = await asyncio.start_server(lambda reader, writer: None, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        psu = SorensenXPF6020DP()
+        try:
+            with pytest.raises(ConnectionError):
+                await psu.open({'host': '127.0.0.1', 'port': port, 'connect_timeout': 0.2})
+        finally:
+            server.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_unreachable_supply_degrades_vcu_setup():
+    async def run():
+        vcu = VCU('vcu', {'psu': {'type': 'sorensen_psu', 'host': '127.0.0.1', 'port': _closed_port(),
+                                  'defaults': {}}})
+        await vcu.setup('vcu')
+        assert 'psu' in vcu.degraded
+        assert 'psu' not in vcu.components
+        assert vcu.setup_report['psu']['status'] == 'degraded'
+    asyncio.run(asyncio.wait_for(run(), 10))
@@ -0,0 +1,144 @@
+from array import array
+from hilcode.telemetry import (BooleanTelemetryPoint, StringTelemetryPoint, TelemetryChannel, TelemetryKeeper,
+                               UnitTelemetryPoint)
+
+
+def test_numeric_channel_stores_typed_columns():
+    channel = TelemetryChannel('pri_meas_volt', type='unit', unit='V')
+    channel.append(1.0, 12.5)
+    channel.append(2.0, 12.25)
+    assert channel.timestamps == array('d', [1.0, 2.0])
+    assert channel.values == array('d', [12.5, 12.25])
+    assert len(channel) == 2
+
+
+def test_drain_hands_over_columns_and_keeps_latest_value():
+    channel = TelemetryChannel('pri_out_ena', type='boolean')
+    channel.append(1.0, True)
+    timestamps, values = channel.timestamps, channel.values
+    assert channel.drain() == (timestamps, values)
+    # The drained columns are the channel's own (not copies), and the channel starts fresh ones
+    assert channel.timestamps is not timestamps and len(channel) == 0
+    assert channel.values.typecode == 'b'
+    assert (channel.last_timestamp, channel.last_value) == (1.0, True)
+
+
+def test_string_values_are_interned():
+    channel = TelemetryChannel('state', type='string')
+    channel.append(1.0, ''.join(['RUN', 'NING']))
+    channel.append(2.0, ''.join(['RUNN', 'ING']))
+    assert isinstance(channel.values, list)
+    assert channel.values[0] is channel.values[1]
+
+
+def test_untyped_channel_takes_type_from_first_point():
+    channel = TelemetryChannel('pri_meas_curr')
+    channel.add_point(UnitTelemetryPoint('pri_meas_curr', 1.0, 0.5, 'A'))
+    assert (channel.type, channel.unit, channel.values.typecode) == ('unit', 'A', 'd')
+    point = channel.pop_point()
+    assert isinstance(point, UnitTelemetryPoint) and (point.value, point.unit) == (0.5, 'A')
+
+    channel = TelemetryChannel('state')
+    channel.add_point(StringTelemetryPoint('state', 1.0, 'IDLE'))
+    assert channel.pop_point().value == 'IDLE'
+
+
+def test_pop_point_gives_booleans_back():
+    channel = TelemetryChannel('pri_out_ena', type='boolean')
+    channel.append(1.0, True)
+    point = channel.pop_point()
+    assert isinstance(point, BooleanTelemetryPoint) and point.value is True
+
+
+def test_drain_columns_takes_every_channel_in_tree():
+    vcu = TelemetryKeeper('leonardo')
+    psu = TelemetryKeeper('psu')
+    volts = TelemetryChannel('pri_meas_volt', type='unit', unit='V')
+    psu.add_telemetry_channel(volts)
+    vcu.add_telemetry_keeper(psu)
+    state = TelemetryChannel('state', type='string')
+    vcu.add_telemetry_channel(state)
+    volts.append(1.0, 12.0)
+    state.append(1.0, 'IDLE')
+    columns = {name: (point_type, unit, list(timestamps), list(values))
+               for name, point_type, unit, timestamps, values in vcu.drain_columns()}
+    assert columns == {
+        'leonardo.state': ('string', None, [1.0], ['IDLE']),
+        'leonardo.psu.pri_meas_volt': ('unit', 'V', [1.0], [12.0]),
+    }
+    assert len(volts) == 0 and len(state) == 0
+
+
+class _Stage(object):
+
+    def __init__(self):
+        self.records = []
+
+    def add(self, *record):
+        self.records.append(record)
+
+
+def _vcu_tree():
+    vcu = TelemetryKeeper('leonardo')
+    psu = TelemetryKeeper('psu')
+    enabled = TelemetryChannel('pri_out_ena', type='boolean')
+    psu.add_telemetry_channel(enabled)
+    vcu.add_telemetry_keeper(psu)
+    return vcu, psu, enabled
+
+
+def test_names_follow_keeper_into_tree():
+    vcu, psu, enabled = _vcu_tree()
+    assert enabled.fqn == 'leonardo.psu.pri_out_ena'
+    root = TelemetryKeeper('HIL')
+    root.add_telemetry_keeper(vcu)
+    assert (psu.fqn, enabled.fqn) == ('HIL.leonardo.psu', 'HIL.leonardo.psu.pri_out_ena')
+
+
+def test_records_flatten_tree_and_drain_it():
+    vcu, _, enabled = _vcu_tree()
+    enabled.append(1.0, True)
+    enabled.append(2.0, False)
+    assert list(vcu.records()) == [
+        (1.0, 'leonardo.psu.pri_out_ena', 'boolean', True, None),
+        (2.0, 'leonardo.psu.pri_out_ena', 'boolean', False, None),
+    ]
+    assert list(vcu.records()) == []
+
+
+def test_drain_to_feeds_every_stage_the_same_records():
+    vcu, _, enabled = _vcu_tree()
+    volts = TelemetryChannel('pri_meas_volt', type='unit', unit='V')
+    vcu.telemetry_keepers['psu'].add_telemetry_channel(volts)
+    enabled.append(1.0, True)
+    volts.append(1.0, 12.0)
+    first, second = _Stage(), _Stage()
+    vcu.drain_to(first, second)
+    assert first.records == second.records == [
+        (1.0, 'leonardo.psu.pri_out_ena', 'boolean', True, None),
+        (1.0, 'leonardo.psu.pri_meas_volt', 'unit', 12.0, 'V'),
+    ]
+
+
+def test_timestamped_data_groups_points_by_time():
+    vcu, _, enabled = _vcu_tree()
+    volts = TelemetryChannel('pri_meas_volt', type='unit', unit='V')
+    vcu.telemetry_keepers['psu'].add_telemetry_channel(volts)
+    enabled.append(1.0, True)
+    volts.append(1.0, 12.0)
+    volts.append(2.0, 11.5)
+    assert vcu.timestamped_data() == {
+        1.0: [{'name': 'leonardo.psu.pri_out_ena', 'type': 'boolean', 'value': True},
+              {'name': 'leonardo.psu.pri_meas_volt', 'type': 'unit', 'value': 12.0, 'unit': 'V'}],
+        2.0: [{'name': 'leonardo.psu.pri_meas_volt', 'type': 'unit', 'value': 11.5, 'unit': 'V'}],
+    }
+
+
+def test_current_data_dict_lists_empty_channels():
+    vcu, _, enabled = _vcu_tree()
+    enabled.append(1.0, True)
+    assert vcu.current_data_dict() == {
+        'leonardo.psu.pri_out_ena': [
+            {'name': 'leonardo.psu.pri_out_ena', 'type': 'boolean', 'value': True, 'timestamp': 1.0}],
+    }
+    assert vcu.current_data_dict() == {'leonardo.psu.pri_out_ena': []}
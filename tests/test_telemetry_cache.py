@@ -0,0 +1,51 @@
+import json
+from hilcode.telemetry import TelemetryChannel, TelemetryKeeper
+from hilcode.telemetry_cache import LatestValueCache
+
+
+def _tree():
+    root = TelemetryKeeper('HIL')
+    vcu = TelemetryKeeper('leonardo')
+    channels = []
+    for keeper_name in ('psu', 'micro_hia'):
+        keeper = TelemetryKeeper(keeper_name)
+        channel = TelemetryChannel('reading', type='float')
+        keeper.add_telemetry_channel(channel)
+        vcu.add_telemetry_keeper(keeper)
+        channel.append(1.0, 2.5)
+        channels.append(channel)
+    root.add_telemetry_keeper(vcu)
+    return root, vcu, channels
+
+
+def test_cache_serves_latest_points():
+    root, _, channels = _tree()
+    cache = LatestValueCache(prefix=f'{root.fqn}.')
+    cache.update(channels)
+    assert sorted(json.loads(cache.json())) == ['leonardo.micro_hia.reading', 'leonardo.psu.reading']
+    assert cache.names('leonardo.psu') == ['leonardo.psu.reading']
+
+
+def test_channels_named_by_target_path():
+    root, vcu, channels = _tree()
+    cache = LatestValueCache(prefix=f'{root.fqn}.')
+    root.on_purge(cache.evict)
+    micro = vcu.telemetry_keepers['micro_hia']
+    cache.update(micro.channels(), keeper=micro, target='leonardo.hia')
+    # Same name a WAIT_ON_VAR on target 'leonardo' with channel 'hia.reading' uses
+    assert list(json.loads(cache.json('leonardo.hia'))) == ['leonardo.hia.reading']
+    assert cache.json('leonardo.micro_hia') is None
+    vcu.purge('micro_hia')
+    assert cache.json() == '{}'
+
+
+def test_purged_keeper_is_evicted():
+    root, vcu, channels = _tree()
+    cache = LatestValueCache(prefix=f'{root.fqn}.')
+    root.on_purge(cache.evict)
+    cache.update(channels)
+    cache.json()
+    vcu.purge('psu')
+    assert list(json.loads(cache.json())) == ['leonardo.micro_hia.reading']
+    assert cache.json('leonardo.psu') is None
+    assert cache.stats()['evictions'] == 1
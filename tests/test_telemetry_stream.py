@@ -0,0 +1,64 @@
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from hilcode.telemetry_stream import TelemetryBroadcaster
+import vcuhil_service
+
+
+def _published(count, history_size=10):
+    broadcaster = TelemetryBroadcaster(history_size=history_size)
+    for n in range(count):
+        broadcaster.publish({'n': n})
+    return broadcaster
+
+
+def test_since_resumes_after_cursor():
+    entries, missed, reset = _published(5).since(3)
+    assert [seq for seq, _ in entries] == [4, 5]
+    assert (missed, reset) == (0, False)
+
+
+def test_cursor_ahead_of_service_is_reset():
+    # Service restarted, client's cursor is from the old numbering
+    entries, missed, reset = _published(3).since(500)
+    assert [seq for seq, _ in entries] == [1, 2, 3]
+    assert (missed, reset) == (0, True)
+
+
+def test_cursor_older_than_history_is_reset():
+    entries, missed, reset = _published(20).since(5)
+    assert [seq for seq, _ in entries] == list(range(11, 21))
+    assert (missed, reset) == (5, True)
+
+
+def test_wait_since_returns_reset_without_waiting():
+    async def run():
+        broadcaster = _published(3)
+        entries, _, reset = await broadcaster.wait_since(500, timeout=10)
+        assert reset and entries[-1][0] == broadcaster.seq
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_subscriber_resuming_from_reset_cursor_gets_everything_held():
+    async def run():
+        broadcaster = _published(3)
+        subscriber = broadcaster.subscribe(cursor=500)
+        assert subscriber.reset
+        assert [seq for seq, _ in await subscriber.get(timeout=1)] == [1, 2, 3]
+        assert subscriber.cursor == 3
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_poll_rejects_bad_timeout():
+    async def run():
+        vcuhil_service.service_state.set({'telemetry_broadcaster': _published(3)})
+        app = web.Application()
+        app.add_routes(vcuhil_service.routes)
+        async with TestClient(TestServer(app)) as client:
+            for timeout in ('soon', 'nan', '-1'):
+                response = await client.get('/telemetry', params={'cursor': '0', 'timeout': timeout})
+                assert response.status == 400
+            response = await client.get('/telemetry', params={'cursor': '1', 'timeout': '0'})
+            assert response.status == 200
+            assert [entry['cursor'] for entry in await response.json()] == [2, 3]
+    asyncio.run(asyncio.wait_for(run(), 5))
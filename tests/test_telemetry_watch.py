@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+from hilcode.command import Command, CommandStatus, CommandWarning, Operation, RoutingError
+from hilcode.components import HIL, VCU, Micro
+from hilcode.sequence import Sequence
+from hilcode.telemetry import TelemetryChannel
+from hilcode.telemetry_cache import LatestValueCache
+import vcuhil_service
+
+
+def _hil():
+    hil = HIL('HIL')
+    vcu = VCU('leonardo', {'hia': {'type': 'micro'}, 'psu': {'type': 'sorensen_psu'}})
+    hil.components['leonardo'] = vcu
+    hil.telemetry.add_telemetry_keeper(vcu.telemetry)
+    # Micro 'hia' keeps its channels in telemetry keeper 'micro_hia'
+    micro = Micro('micro_hia', None)
+    micro.telemetry.add_telemetry_channel(TelemetryChannel('serial_out', 'string'))
+    vcu.components['hia'] = micro
+    vcu.telemetry.add_telemetry_keeper(micro.telemetry)
+    return hil, micro.telemetry.telemetry_channels['serial_out']
+
+
+def test_channel_found_by_component_name():
+    hil, channel = _hil()
+    assert hil.find_channel('leonardo.hia.serial_out') is channel
+    assert hil.find_channel('leonardo.micro_hia.serial_out') is channel
+    assert hil.find_channel('leonardo.vcu_state') is not None
+    assert hil.find_channel('leonardo.hia.nothing') is None
+
+
+def test_check_channel():
+    hil, _ = _hil()
+    hil.check_channel('leonardo.hia.serial_out')
+    # Configured, set up once the VCU is enabled
+    hil.check_channel('leonardo.psu.pri_meas_curr')
+    for path in ('leonardo.hia.nothing', 'leonardo.lpa.serial_out', 'donatello.vcu_state'):
+        with pytest.raises(RoutingError):
+            hil.check_channel(path)
+
+
+def test_sequence_with_unknown_channel_fails_before_running():
+    hil, _ = _hil()
+    sequence = Sequence.from_options({'steps': [
+        {'sleep': 0},
+        {'command': {'operation': 'WAIT_ON_VAR', 'options': {'channel': 'hia.nothing', 'value': 'x'}}},
+    ]}, target='leonardo')
+    with pytest.raises(CommandWarning, match='step 1'):
+        sequence.check_channels(hil)
+
+
+def test_sequence_rejects_bad_predicate():
+    with pytest.raises(CommandWarning, match='needs a number'):
+        Sequence.from_options({'steps': [
+            {'command': {'operation': 'WAIT_ON_VAR', 'options': {'channel': 'vcu_state', 'op': '>', 'value': 'x'}}},
+        ]}, target='leonardo')
+
+
+def test_wait_on_var_by_component_name():
+    async def run():
+        hil, channel = _hil()
+        cmd = Command(operation=Operation.WAIT_ON_VAR, target='leonardo',
+                      options={'channel': 'hia.serial_out', 'op': 'match', 'value': 'login:', 'timeout': 5})
+        cmd.track()
+        waiting = asyncio.create_task(vcuhil_service.wait_on_var({'hil': hil}, cmd))
+        await asyncio.sleep(0)
+        channel.append(1.0, 'vcu-leonardo login:')
+        await waiting
+        assert cmd.result.status == CommandStatus.SUCCESS
+        assert cmd.result.value['value'] == 'vcu-leonardo login:'
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_latest_value_names_are_channel_paths():
+    hil, channel = _hil()
+    channel.append(1.0, 'login:')
+    micro = hil.get_component('leonardo.hia')
+    cache = LatestValueCache(prefix=f'{hil.telemetry.fqn}.')
+    cache.update(micro.telemetry.channels(), keeper=micro.telemetry, target='leonardo.hia')
+    assert [hil.find_channel(name) for name in cache.names('leonardo')] == [channel]
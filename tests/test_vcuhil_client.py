@@ -0,0 +1,80 @@
+import json
+import socket
+import threading
+import pytest
+import hilcode.command as command
+import vcuhil
+
+
+class RestartingService(object):
+    """
+    Command service stand-in that serves each connection from a script: 'reply' answers a command, 'progress'
+    reports progress for it then closes the connection, 'close' reads a command and closes the connection without
+    a word (like a service restarting between the client's send and its reply).
+    """
+
+    def __init__(self, scripts):
+        self.scripts = list(scripts)
+        self.received = []
+        self.closed = [threading.Event() for _ in self.scripts]
+        self._server = socket.create_server(('127.0.0.1', 0))
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        for script, closed in zip(self.scripts, self.closed):
+            conn, _ = self._server.accept()
+            with conn, conn.makefile('rb') as lines:
+                for step in script:
+                    line = lines.readline()
+                    if not line:
+                        break
+                    message = json.loads(line)
+                    self.received.append(message)
+                    if step == 'close':
+                        break
+                    result = ['PROGRESS', {'step': 0}] if step == 'progress' else ['QUEUED', message['operation']]
+                    conn.sendall(f'{json.dumps({"id": message["id"], "result": result})}\n'.encode())
+                    if step == 'progress':
+                        break
+            closed.set()
+        self._server.close()
+
+
+@pytest.fixture(autouse=True)
+def _empty_pool():
+    yield
+    for host, port in list(vcuhil._connection_pool):
+        vcuhil.discard_connection(host, port)
+
+
+def _no_op():
+    return command.Command(operation=command.Operation.NO_OP, target='leonardo')
+
+
+def test_resends_when_service_closes_before_replying():
+    service = RestartingService([['reply', 'close'], ['reply']])
+    client = vcuhil.VCUHIL_command('127.0.0.1', service.port)
+    assert client.command(_no_op()) == ['QUEUED', 0]
+    assert client.command(_no_op()) == ['QUEUED', 0]
+    assert len(service.received) == 3
+
+
+def test_replaces_pooled_connection_service_closed():
+    service = RestartingService([['reply'], ['reply']])
+    client = vcuhil.VCUHIL_command('127.0.0.1', service.port)
+    assert client.command(_no_op()) == ['QUEUED', 0]
+    # Service closed its end after the first reply, the probe notices before anything is sent on it
+    assert service.closed[0].wait(2)
+    assert not vcuhil._connection_pool[('127.0.0.1', service.port)].alive()
+    assert client.command(_no_op()) == ['QUEUED', 0]
+    assert len(service.received) == 2
+
+
+def test_does_not_resend_command_service_started():
+    service = RestartingService([['progress']])
+    client = vcuhil.VCUHIL_command('127.0.0.1', service.port)
+    with pytest.raises(ConnectionError):
+        client.command(_no_op(), wait=True)
+    assert len(service.received) == 1
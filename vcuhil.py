@@ -2,6 +2,8 @@
 
 import abc
 import argparse
+import itertools
+import json
 import socket
 import pprint
 import hil_config
@@ -35,31 +37,226 @@ def check_command(cmd):
     return cmd
 
 
+def _add_wait(message, wait, timeout):
+    """
+    Add completion waiting options to a command message.
+
+    :param message: Command dictionary (see Command.to_dict)
+    :param wait: Service replies once command has finished
+    :param timeout: (optional) Seconds service waits for command to finish
+    """
+    if wait:
+        message['wait'] = True
+        if timeout is not None:
+            message['timeout'] = timeout
+
+
+def _parse_reply(reply):
+    """
+    Turn a completion reply (['DONE', result]) into a CommandResult, other replies are returned as is.
+
+    :param reply: Reply from HIL
+    :return: Reply from HIL, or CommandResult
+    """
+    if isinstance(reply, list) and len(reply) == 2 and reply[0] == 'DONE':
+        return command.CommandResult.from_dict(reply[1])
+    return reply
+
+
+class VCUHIL_connection(object):
+    """
+    Persistent command connection to the HIL service.  Many commands share one connection, and several can be sent
+    before reading any replies (replies are matched to commands by correlation id).
+    """
+
+    def __init__(self, host, cmd_port=8080):
+        """
+        Open a persistent command connection.
+
+        :param host: Command server hostname
+        :param cmd_port: Command server port (default of 8080)
+        """
+        self.host = host
+        self.port = cmd_port
+        self._socket = socket.create_connection((host, cmd_port))
+        self._file = self._socket.makefile('rb')
+        self._ids = itertools.count(1)
+        self._replies = {}
+        self._progress = {}
+        self._heard = set()
+
+    def send(self, cmd, wait=False, timeout=None):
+        """
+        Send a command without waiting for its reply.
+
+        :param cmd: HIL command to send to service for execution
+        :param wait: Service replies once command has finished, instead of once it is queued
+        :param timeout: (optional) Seconds service waits for command to finish before replying
+        :return: Correlation id, pass to recv() to get reply
+        """
+        cmd = check_command(cmd)
+        command_id = next(self._ids)
+        message = command.Command(
+            operation=cmd.operation,
+            options=cmd.options,
+            target=cmd.target,
+            command_id=command_id
+        ).to_dict()
+        _add_wait(message, wait, timeout)
+        self._socket.sendall(f'{json.dumps(message)}\n'.encode())
+        return command_id
+
+    def recv(self, command_id, progress=None):
+        """
+        Wait for the reply to a sent command.
+
+        :param command_id: Correlation id returned by send()
+        :param progress: (optional) Function called with each progress dictionary the command reports (like the
+                         steps of a SEQUENCE) until it replies
+        :return: Reply from HIL
+        """
+        while command_id not in self._replies:
+            for report in self._progress.pop(command_id, ()):
+                if progress is not None:
+                    progress(report)
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError('HIL service closed command connection')
+            reply = json.loads(line)
+            self._heard.add(reply['id'])
+            if isinstance(reply['result'], list) and reply['result'][:1] == ['PROGRESS']:
+                self._progress.setdefault(reply['id'], []).append(reply['result'][1])
+                continue
+            self._replies[reply['id']] = reply['result']
+        for report in self._progress.pop(command_id, ()):
+            if progress is not None:
+                progress(report)
+        self._heard.discard(command_id)
+        return _parse_reply(self._replies.pop(command_id))
+
+    def heard_from(self, command_id):
+        """
+        Has the service sent anything (a reply or progress) for a command?
+
+        :param command_id: Correlation id returned by send()
+        :return: True/False if anything was received for command
+        """
+        return command_id in self._heard or command_id in self._replies
+
+    def alive(self):
+        """
+        Check, without blocking, that the service hasn't closed the connection (like after a restart).
+
+        :return: True/False if connection still open
+        """
+        try:
+            data = self._socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        # Unread replies are fine, nothing at all means the service closed its end
+        return bool(data)
+
+    def command(self, cmd, wait=False, timeout=None, progress=None):
+        """
+        Send a command to the HIL service and wait for its reply.
+
+        :param cmd: HIL command to send to service for execution
+        :param wait: Wait for command to finish, instead of only for it to be queued
+        :param timeout: (optional) Seconds to wait for command to finish
+        :param progress: (optional) Function called with each progress dictionary while waiting
+        :return: Reply from HIL, or CommandResult if waiting
+        """
+        return self.recv(self.send(cmd, wait=wait, timeout=timeout), progress=progress)
+
+    def close(self):
+        """
+        Close connection.
+        """
+        self._file.close()
+        self._socket.close()
+
+
+# Open persistent connections, by (host, port)
+_connection_pool = {}
+
+
+def pooled_connection(host, cmd_port):
+    """
+    Get the pooled persistent connection to a HIL service, opening it if needed.
+
+    :param host: Command server hostname
+    :param cmd_port: Command server port
+    :return: VCUHIL_connection
+    """
+    key = (host, cmd_port)
+    if key in _connection_pool and not _connection_pool[key].alive():
+        discard_connection(host, cmd_port)
+    if key not in _connection_pool:
+        _connection_pool[key] = VCUHIL_connection(host, cmd_port)
+    return _connection_pool[key]
+
+
+def discard_connection(host, cmd_port):
+    """
+    Close and forget a pooled connection (after it broke).
+
+    :param host: Command server hostname
+    :param cmd_port: Command server port
+    """
+    conn = _connection_pool.pop((host, cmd_port), None)
+    if conn is not None:
+        conn.close()
+
+
 class VCUHIL_command(object):
     """
     Client for HIL commands.
     """
 
-    def __init__(self, host, cmd_port=8080):
+    def __init__(self, host, cmd_port=8080, persistent=True):
         """
         Generate a HIL command client.
 
         :param host: Command client hostname
         :param cmd_port: Command client port (default of 8080)
+        :param persistent: Send over a pooled persistent connection (default), or one connection per command
         """
         self.host = host
         self.port = cmd_port
+        self.persistent = persistent
 
-    def command(self, cmd):
+    def command(self, cmd, wait=False, timeout=None, progress=None):
         """
         Send a command to the HIL service.
 
         :param cmd: HIL command to send to service for execution
-        :return: Response from HIL
-        """
+        :param wait: Wait for command to finish, instead of only for it to be queued
+        :param timeout: (optional) Seconds to wait for command to finish
+        :param progress: (optional) Function called with each progress dictionary while waiting (persistent only)
+        :return: Response from HIL, or CommandResult if waiting on a persistent connection
+        """
+        if self.persistent:
+            conn = pooled_connection(self.host, self.port)
+            command_id = None
+            try:
+                command_id = conn.send(cmd, wait=wait, timeout=timeout)
+                return conn.recv(command_id, progress=progress)
+            except ConnectionError:
+                discard_connection(self.host, self.port)
+                if command_id is not None and conn.heard_from(command_id):
+                    # Service had the command, sending it again could run it twice
+                    raise
+            # Pooled connection went stale (service restarted) before the command got anywhere, send once more on a
+            # fresh one
+            conn = pooled_connection(self.host, self.port)
+            return conn.recv(conn.send(cmd, wait=wait, timeout=timeout), progress=progress)
         cmd_socket = socket.create_connection((self.host, self.port))
         cmd = check_command(cmd)
-        bcmd = str(cmd).encode()
+        message = cmd.to_dict()
+        _add_wait(message, wait, timeout)
+        bcmd = f'{json.dumps(message)}\n'.encode()
         cmd_socket.send(bcmd)
         r = cmd_socket.recvmsg(BUFFER_SIZE)
         cmd_socket.close()
@@ -91,6 +288,21 @@ class VCUHIL_telemetry(object):
         tlm_j = tlm_r.json()
         return telemetry.TelemetryJsonLine(tlm_j)
 
+    def get_latest(self, pattern=None):
+        """
+        Get the latest point of telemetry channels, without taking telemetry away from other clients.
+
+        :param pattern: (optional) Channel name ('leonardo.psu.pri_meas_curr'), glob ('*.vcu_state') or VCU or
+                        component name ('leonardo'), every channel if not given
+        :return: Dictionary of {channel name: point dictionary}
+        """
+        url = f'http://{self.host}:{self.port}/latest'
+        if pattern is not None:
+            url = f'{url}/{pattern}'
+        tlm_r = requests.get(url)
+        tlm_r.raise_for_status()
+        return tlm_r.json()
+
 
 class ComponentClient(object):
     """
@@ -163,19 +375,25 @@ class MicroClient(ComponentClient):
         """
         self.subcomponent_name = name
 
-    def command(self, cmd):
+    def command(self, cmd, wait=False, timeout=None):
         """
         Send a command (always a serial command) to the HIL.
 
         :param cmd: Command to send to microcontroller.
+        :param wait: Wait for command to finish, instead of only for it to be queued
+        :param timeout: (optional) Seconds to wait for command to finish
         :return:
         """
         cmd_client = VCUHIL_command(self.host, cmd_port=self.cmd_port)
+        options = {'command': cmd.options['command']}
+        for option in ('expect', 'timeout', 'quiet'):
+            if cmd.options.get(option) is not None:
+                options[option] = cmd.options[option]
         return cmd_client.command(command.Command(
             operation=command.Operation.SERIAL_CMD,
             target=self.name,
-            options={'command':cmd.options['command']}
-        ))
+            options=options
+        ), wait=wait, timeout=timeout)
 
 
 
@@ -205,15 +423,17 @@ class PowerSupplyClient(ComponentClient):
         """
         self.subcomponent_name = name
 
-    def command(self, cmd):
+    def command(self, cmd, wait=False, timeout=None):
         """
         Send a command to the HIL.
 
         :param cmd: Command to send to microcontroller.
+        :param wait: Wait for command to finish, instead of only for it to be queued
+        :param timeout: (optional) Seconds to wait for command to finish
         :return:
         """
         cmd_client = VCUHIL_command(self.host, cmd_port=self.cmd_port)
-        return cmd_client.command(cmd)
+        return cmd_client.command(cmd, wait=wait, timeout=timeout)
 
     def _generic_command(self, cmd, val):
         cmd_client = VCUHIL_command(self.host, cmd_port=self.cmd_port)
@@ -302,7 +522,7 @@ class VCUClient(ComponentClient):
         :param subcomponent_config: Dictionary of configuration options for subcomponent
         :return:
         """
-        if subcomponent_config['type'] == 'sorensen_psu':
+        if subcomponent_config['type'].endswith('_psu'):
             self.subcomponents[name] = PowerSupplyClient(f'{self.name}.{name}', self.host,
                                                          cmd_port=self.cmd_port,
                                                          config=subcomponent_config
@@ -312,38 +532,25 @@ class VCUClient(ComponentClient):
                                                    cmd_port=self.cmd_port,
                                                    config=subcomponent_config)
 
-    def command(self, cmd):
+    def command(self, cmd, wait=False, timeout=None):
         """
         Send a command to the VCU on the HIL
 
         :param cmd: Command object to send.
+        :param wait: Wait for command to finish, instead of only for it to be queued
+        :param timeout: (optional) Seconds to wait for command to finish
         :return:
         """
         cmd_client = VCUHIL_command(self.host, cmd_port=self.cmd_port)
-        if cmd.operation == command.Operation.BRING_OFFLINE:
+        if cmd.operation in (command.Operation.BRING_OFFLINE,
+                             command.Operation.POWER_OFF,
+                             command.Operation.ENABLE,
+                             command.Operation.BOOTED_FORCE):
             return cmd_client.command(command.Command(
-                operation=command.Operation.BRING_OFFLINE,
+                operation=cmd.operation,
                 target=self.name,
                 options=None
-            ))
-        elif cmd.operation == command.Operation.POWER_OFF:
-            return cmd_client.command(command.Command(
-                operation=command.Operation.POWER_OFF,
-                target=self.name,
-                options=None
-            ))
-        elif cmd.operation == command.Operation.ENABLE:
-            return cmd_client.command(command.Command(
-                operation=command.Operation.ENABLE,
-                target=self.name,
-                options=None
-            ))
-        elif cmd.operation == command.Operation.BOOTED_FORCE:
-            return cmd_client.command(command.Command(
-                operation=command.Operation.BOOTED_FORCE,
-                target=self.name,
-                options=None
-            ))
+            ), wait=wait, timeout=timeout)
         else:
             raise RuntimeError('Something else that is not a vcu offline')
 
@@ -362,10 +569,83 @@ class VCUHILClient(object):
         :param telem_port: Telemetry port of VCU HIL (default is 8888)
         """
         self.host = host
+        self.cmd_port = cmd_port
         self.telem_port = telem_port
         vcu_config = hil_config.VCU_CONFIGS
         self.vcus = {name:VCUClient(name, host, cmd_port, config) for name,config in vcu_config.items()}
 
+    def broadcast(self, operation, targets, options=None, wait=False, timeout=None):
+        """
+        Send one command to many components at once, like ENABLE to '*' or set_defaults to '*.psu'.  The service
+        runs it on every target at the same time.
+
+        :param operation: Operation to run
+        :param targets: Glob pattern ('*', '*.psu', 'leo*.h*'), or list of targets and patterns
+        :param options: Command options, same for every target
+        :param wait: Wait for every target to finish, instead of only for the command to be queued
+        :param timeout: (optional) Seconds to wait for every target to finish
+        :return: Reply from HIL, or CommandResult if waiting (value is {'targets': {target: result dictionary}})
+        """
+        cmd_client = VCUHIL_command(self.host, cmd_port=self.cmd_port)
+        return cmd_client.command(command.Command(
+            operation=operation,
+            target=list(targets) if isinstance(targets, (list, tuple)) else targets,
+            options=options
+        ), wait=wait, timeout=timeout)
+
+    def sequence(self, steps, target='', timeout=None, progress=None):
+        """
+        Run a sequence of steps (commands, state waits, sleeps and branches, see hilcode.sequence) inside the service
+        and wait for it to finish.
+
+        :param steps: List of step dictionaries
+        :param target: (optional) Target of steps that don't name one
+        :param timeout: (optional) Seconds the whole sequence may take
+        :param progress: (optional) Function called with a progress dictionary as each step starts and finishes
+        :return: CommandResult, value is {'steps': [finished step dictionaries]}
+        """
+        options = {'steps': steps}
+        if timeout is not None:
+            options['timeout'] = timeout
+        cmd_client = VCUHIL_command(self.host, cmd_port=self.cmd_port)
+        return cmd_client.command(command.Command(
+            operation=command.Operation.SEQUENCE,
+            target=target,
+            options=options
+        ), wait=True, timeout=timeout, progress=progress)
+
+    def wait_on_var(self, channel, op, value, timeout=None):
+        """
+        Wait inside the service until a telemetry channel meets a condition, like
+        wait_on_var('leonardo.vcu_state', '==', 'idle').  Replies on the sample that meets it.
+
+        :param channel: Target, then channel name, like 'leonardo.psu.pri_meas_curr' or 'leonardo.hia.serial_out'
+                        (component names, not telemetry keeper names), a channel that doesn't exist fails right away
+        :param op: Operator, one of ==, !=, <, <=, >, >= or match (regular expression)
+        :param value: Value compared against
+        :param timeout: (optional) Seconds to wait
+        :return: CommandResult, value is {'channel', 'timestamp', 'value'} of the point that met it (or the latest)
+        """
+        options = {'channel': channel, 'op': op, 'value': value}
+        if timeout is not None:
+            options['timeout'] = timeout
+        cmd_client = VCUHIL_command(self.host, cmd_port=self.cmd_port)
+        return cmd_client.command(command.Command(
+            operation=command.Operation.WAIT_ON_VAR,
+            target='',
+            options=options
+        ), wait=True, timeout=timeout + 1 if timeout is not None else None)
+
+    def get_latest(self, pattern=None):
+        """
+        Get the latest point of telemetry channels (see VCUHIL_telemetry.get_latest).
+
+        :param pattern: (optional) Channel name, glob, or VCU or component name
+        :return: Dictionary of {channel name: point dictionary}
+        """
+        tlm = VCUHIL_telemetry(self.host, self.telem_port)
+        return tlm.get_latest(pattern)
+
     def get_telem_dict(self):
         """
         Get current telemetry points from server.
@@ -381,10 +661,13 @@ class VCUHILClient(object):
 def print_action_help():
     print('SYNTAX: vcuhil.py [action]')
     print('ACTION: telemetry\t\tGet and print one telemetry point.')
+    print('ACTION: latest\t\tGet the latest value of channels (a name, glob or VCU, all if not given).')
     print('ACTION: psu_set\t\tAdjust a power supply setting.')
     print('ACTION: serial_command\t\tSend an arbitrary command over a serial port.')
     print('ACTION: bring_offline\t\tSet a VCU to offline status.')
     print('ACTION: power_off\t\tCompletely power off VCU, and reinitialize all states.')
+    print('ACTION: wait_on_var\t\tWait for a telemetry channel to meet a condition (--until).')
+    print('ACTION: sequence\t\tRun the sequence of steps in a JSON file (--file) on the service.')
     print('ACTION: help\t\tPrint this message.')
 
 
@@ -399,10 +682,104 @@ def print_psu_set_help():
     print('SETTING: set_defaults\t\tSet supply to default values for VCU.')
 
 
+def print_result(reply):
+    """
+    Print outcome of a command that was waited on.
+
+    :param reply: Reply from HIL, or CommandResult
+    """
+    if isinstance(reply, command.CommandResult):
+        print(f'{reply.status.value.upper()}: {reply.warning or ""}'.rstrip(': '))
+        if isinstance(reply.value, dict) and 'targets' in reply.value:
+            # Broadcast command, one result per target
+            for target, result in reply.value['targets'].items():
+                print(f'{target}: ', end='')
+                print_result(command.CommandResult.from_dict(result))
+        elif isinstance(reply.value, dict) and 'lines' in reply.value:
+            # Serial command output
+            for line in reply.value['lines']:
+                print(line)
+        elif reply.value is not None:
+            pprint.pprint(reply.value)
+
+
+def print_progress(report):
+    """
+    Print a progress report of a sequence step.
+
+    :param report: Progress dictionary
+    """
+    step = f'step {report["step"]} {report["kind"]}'
+    if report.get('label'):
+        step = f'{step} ({report["label"]})'
+    if report['event'] == 'started':
+        print(f'{report["elapsed"]:8.2f}s {step} started')
+    else:
+        warning = f': {report["warning"]}' if report.get('warning') else ''
+        print(f'{report["elapsed"]:8.2f}s {step} {report["status"]} in {report["seconds"]:.2f}s{warning}')
+
+
+def broadcast_target(vcu_name, subcomponent_name=None):
+    """
+    Command target for VCU names given on the command line, a pattern or list if it names more than one VCU.
+
+    :param vcu_name: VCU name, glob pattern ('*', 'leo*') or comma separated list
+    :param subcomponent_name: (optional) Subcomponent of every VCU
+    :return: Target string or list, and True/False if it is a broadcast
+    """
+    names = vcu_name.split(',')
+    targets = [f'{name}.{subcomponent_name}' if subcomponent_name else name for name in names]
+    target = targets if len(targets) > 1 else targets[0]
+    return target, command.is_broadcast(target)
+
+
 def main(args):
     hil = VCUHILClient(args.host, args.cmd_port, args.telem_port)
-    if args.action == 'telemetry':
+    vcu_operations = {
+        'bring_offline': command.Operation.BRING_OFFLINE,
+        'power_off': command.Operation.POWER_OFF,
+        'enable': command.Operation.ENABLE,
+        'force_booted': command.Operation.BOOTED_FORCE,
+    }
+    if args.vcu_name is not None and args.action != 'latest':
+        target, broadcast = broadcast_target(args.vcu_name, args.subcomponent_name)
+    else:
+        broadcast = False
+    if broadcast:
+        if args.action in vcu_operations:
+            reply = hil.broadcast(vcu_operations[args.action], target, wait=args.wait, timeout=args.timeout)
+        elif args.action == 'psu_set' and args.command == 'set_defaults':
+            reply = hil.broadcast(command.Operation.PWR_SUPPLY_CMD, target, options={'command': 'set_defaults'},
+                                  wait=args.wait, timeout=args.timeout)
+        elif args.action == 'serial_cmd':
+            options = {'command': args.command}
+            for option in ('expect', 'timeout'):
+                if getattr(args, option) is not None:
+                    options[option] = getattr(args, option)
+            reply = hil.broadcast(command.Operation.SERIAL_CMD, target, options=options,
+                                  wait=args.wait or args.expect is not None)
+        else:
+            raise RuntimeError(f'Action {args.action} {args.command or ""} can not be sent to several VCUs.')
+        print_result(reply)
+    elif args.action == 'telemetry':
         pprint.pprint(hil.get_telem_dict())
+    elif args.action == 'latest':
+        pprint.pprint(hil.get_latest(args.vcu_name))
+    elif args.action == 'wait_on_var':
+        op, _, value = (args.until or '').partition(' ')
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+        print_result(hil.wait_on_var(args.vcu_name, op, value, timeout=args.timeout))
+    elif args.action == 'sequence':
+        with open(args.file) as f:
+            document = json.load(f)
+        steps = document['steps'] if isinstance(document, dict) else document
+        timeout = args.timeout if args.timeout is not None else \
+            (document.get('timeout') if isinstance(document, dict) else None)
+        reply = hil.sequence(steps, target=args.vcu_name or '', timeout=timeout, progress=print_progress)
+        print(f'{reply.status.value.upper()}: {reply.warning or ""}'.rstrip(': '))
     elif args.action == 'psu_set':
         if args.command == 'voltage_ch1':
             hil.vcus[args.vcu_name].subcomponents[args.subcomponent_name].set_voltage_channel1(args.setpoint)
@@ -427,35 +804,35 @@ def main(args):
         else:
             raise RuntimeError(f'Command for psu_set {args.command} not recognized. Try "help" for a list of commands.')
     elif args.action == 'serial_cmd':
-        hil.vcus[args.vcu_name].subcomponents[args.subcomponent_name].command(command.Command(
+        print_result(hil.vcus[args.vcu_name].subcomponents[args.subcomponent_name].command(command.Command(
             operation=command.Operation.SERIAL_CMD,
             target=f'{args.vcu_name}.{args.subcomponent_name}',
-            options={'command': args.command }
-        ))
+            options={'command': args.command, 'expect': args.expect, 'timeout': args.timeout}
+        ), wait=args.wait or args.expect is not None))
     elif args.action == 'bring_offline':
-        hil.vcus[args.vcu_name].command(command.Command(
+        print_result(hil.vcus[args.vcu_name].command(command.Command(
             operation=command.Operation.BRING_OFFLINE,
             target=args.vcu_name,
             options=None
-        ))
+        ), wait=args.wait, timeout=args.timeout))
     elif args.action == 'power_off':
-        hil.vcus[args.vcu_name].command(command.Command(
+        print_result(hil.vcus[args.vcu_name].command(command.Command(
             operation=command.Operation.POWER_OFF,
             target=args.vcu_name,
             options=None
-        ))
+        ), wait=args.wait, timeout=args.timeout))
     elif args.action == 'enable':
-        hil.vcus[args.vcu_name].command(command.Command(
+        print_result(hil.vcus[args.vcu_name].command(command.Command(
             operation=command.Operation.ENABLE,
             target=args.vcu_name,
             options=None
-        ))
+        ), wait=args.wait, timeout=args.timeout))
     elif args.action == 'force_booted':
-        hil.vcus[args.vcu_name].command(command.Command(
+        print_result(hil.vcus[args.vcu_name].command(command.Command(
             operation=command.Operation.BOOTED_FORCE,
             target=args.vcu_name,
             options=None
-        ))
+        ), wait=args.wait, timeout=args.timeout))
     elif args.action == 'help':
         print_action_help()
     else:
@@ -465,13 +842,22 @@ if __name__=='__main__':
     parser = argparse.ArgumentParser(prog='vcuhil',
                                      description='Client to manage VCU HIL on main x86 computer (April).')
     parser.add_argument('action', default='telemetry', type=str, help='Action to execute')
-    parser.add_argument('vcu_name', default=None, type=str, help='Target VCU', nargs='?')
+    parser.add_argument('vcu_name', default=None, type=str, nargs='?',
+                        help='Target VCU, a glob ("*", "leo*") or comma separated list sends to several at once')
     parser.add_argument('subcomponent_name', default=None, type=str, help='Target VCU component', nargs='?')
     parser.add_argument('command', default=None, type=str, help='(optional) Command of action', nargs='?')
     parser.add_argument('setpoint', default=None, type=float, help='(optional) Setpoint of action', nargs='?')
     parser.add_argument('--host', default='localhost', type=str, help='Host for HIL service')
     parser.add_argument('--cmd_port', default=6060, type=int, help='Host port for commanding HIL')
     parser.add_argument('--telem_port', default=6666, type=int, help='Host port for commanding HIL')
+    parser.add_argument('--wait', action='store_true', help='Wait for command to finish and print its outcome')
+    parser.add_argument('--timeout', default=None, type=float, help='Seconds to wait for command to finish')
+    parser.add_argument('--expect', default=None, type=str,
+                        help='serial_cmd: regex (like a prompt) ending command output, implies --wait')
+    parser.add_argument('--until', default=None, type=str,
+                        help='wait_on_var: condition, an operator and a value like "== idle" or "> 1.5"')
+    parser.add_argument('--file', default=None, type=str,
+                        help='sequence: JSON file of steps, or of {"steps": [...], "timeout": seconds}')
 
     args = parser.parse_args()
     main(args)
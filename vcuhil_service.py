@@ -4,23 +4,49 @@
 # (c) 2020 Luminar Technologies
 
 # Imports
-from hil_config import VCU_CONFIGS
+from hil_config import VCU_CONFIGS, PSU_DEFAULTS
 from hilcode.components import VCU, HIL
-from hilcode.command import Command, Operation, CommandWarning
+from hilcode.command import Command, Operation, CommandWarning, CommandStatus, CommandResult, RoutingError
+from hilcode.influx_writer import InfluxWriter
+from hilcode.scheduler import Scheduler, LoopMonitor
+from hilcode.simulator import Simulator, DiscardingInfluxClient, LINE_RATE
+from hilcode.dispatcher import CommandDispatcher
+from hilcode.sequence import Sequence, SEQUENCE_TIMEOUT
+from hilcode.telemetry_watch import ChannelPredicate, wait_for_channel, channel_path
+from hilcode.telemetry_stream import TelemetryBroadcaster
+from hilcode.telemetry import TimestampGrouper
+from hilcode.telemetry_cache import LatestValueCache
 from contextvars import ContextVar
 import logging
 import asyncio
+import time
 import argparse
 import sys
 import json
+import itertools
 import pprint
-import datetime
-from influxdb import InfluxDBClient
 from aiohttp import web
 
 DEBUG = False
 
 CYCLE_TIME = 1
+POLL_TIMEOUT = 30
+COMMAND_TIMEOUT = 60
+# Correlation ids given to commands sent without one (one-shot), prefixed so they can't be mistaken for a client's
+SERVER_COMMAND_IDS = itertools.count(1)
+SERVER_ID_PREFIX = 'hil-'
+# Seconds between load reports in simulate mode
+SIMULATE_REPORT_PERIOD = 10
+
+# Telemetry rate for each VCU subcomponent, by config type (seconds)
+COMPONENT_PERIODS = {
+    'micro': 0.1,
+    'sorensen_psu': 0.25,
+    'simulated_psu': 0.25,
+    'sga': 1.0,
+    'hpa': 5.0,
+}
+VCU_STATE_PERIOD = 0.25
 
 if DEBUG:
     LOG_LEVEL = logging.DEBUG
@@ -37,6 +63,7 @@ log.setLevel(LOG_LEVEL)
 # Globals
 command_queue = ContextVar('command_queue')
 telemetry_queue = ContextVar('telemetry_queue')
+service_state = ContextVar('service_state')
 routes = web.RouteTableDef()
 
 # Setup
@@ -47,33 +74,161 @@ async def setup(args):
     :param args: Arguments from command line
     :return: State of HIL
     """
-    # Parse Config
+    # Parse Config, simulated VCUs stand in for the real ones in simulate mode
+    simulator = None
+    vcu_configs = VCU_CONFIGS
+    if args.get('simulate'):
+        simulator = Simulator(args['simulate'], line_rate=args.get('line_rate', LINE_RATE))
+        await simulator.start()
+        vcu_configs = simulator.vcu_configs(PSU_DEFAULTS)
     hil = HIL('VCU HIL')
-    for vcu_name, vcu_config in VCU_CONFIGS.items():
+    for vcu_name, vcu_config in vcu_configs.items():
         vcu = VCU(vcu_name, vcu_config)
         hil.components[vcu_name] = vcu
 
     # Setup Components
+    started = time.monotonic()
     await hil.setup('VCU HIL')
+    log_setup_report(hil.setup_reports(), time.monotonic() - started)
     log.warning('-=NINJA TURTLES GO=-')
 
-    return {
+    # Influx Writer (points are formatted but thrown away in simulate mode)
+    influx_writer = InfluxWriter(client=DiscardingInfluxClient()) if simulator is not None else InfluxWriter()
+    await influx_writer.start()
+
+    state = {
         'done': False,
         'hil': hil,
         'log_filename': args['log_filename'],
         'command_queue': asyncio.Queue(),
-        'telemetry_queue': asyncio.Queue(200)
+        'telemetry_queue': asyncio.Queue(200),
+        'influx_writer': influx_writer,
+        'scheduler': Scheduler(),
+        'telemetry_broadcaster': TelemetryBroadcaster(),
+        'telemetry_cache': LatestValueCache(prefix=f'{hil.telemetry.fqn}.'),
+        'loop_monitor': LoopMonitor(),
+        'simulator': simulator,
     }
+    # Channels purged at VCU desetup would otherwise be served by /latest forever
+    hil.telemetry.on_purge(state['telemetry_cache'].evict)
+    async def execute(cmd):
+        cmd.start()
+        try:
+            await execute_command(state, cmd)
+        except Exception as e:
+            cmd.finish(CommandStatus.ERROR, warning=f'{type(e).__name__}: {e}')
+            raise
+    def check_vcu(key):
+        # Commands without a target are for the HIL itself
+        if key:
+            hil.index.route(key)
+    state['dispatcher'] = CommandDispatcher(execute, check_key=check_vcu)
+    setup_jobs(state)
+    if simulator is not None:
+        # Simulated VCUs are switched on straight away, so they boot and load the service
+        for vcu_name in hil.components:
+            state['command_queue'].put_nowait(Command(operation=Operation.ENABLE, target=vcu_name))
+    return state
+
+
+def log_setup_report(reports, seconds):
+    """
+    Log how long each VCU subcomponent took to set up, and which are degraded.
+
+    :param reports: Setup reports (see HIL.setup_reports)
+    :param seconds: Total setup time
+    """
+    log.info(f'Setup took {seconds:.2f}s')
+    for vcu_name, report in reports.items():
+        for comp_name, comp_report in sorted(report.items(), key=lambda item: -item[1]['seconds']):
+            if comp_report['status'] == 'ok':
+                log.info(f'  {vcu_name}.{comp_name}: {comp_report["seconds"]:.2f}s')
+            else:
+                log.warning(f'  {vcu_name}.{comp_name}: DEGRADED after {comp_report["seconds"]:.2f}s '
+                            f'({comp_report["error"]})')
+
+
+def setup_jobs(state):
+    """
+    Register periodic jobs, one per VCU state machine and one per VCU subcomponent, each at its own rate.
+
+    :param state: State of program
+    """
+    scheduler = state['scheduler']
+    hil = state['hil']
+    cache = state['telemetry_cache']
+    for vcu_name, vcu in hil.components.items():
+        async def vcu_job(vcu=vcu):
+            await vcu.check_state()
+            await vcu.gather_state_telemetry()
+            cache.update(vcu.telemetry.telemetry_channels.values(), keeper=vcu.telemetry, target=vcu_name)
+        scheduler.add_job(vcu_name, VCU_STATE_PERIOD, vcu_job)
+        for comp_name, comp_config in vcu.configs.items():
+            if comp_config['type'] not in COMPONENT_PERIODS:
+                continue
+            async def component_job(vcu=vcu, comp_name=comp_name):
+                # Looked up every run, components are rebuilt when a VCU is power cycled
+                comp = vcu.components.get(comp_name)
+                if comp is not None:
+                    await comp.gather_telemetry()
+                    cache.update(comp.telemetry.channels(), keeper=comp.telemetry, target=f'{vcu_name}.{comp_name}')
+            scheduler.add_job(f'{vcu_name}.{comp_name}', COMPONENT_PERIODS[comp_config['type']], component_job)
+    async def publish_job():
+        await publish_telemetry(state)
+    scheduler.add_job('publish', CYCLE_TIME, publish_job)
+    if state['simulator'] is not None:
+        async def report_job():
+            # First run is at startup, before there is anything to report
+            if state['scheduler'].jobs['publish'].runs:
+                log_load_report(state)
+        scheduler.add_job('simulate_report', SIMULATE_REPORT_PERIOD, report_job)
+
+
+def load_report(state):
+    """
+    Summary of how the service is keeping up: job cycle times, event loop lag and memory.
+
+    :param state: State of program
+    :return: Dictionary of load statistics
+    """
+    jobs = state['scheduler'].stats()
+    loop = state['loop_monitor'].stats()
+    return {
+        'vcus': len(state['hil'].components),
+        'jobs': len(jobs),
+        'max_job_duration': max((job['last_duration'] for job in jobs.values()), default=0.0),
+        'publish_duration': jobs['publish']['last_duration'] if 'publish' in jobs else 0.0,
+        'overruns': sum(job['overruns'] for job in jobs.values()),
+        'mean_lag': loop['mean_lag'],
+        'p99_lag': loop['p99_lag'],
+        'max_lag': loop['max_lag'],
+        'rss_bytes': loop['rss_bytes'],
+    }
+
+
+def log_load_report(state):
+    """
+    Log a load report (see load_report).
+
+    :param state: State of program
+    """
+    report = load_report(state)
+    rss = f'{report["rss_bytes"] / 2 ** 20:.1f} MiB' if report['rss_bytes'] is not None else 'unknown'
+    log.warning(f'{report["vcus"]} VCUs: max job {report["max_job_duration"] * 1e3:.2f} ms, '
+                f'publish {report["publish_duration"] * 1e3:.2f} ms, {report["overruns"]} overruns, '
+                f'loop lag mean {report["mean_lag"] * 1e3:.2f} ms p99 {report["p99_lag"] * 1e3:.2f} ms '
+                f'max {report["max_lag"] * 1e3:.2f} ms, RSS {rss}')
 
 
 async def execute_command(state, curr_command):
     """
-    Function for deciding how to execute command.
+    Function for deciding how to execute command.  The outcome is recorded on the command (see Command.finish).
 
     :param state: State of program
     :param curr_command: Command to execute
     """
     if curr_command.operation == Operation.NO_OP:
+        curr_command.finish(CommandStatus.SUCCESS)
         return state
     elif curr_command.operation == Operation.PWR_SUPPLY_CMD or \
         curr_command.operation == Operation.SERIAL_CMD or \
@@ -84,137 +239,282 @@ async def execute_command(state, curr_command):
         curr_command.operation == Operation.ENABLE or\
         curr_command.operation == Operation.BOOTED_FORCE:
         logging.info(f'COMMAND RECEIVED: {str(curr_command)}')
-        stack, comp = state['hil'].get_component_cmdstack(curr_command.target)
         try:
+            stack, comp = state['hil'].get_component_cmdstack(curr_command.target)
             # Inform stack command is being sent
             if stack is not None:
                 for upper_comp in stack:
                     await upper_comp.command_callstack(curr_command)
             # Send command to component
-            await comp.command(operation=curr_command.operation, options=curr_command.options)
+            value = await comp.command(operation=curr_command.operation, options=curr_command.options)
+            curr_command.finish(CommandStatus.SUCCESS, value=value)
             return state
-        except CommandWarning:
+        except CommandWarning as e:
             log.warning(f'FAILED COMMAND {curr_command}')
+            curr_command.finish(CommandStatus.WARNING, warning=str(e))
     else:
-        RuntimeError(f'Operation {curr_command.operation} not recognized.')
+        curr_command.finish(CommandStatus.ERROR, warning=f'Operation {curr_command.operation} not recognized.')
 
-def tags_compute(name):
-    tags = name.split('.')
-    if len(tags) == 2:
-        return (tags[-1], {
-            'HIL': tags[0]
-        })
-    elif len(tags) == 3:
-        return (tags[-1], {
-            'HIL': tags[0],
-            'VCU': tags[1],
-        })
+async def command_loop(state):
+    """
+    Coroutine that hands commands to the dispatcher as soon as they arrive.  Each VCU has its own worker, so
+    commands for different VCUs run at the same time and commands for one VCU keep their order.  Sequences and
+    broadcasts run as tasks of their own, queueing their commands like any other, and so do waits on telemetry
+    (which would otherwise hold up their VCU's worker).
+
+    :param state: State of program
+    """
+    cmd_queue = state['command_queue']
+    dispatcher = state['dispatcher']
+    background = set()
+    while not state['done']:
+        curr_command = await cmd_queue.get()
+        log.debug(f'Dispatching command {curr_command}')
+        if curr_command.operation == Operation.SEQUENCE:
+            task = asyncio.create_task(run_sequence(state, curr_command))
+        elif curr_command.operation == Operation.WAIT_ON_VAR:
+            task = asyncio.create_task(wait_on_var(state, curr_command))
+        elif curr_command.is_broadcast():
+            task = dispatch_broadcast(state, curr_command)
+        else:
+            dispatcher.submit(curr_command)
+            continue
+        if task is not None:
+            background.add(task)
+            task.add_done_callback(background.discard)
+
+
+async def run_sequence(state, cmd):
+    """
+    Run a SEQUENCE command's steps (see hilcode.sequence), reporting progress on the command as each step starts
+    and finishes.
+
+    :param state: State of program
+    :param cmd: SEQUENCE command
+    """
+    cmd.start()
+    logging.info(f'SEQUENCE RECEIVED: {str(cmd)}')
+    try:
+        sequence = Sequence.from_options(cmd.options, target=cmd.target)
+        sequence.check_channels(state['hil'])
+        result = await sequence.run(state['command_queue'].put_nowait, state['hil'], progress=cmd.progress)
+    except CommandWarning as e:
+        log.warning(f'FAILED COMMAND {cmd}')
+        cmd.finish(CommandStatus.WARNING, warning=str(e))
+    except Exception as e:
+        log.exception(f'COMMAND ERROR {cmd}')
+        cmd.finish(CommandStatus.ERROR, warning=f'{type(e).__name__}: {e}')
     else:
-        return (tags[-1], {
-            'HIL': tags[0],
-            'VCU': tags[1],
-            'subcomponent': tags[2],
-        })
+        cmd.finish(result.status, warning=result.warning, value=result.value)
 
 
-# Loop (every second)
-async def run(state):
+def dispatch_broadcast(state, cmd):
     """
-    Function that runs once per second.  If it takes longer, blocks next call for run().
+    Split a broadcast command into one command per target and queue them all at once, so they run at the same time
+    on their VCUs' workers (and keep their place in order with other commands to those VCUs).
 
-    :param state: State of program, can be manipulated by function.
-    :return: Manipulated state
+    :param state: State of program
+    :param cmd: Broadcast command
+    :return: Task that finishes the broadcast command once every target has, or None if nothing matched
     """
-    # Setup
-    hil = state['hil']
-    log_filename = state['log_filename']
+    cmd.start()
+    try:
+        targets = state['hil'].expand_targets(cmd.target)
+    except RoutingError as e:
+        log.warning(f'FAILED COMMAND {cmd}')
+        cmd.finish(CommandStatus.WARNING, warning=str(e))
+        return None
+    commands = cmd.fan_out(targets)
+    for target_command in commands:
+        state['dispatcher'].submit(target_command)
+    return asyncio.create_task(finish_broadcast(cmd, commands))
+
+
+async def finish_broadcast(cmd, commands):
+    """
+    Wait for every target of a broadcast command, then finish it with their combined result.
 
-    cmd_queue = state['command_queue']
-    tlm_queue = state['telemetry_queue']
+    :param cmd: Broadcast command
+    :param commands: Its per target commands
+    """
+    results = await asyncio.gather(*(target_command.wait(COMMAND_TIMEOUT) for target_command in commands))
+    combined = CommandResult.combine(cmd.command_id, {target_command.target: result
+                                                      for target_command, result in zip(commands, results)})
+    cmd.finish(combined.status, warning=combined.warning, value=combined.value)
 
-    # Send Commands
-    if not cmd_queue.empty():
-        curr_command = cmd_queue.get_nowait()
+
+async def wait_on_var(state, cmd):
+    """
+    Wait until a telemetry channel meets a condition, finishing the command on the sample that meets it.  Options
+    are {'channel': name, 'op': operator, 'value': value, 'timeout': seconds}, the channel is named relative to
+    the command's target (or the HIL if target is empty), like 'vcu_state' with target 'leonardo' or
+    'hia.serial_out' with target 'leonardo' (see HIL.find_channel).  Operators are ==, !=, <, <=, >, >= and match
+    (regular expression on string channels).  A channel that doesn't exist fails right away.
+
+    :param state: State of program
+    :param cmd: WAIT_ON_VAR command
+    """
+    cmd.start()
+    options = cmd.options if isinstance(cmd.options, dict) else {}
+    name = channel_path(cmd.target, options.get('channel'))
+    try:
+        predicate = ChannelPredicate.from_options(options)
+        timeout = float(options.get('timeout', COMMAND_TIMEOUT))
+    except CommandWarning as e:
+        cmd.finish(CommandStatus.WARNING, warning=str(e))
+        return
+    except (TypeError, ValueError):
+        cmd.finish(CommandStatus.WARNING, warning='WAIT_ON_VAR timeout is not a number')
+        return
+    channel = state['hil'].find_channel(name)
+    if channel is None:
+        cmd.finish(CommandStatus.WARNING, warning=f'No telemetry channel {name}')
+        return
+    met, timestamp, value = await wait_for_channel(channel, predicate, timeout)
+    result = {'channel': name, 'timestamp': timestamp, 'value': value}
+    if met:
+        cmd.finish(CommandStatus.SUCCESS, value=result)
     else:
-        curr_command = Command(operation=Operation.NO_OP)
+        cmd.finish(CommandStatus.TIMEOUT, value=result,
+                   warning=f'{name} {predicate} not met after {timeout}s (last value {value!r})')
 
-    log.debug(f'Executing command {curr_command}')
-    state = await execute_command(state, curr_command)
 
-    await hil.check_state()
+async def publish_telemetry(state):
+    """
+    Drain telemetry gathered since last call, and send it to the HTTP queue and influx.
 
-    # Acquire Data for next cycle
-    log.debug('Command complete, now getting telemetry')
-    await hil.gather_telemetry()
-    ts_data = hil.telemetry.timestamped_data()
+    :param state: State of program
+    """
+    hil = state['hil']
+    tlm_queue = state['telemetry_queue']
+
+    # One pass over the telemetry tree, each record goes to every consumer stage
+    grouper = TimestampGrouper()
+    hil.telemetry.drain_to(grouper, state['influx_writer'])
+    ts_data = grouper.data
     log.debug('Telemetry Got')
-    log.debug(pprint.pformat(ts_data))
+    if log.isEnabledFor(logging.DEBUG):
+        # Formatting every point is expensive, only pay for it when it is logged
+        log.debug(pprint.pformat(ts_data))
 
     log.debug('Telem to http')
     # Telem Out
     if tlm_queue.full():
         tlm_queue.get_nowait()
     tlm_queue.put_nowait(ts_data)
-    log.debug('Telem to file')
-
-    # Write telem to influx
-    for timestamp, tpoints in ts_data.items():
-        for tpoint in tpoints:
-            name, tags = tags_compute(tpoint['name'])
-            if tpoint['type'] == 'unit':
-                value = float(tpoint['value'])
-            elif tpoint['type'] =='string':
-                value = str(tpoint['value'])
-            elif tpoint['type'] == 'boolean':
-                value = bool(tpoint['value'])
-            else:
-                raise RuntimeError('type not recognized')
-            ts_data_influx = [{
-                'time': datetime.datetime.utcfromtimestamp(timestamp).isoformat(),
-                'fields': {
-                    'value': value
-                },
-                'measurement': name,
-                'tags': tags,
-            }]
-            influx_client = InfluxDBClient('localhost', 8086, 'vcuhil', 'vcuhil_password123', 'vcuhil')
-            influx_client.write_points(ts_data_influx)
-
-    # Return state for next processing round
-    log.debug('End cycle')
-    return state
+    state['telemetry_broadcaster'].publish(ts_data)
 
 
-async def json_server(reader, writer):
+def _message_id(message):
     """
-    JSON command socket server.
+    Correlation id a client sent with a command message.
 
-    :param reader: Socket stream reader
-    :param writer: Socket stream writer
+    :param message: Decoded JSON command message
+    :return: Correlation id, or None if message has none
+    """
+    return message.get('id') if isinstance(message, dict) else None
+
+
+def _is_one_shot(data):
+    """
+    Is a raw command message one-shot (sent without a correlation id, see json_server)?
+
+    :param data: Raw message bytes
+    :return: True/False if message is one-shot
+    """
+    try:
+        return _message_id(json.loads(data)) is None
+    except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+        return True
+
+
+async def handle_command_message(message, cmd_queue, progress=None):
+    """
+    Parse one JSON command message and queue it.  With "wait": true the reply is sent once the command has finished
+    (or "timeout" seconds have passed), as ['DONE', result dictionary] (see CommandResult.to_dict).
+
+    :param message: JSON command string
+    :param cmd_queue: Command queue
+    :param progress: (optional) Function called as progress(correlation id, progress dictionary) while a waited on
+                     command (like a SEQUENCE) runs
+    :return: Tuple of (correlation id or None, reply list), commands sent without an id are tracked and reported
+             under a service assigned one, but still return None
     """
-    data = await reader.readline()
-    cmd_queue = command_queue.get()
     try:
-        message = data.decode()
         command_options = json.loads(message)
+    except json.decoder.JSONDecodeError:
+        return None, ['INVALID JSON']
+    command_id = _message_id(command_options)
+    try:
         cmd = Command(
             operation=Operation(command_options['operation']),
             options=command_options['options'],
-            target=command_options['target']
+            target=command_options['target'],
+            command_id=command_id if command_id is not None else f'{SERVER_ID_PREFIX}{next(SERVER_COMMAND_IDS)}'
         )
-        await cmd_queue.put(cmd)
-        data = ['ACK']
-        writer.write(json.dumps(data).encode())
-    except json.decoder.JSONDecodeError:
-        data = ['INVALID JSON']
-        writer.write(json.dumps(data).encode())
-    except KeyError:
-        data = ['INVALID CMD']
-        writer.write(json.dumps(data).encode())
-    except ValueError:
-        data = ['INVALID CMD']
-        writer.write(json.dumps(data).encode())
+        wait = bool(command_options.get('wait', False))
+        max_timeout = SEQUENCE_TIMEOUT if cmd.operation == Operation.SEQUENCE else COMMAND_TIMEOUT
+        timeout = min(float(command_options.get('timeout', max_timeout)), max_timeout)
+    except (KeyError, ValueError, TypeError):
+        return command_id, ['INVALID CMD']
+    cmd.track()
+    if wait and progress is not None:
+        cmd.on_progress(lambda report: progress(command_id, report))
+    await cmd_queue.put(cmd)
+    if not wait:
+        return command_id, ['ACK']
+    result = await cmd.wait(timeout)
+    return command_id, ['DONE', result.to_dict()]
+
+
+async def json_server(reader, writer):
+    """
+    JSON command socket server.
+
+    A message without an 'id' is one-shot: one command, one bare reply, connection closed.  Messages with an 'id'
+    keep the connection open for more newline-delimited commands, each reply is {'id': id, 'result': reply}
+    followed by a newline.  On a persistent connection commands are handled concurrently, so replies to waiting
+    commands can come back in a different order than the commands were sent, and a waited on command can send
+    {'id': id, 'result': ['PROGRESS', progress dictionary]} lines before its reply.
+
+    :param reader: Socket stream reader
+    :param writer: Socket stream writer
+    """
+    cmd_queue = command_queue.get()
+    persistent = False
+    pending = set()
+
+    def send_progress(command_id, report):
+        # One-shot commands (no id) only get their reply
+        if command_id is not None and not writer.is_closing():
+            writer.write(f'{json.dumps({"id": command_id, "result": ["PROGRESS", report]})}\n'.encode())
+
+    async def reply_to(message):
+        command_id, reply = await handle_command_message(message, cmd_queue, progress=send_progress)
+        writer.write(f'{json.dumps({"id": command_id, "result": reply})}\n'.encode())
+        await writer.drain()
+
+    try:
+        while True:
+            data = await reader.readline()
+            if not data:
+                break
+            if not persistent:
+                if _is_one_shot(data):
+                    _, reply = await handle_command_message(data.decode(), cmd_queue, progress=send_progress)
+                    writer.write(json.dumps(reply).encode())
+                    break
+                # Even the first command is handled concurrently, so one waiting for completion doesn't hold up
+                # commands pipelined behind it
+                persistent = True
+            task = asyncio.create_task(reply_to(data.decode()))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    except ConnectionError:
+        pass
     finally:
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
         writer.close()
 
 @routes.get('/')
@@ -231,10 +531,145 @@ async def handler(request):
         tl.append(await tlm_queue.get())
     return web.json_response(tl)
 
+def _cursor(request):
+    """
+    Resume cursor from a telemetry request, from the 'cursor' query parameter or an SSE Last-Event-ID header.
+
+    :param request: Request to HTTP
+    :return: Cursor (int), or None if not given
+    """
+    cursor = request.query.get('cursor', request.headers.get('Last-Event-ID'))
+    if cursor is None:
+        return None
+    try:
+        return int(cursor)
+    except ValueError:
+        raise web.HTTPBadRequest(text='cursor must be an integer')
+
+def _poll_timeout(request):
+    """
+    Seconds a telemetry poll may wait, from the 'timeout' query parameter, at most POLL_TIMEOUT.
+
+    :param request: Request to HTTP
+    :return: Timeout (float)
+    """
+    try:
+        timeout = float(request.query.get('timeout', POLL_TIMEOUT))
+    except ValueError:
+        raise web.HTTPBadRequest(text='timeout must be a number')
+    if not 0 <= timeout:
+        raise web.HTTPBadRequest(text='timeout must not be negative')
+    return min(timeout, POLL_TIMEOUT)
+
+@routes.get('/telemetry')
+async def poll_handler(request):
+    """
+    HTTP Request Handler, for telemetry newer than a cursor.  Doesn't take data away from other consumers.
+    Waits up to 'timeout' seconds if nothing is newer than cursor yet.
+
+    :param request: Request to HTTP
+    :return: JSON response of [{'cursor': int, 'data': timestamped data}], with X-Telemetry-Cursor,
+             X-Telemetry-Dropped and X-Telemetry-Reset (1 if cursor couldn't be resumed from, everything held is
+             returned) headers.
+    """
+    broadcaster = service_state.get()['telemetry_broadcaster']
+    cursor = _cursor(request)
+    if cursor is None:
+        cursor = broadcaster.seq
+    timeout = _poll_timeout(request)
+    entries, missed, reset = await broadcaster.wait_since(cursor, timeout)
+    return web.json_response(
+        [{'cursor': seq, 'data': data} for seq, data in entries],
+        headers={
+            'X-Telemetry-Cursor': str(entries[-1][0] if entries else broadcaster.seq),
+            'X-Telemetry-Dropped': str(missed),
+            'X-Telemetry-Reset': str(int(reset)),
+        })
+
+@routes.get('/stream')
+async def stream_handler(request):
+    """
+    HTTP Request Handler, for streaming telemetry as server sent events.  Every subscriber has its own buffer.
+    Event ids are cursors, reconnecting with Last-Event-ID (or ?cursor=) resumes after that event, or replays
+    everything held (X-Telemetry-Reset header is 1) if that event is gone or from before a restart.
+
+    :param request: Request to HTTP
+    :return: Event stream response.
+    """
+    broadcaster = service_state.get()['telemetry_broadcaster']
+    subscriber = broadcaster.subscribe(_cursor(request))
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Telemetry-Dropped': str(subscriber.dropped),
+        'X-Telemetry-Reset': str(int(subscriber.reset)),
+    })
+    await response.prepare(request)
+    reported_dropped = subscriber.dropped
+    try:
+        while True:
+            entries = await subscriber.get()
+            if subscriber.dropped != reported_dropped:
+                reported_dropped = subscriber.dropped
+                await response.write(f'event: dropped\ndata: {json.dumps({"dropped": reported_dropped})}\n\n'.encode())
+            for seq, data in entries:
+                await response.write(f'id: {seq}\nevent: telemetry\ndata: {json.dumps(data)}\n\n'.encode())
+    except ConnectionResetError:
+        pass
+    finally:
+        broadcaster.unsubscribe(subscriber)
+    return response
+
+@routes.get('/latest')
+async def latest_handler(request):
+    """
+    HTTP Request Handler, for the latest point of every telemetry channel.  Doesn't take data away from other
+    consumers.  Channels are named by target path, the same names WAIT_ON_VAR takes ('leonardo.hia.serial_out',
+    not the telemetry keeper path 'leonardo.micro_hia.serial_out').
+
+    :param request: Request to HTTP
+    :return: JSON response of {channel name: point}.
+    """
+    return web.Response(text=service_state.get()['telemetry_cache'].json(), content_type='application/json')
+
+@routes.get('/latest/{pattern}')
+async def latest_pattern_handler(request):
+    """
+    HTTP Request Handler, for the latest point of one telemetry channel ('leonardo.psu.pri_meas_curr'), a glob of
+    channels ('*.vcu_state') or every channel of a VCU or component ('leonardo', 'leonardo.hia'), by target path
+    like command targets.
+
+    :param request: Request to HTTP
+    :return: JSON response of {channel name: point}, 404 if nothing matches.
+    """
+    body = service_state.get()['telemetry_cache'].json(request.match_info['pattern'])
+    if body is None:
+        raise web.HTTPNotFound(text=f'No telemetry channels match {request.match_info["pattern"]}')
+    return web.Response(text=body, content_type='application/json')
+
+@routes.get('/stats')
+async def stats_handler(request):
+    """
+    HTTP Request Handler, for service statistics (job timing, command queues, influx writer counters, setup
+    report, latest-value cache counters)
+
+    :param request: Request to HTTP
+    :return: JSON response.
+    """
+    state = service_state.get()
+    return web.json_response({
+        'jobs': state['scheduler'].stats(),
+        'commands': state['dispatcher'].stats(),
+        'influx': state['influx_writer'].stats(),
+        'setup': state['hil'].setup_reports(),
+        'loop': state['loop_monitor'].stats(),
+        'cache': state['telemetry_cache'].stats(),
+    })
+
 # Main Function
 async def main(args):
     """
-    Runs setup() function once, then every second runs 'run' function.
+    Runs setup() function once, then runs periodic jobs and commands until done.
 
     :param args: Arguments from argparse
     :return: N/A
@@ -243,6 +678,7 @@ async def main(args):
     state = await setup(args)
     command_queue.set(state['command_queue'])
     telemetry_queue.set(state['telemetry_queue'])
+    service_state.set(state)
 
     # Command Server Setup
     cmd_factory = await asyncio.start_server(json_server, *('localhost', args['parser_port']))
@@ -257,30 +693,28 @@ async def main(args):
 
     log.debug(f'Starting up json server on port {args["parser_port"]}')
 
-    timeout_count = 0
-    # Main loop
+    # Main loop, each job runs at its own rate and commands run as they arrive
+    scheduler = state['scheduler']
+    await scheduler.start()
+    await state['loop_monitor'].start()
+    cmd_task = asyncio.create_task(command_loop(state))
     try:
         while not state['done']:
-            log.debug('Launching new task')
-            task = asyncio.create_task(run(state))
-            log.debug('Waiting for Task to end')
             await asyncio.sleep(CYCLE_TIME)
-            log.debug('Task should have ended by now....')
-            while not task.done():
-                timeout_count += 1
-                log.debug('Task did not end, wait for it to end')
-                await asyncio.sleep(CYCLE_TIME)
-                if timeout_count > 100:
-                    log.warning('Task blocked too long, waited timeout period')
-                    task.cancel()
-            log.debug('Task Complete, saving results')
-            state = task.result()
     except asyncio.CancelledError as e:
         raise e
+    finally:
+        cmd_task.cancel()
+        await state['dispatcher'].close()
+        await scheduler.close()
+        await state['loop_monitor'].close()
+        if state['simulator'] is not None:
+            await state['simulator'].close()
 
     # No longer running, 'done' called
     log.info('Service Terminated')
     cmd_factory.close()
+    await state['influx_writer'].close()
     sys.exit(0) # Terminated properly
 
 
@@ -300,6 +734,18 @@ if __name__ == '__main__':
         '--telem_port',
         default=6666
     )
+    parser.add_argument(
+        '--simulate',
+        type=int,
+        default=0,
+        help='Run against this many simulated VCUs instead of the hardware in hil_config'
+    )
+    parser.add_argument(
+        '--line_rate',
+        type=float,
+        default=LINE_RATE,
+        help='Serial lines per second per simulated console'
+    )
     args = parser.parse_args()
     try:
         asyncio.run(main(vars(args)), debug=DEBUG)